@@ -175,6 +175,27 @@ if not DEBUG:
     # Use simpler storage for serverless to avoid manifest missing errors
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
+# Global cold-start category model, written by `manage.py train_global_category_model`
+GLOBAL_CATEGORY_MODEL_PATH = os.environ.get(
+    'GLOBAL_CATEGORY_MODEL_PATH', str(BASE_DIR / 'global_category_model.bin')
+)
+
+# Asynchronous exports (wallet.ExportJob): files are written by `manage.py run_export_worker`
+# to this storage; any Django storage backend works (e.g. S3 via django-storages).
+# The worker and every web instance must see the same files. On Vercel each instance has
+# its own /tmp, so there EXPORT_STORAGE_BACKEND must name a shared backend: with a local
+# FileSystemStorage export jobs and cached exports fail with ImproperlyConfigured
+EXPORT_STORAGE_MUST_BE_SHARED = 'VERCEL' in os.environ
+EXPORT_STORAGE = {
+    'BACKEND': os.environ.get('EXPORT_STORAGE_BACKEND', 'django.core.files.storage.FileSystemStorage'),
+    'OPTIONS': {'location': os.environ.get('EXPORT_STORAGE_LOCATION', str(BASE_DIR / 'exports'))},
+}
+# A completed job for the same user, type and filters is reused for this long
+EXPORT_JOB_REUSE_SECONDS = int(os.environ.get('EXPORT_JOB_REUSE_SECONDS', 600))
+# Rendered exports are cached in the same storage (wallet.export_cache); least recently
+# downloaded files are evicted once the cache grows past this many bytes
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from admin_auto_filters.filters import AutocompleteFilter
-from .models import Transaction, Budget, FixedExpense, Category, VisionEntity, GamificationStats
+from .models import Transaction, Budget, FixedExpense, Category, VisionEntity, GamificationStats, ExportJob, FirebaseMigrationCheckpoint
 
 class UserFilter(AutocompleteFilter):
     title = 'User'
@@ -46,3 +46,19 @@ class GamificationStatsAdmin(admin.ModelAdmin):
     list_filter = (UserFilter,)
     search_fields = ('user__username',)
     autocomplete_fields = ['user']
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'export_type', 'status', 'file_size', 'created_at', 'finished_at', 'user')
+    list_filter = ('export_type', 'status', UserFilter)
+    search_fields = ('user__username',)
+    readonly_fields = ('filters_hash', 'file_name', 'file_size', 'error', 'started_at', 'finished_at')
+    autocomplete_fields = ['user']
+
+@admin.register(FirebaseMigrationCheckpoint)
+class FirebaseMigrationCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('user', 'firebase_uid', 'status', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'user__email', 'firebase_uid')
+    readonly_fields = ('counts', 'error', 'updated_at')
+    autocomplete_fields = ['user']
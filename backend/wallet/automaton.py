@@ -0,0 +1,111 @@
+import re
+import unicodedata
+from collections import deque
+
+
+def normalize_phrase(text):
+    """
+    Lowercases, strips accents and replaces punctuation with single spaces,
+    so "Farmacias  del Ahorro, S.A." and "farmacias del ahorro s a" compare equal.
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^a-z0-9ñ\s]', ' ', text).split())
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over whole-word (possibly multi-word) keywords.
+
+    Keywords and searched text go through `normalize_phrase()` and are padded
+    with spaces, so "uber" matches "pago uber mx" but not "suberbio". A search
+    is linear in the length of the text, whatever the number of keywords.
+
+    With `whole_words=False` and another `normalize` (e.g. `str.lower`) it
+    becomes a plain substring matcher whose spans index the text as given.
+    """
+
+    def __init__(self, keywords=(), normalize=normalize_phrase, whole_words=True):
+        self._normalize = normalize
+        self._pad = ' ' if whole_words else ''
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for keyword, value in keywords:
+            self.add(keyword, value)
+        self.build()
+
+    def __len__(self):
+        return sum(1 for outputs in self._out for _ in outputs)
+
+    def add(self, keyword, value):
+        pattern = self._normalize(keyword)
+        if not pattern:
+            return
+        pattern = f'{self._pad}{pattern}{self._pad}'
+
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((len(pattern), value))
+
+    def build(self):
+        """
+        Computes failure links breadth-first. Must be called after the last
+        `add()`; the constructor does it for the keywords it receives.
+        """
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """
+        Yields every (start, end, value) match over the padded normalized text,
+        overlapping ones included. Spans exclude the padding spaces and refer
+        to the normalized text.
+        """
+        pad = len(self._pad)
+        padded = f'{self._pad}{self._normalize(text or "")}{self._pad}'
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(padded):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in out[state]:
+                # Shift by the text's leading pad and trim the pattern's own pads
+                yield i - length + 1, i + 1 - 2 * pad, value
+
+    def search(self, text):
+        """
+        Returns the leftmost-longest non-overlapping matches as a list of
+        (start, end, value), so "uber eats" wins over "uber".
+        """
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = -1
+        for start, end, value in matches:
+            if start >= last_end:
+                selected.append((start, end, value))
+                last_end = end
+        return selected
@@ -0,0 +1,305 @@
+import datetime
+import gzip
+import io
+import json
+import zlib
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction as db_transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from .exporters import EXPORT_CHUNK_SIZE, _buffered, _gzipped
+from .fingerprints import fingerprint_for
+from .ml import reset_category_model
+from .models import Budget, Category, FixedExpense, GamificationStats, Transaction, VisionEntity
+from .nlp import discard_parsing_context
+from .signals import suppress_balance_signals
+
+BACKUP_FORMAT = 'flowcash-backup'
+BACKUP_VERSION = 1
+
+# Rows per INSERT while restoring
+RESTORE_BATCH_SIZE = 2000
+
+# Rows per UPDATE that puts back the backed up timestamps
+TIMESTAMP_UPDATE_BATCH = 200
+
+# Record names in dependency order: a backup lists them in this order and a
+# restore inserts them in it, so references always point backwards
+BACKUP_MODELS = [
+    ('category', Category),
+    ('vision_entity', VisionEntity),
+    ('budget', Budget),
+    ('fixed_expense', FixedExpense),
+    ('gamification_stats', GamificationStats),
+    ('transaction', Transaction),
+]
+
+# Transaction fields holding a VisionEntity pk as a string
+ENTITY_REFERENCE_FIELDS = ('related_entity_id', 'transfer_related_entity_id')
+
+
+class _BackupEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeps only milliseconds; a backup keeps every digit."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def backup_fields(model):
+    """
+    Plain data fields of a model: everything but the pk, relations (user,
+    budget) and non-editable fields. Fingerprints are computed again on
+    restore; auto timestamps are backed up apart (`timestamp_fields`).
+    """
+    return [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key and not field.is_relation and field.editable
+    ]
+
+
+def timestamp_fields(model):
+    """
+    The model's auto_now / auto_now_add fields (created_at, updated_at).
+    They are backed up with the data fields and set again after the insert,
+    which would otherwise stamp every row with the restore time.
+    """
+    return [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+
+
+def _backup_querysets(user):
+    return {
+        'category': Category.objects.filter(user=user),
+        'vision_entity': VisionEntity.objects.filter(user=user),
+        'budget': Budget.objects.filter(user=user),
+        'fixed_expense': FixedExpense.objects.filter(budget__user=user),
+        'gamification_stats': GamificationStats.objects.filter(user=user),
+        'transaction': Transaction.objects.filter(user=user),
+    }
+
+
+def backup_lines(user):
+    """
+    Yields the backup as JSON lines: a header, one {"model", "id", "fields"}
+    record per row (read from server-side cursors) and a trailer with the
+    counts, whose absence marks a truncated file.
+    """
+    encoder = _BackupEncoder(separators=(',', ':'), ensure_ascii=False)
+    yield encoder.encode({
+        'format': BACKUP_FORMAT,
+        'version': BACKUP_VERSION,
+        'created_at': timezone.now(),
+        'username': user.username,
+    }) + '\n'
+
+    querysets = _backup_querysets(user)
+    counts = {}
+    for name, model in BACKUP_MODELS:
+        names = [field.attname for field in backup_fields(model) + timestamp_fields(model)]
+        rows = querysets[name].order_by('pk').values_list('pk', *names).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        count = 0
+        for row in rows:
+            yield encoder.encode({'model': name, 'id': row[0], 'fields': dict(zip(names, row[1:]))}) + '\n'
+            count += 1
+        counts[name] = count
+
+    yield encoder.encode({'end': True, 'counts': counts}) + '\n'
+
+
+def backup_chunks(user):
+    """The gzip-compressed backup as a stream of byte chunks."""
+    return _gzipped(_buffered(backup_lines(user)))
+
+
+def write_backup(user, output):
+    for chunk in backup_chunks(user):
+        output.write(chunk)
+
+
+def _read_records(fileobj):
+    """
+    Yields (model name, old pk, fields) from a gzip-compressed backup,
+    checking the header, the model order and the trailer counts.
+    """
+    order = {name: position for position, (name, _) in enumerate(BACKUP_MODELS)}
+    try:
+        lines = io.TextIOWrapper(gzip.GzipFile(fileobj=fileobj, mode='rb'), encoding='utf-8')
+        header = json.loads(next(lines, 'null'))
+        if not isinstance(header, dict) or header.get('format') != BACKUP_FORMAT:
+            raise ValueError("Not a flowcash backup")
+        if header.get('version') != BACKUP_VERSION:
+            raise ValueError(f"Unsupported backup version: {header.get('version')}")
+
+        position = 0
+        counts = dict.fromkeys(order, 0)
+        for line in lines:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Invalid backup record")
+            if record.get('end'):
+                if record.get('counts') != counts:
+                    raise ValueError("Backup counts do not match its records")
+                return
+            name = record.get('model')
+            if name not in order or order[name] < position:
+                raise ValueError(f"Unexpected record: {name}")
+            position = order[name]
+            counts[name] += 1
+            yield name, record.get('id'), record.get('fields') or {}
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Unreadable backup: {e}")
+    raise ValueError("Backup is truncated")
+
+
+# Models holding the account data a restore replaces (FixedExpense goes with its Budget)
+ACCOUNT_DATA_MODELS = (Transaction, VisionEntity, Category, Budget, GamificationStats)
+
+
+def _has_account_data(user):
+    return any(model.objects.filter(user=user).exists() for model in ACCOUNT_DATA_MODELS)
+
+
+def _delete_account_data(user):
+    # Ninguna tabla referencia a Transaction, así que se borra con un DELETE en
+    # SQL: delete() cargaría cada fila para enviar sus señales, que aquí sobran
+    # (los saldos vienen del respaldo y los conteos del predictor se reconstruyen)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(Transaction._meta.db_table)} WHERE {quote('user_id')} = %s", [user.pk]
+        )
+    for model in ACCOUNT_DATA_MODELS[1:]:
+        model.objects.filter(user=user).delete()
+
+
+class _Restore:
+    """State of one restore: pending rows of the current model and the pk remaps."""
+
+    def __init__(self, user):
+        self.user = user
+        self.models = dict(BACKUP_MODELS)
+        self.fields = {name: backup_fields(model) for name, model in BACKUP_MODELS}
+        self.timestamp_fields = {name: timestamp_fields(model) for name, model in BACKUP_MODELS}
+        self.counts = dict.fromkeys(self.models, 0)
+        self.counts['unlinked_references'] = 0
+        self.entity_ids = {}  # pk antiguo (str) -> pk nuevo (str)
+        self.budget = None
+        self.pending = []  # [(model name, old pk, unsaved instance, {timestamp attname: value})]
+
+    def add(self, name, old_id, values):
+        if self.pending and self.pending[0][0] != name:
+            self.flush()
+        try:
+            data = {
+                field.attname: field.to_python(values[field.attname]) if field.attname in values else field.get_default()
+                for field in self.fields[name]
+            }
+            timestamps = {
+                field.attname: field.to_python(values[field.attname])
+                for field in self.timestamp_fields[name] if values.get(field.attname)
+            }
+        except ValidationError as e:
+            raise ValueError(f"Invalid {name} record {old_id}: {e.messages}")
+
+        if name == 'transaction':
+            for reference in ENTITY_REFERENCE_FIELDS:
+                if data[reference]:
+                    mapped = self.entity_ids.get(data[reference])
+                    self.counts['unlinked_references'] += mapped is None
+                    data[reference] = mapped
+        if name == 'fixed_expense':
+            if self.budget is None:
+                raise ValueError("Fixed expense without a budget")
+            obj = FixedExpense(budget=self.budget, **data)
+        else:
+            obj = self.models[name](user=self.user, **data)
+        if name == 'transaction':
+            obj.fingerprint = fingerprint_for(obj)
+
+        self.pending.append((name, old_id, obj, timestamps))
+        if len(self.pending) >= RESTORE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        name = self.pending[0][0]
+        objects = [obj for _, _, obj, _ in self.pending]
+        # Entidades y presupuesto se referencian después: necesitan su pk
+        if name in ('vision_entity', 'budget') and not connection.features.can_return_rows_from_bulk_insert:
+            for obj in objects:
+                obj.save()
+        else:
+            self.models[name].objects.bulk_create(objects, batch_size=RESTORE_BATCH_SIZE)
+
+        self._restore_timestamps(name, [
+            (obj.pk, timestamps) for _, _, obj, timestamps in self.pending if timestamps and obj.pk is not None
+        ])
+
+        if name == 'vision_entity':
+            self.entity_ids.update((str(old_id), str(obj.pk)) for _, old_id, obj, _ in self.pending)
+        elif name == 'budget':
+            self.budget = objects[-1]
+        self.counts[name] += len(objects)
+        self.pending = []
+
+    def _restore_timestamps(self, name, rows):
+        """
+        Puts the backed up timestamps on the inserted rows [(pk, values)]:
+        auto_now and auto_now_add ignore values passed to an insert, but not
+        a queryset update(). One UPDATE with a CASE per field for every
+        TIMESTAMP_UPDATE_BATCH rows.
+        """
+        model = self.models[name]
+        for start in range(0, len(rows), TIMESTAMP_UPDATE_BATCH):
+            batch = rows[start:start + TIMESTAMP_UPDATE_BATCH]
+            updates = {}
+            for field in self.timestamp_fields[name]:
+                whens = [
+                    When(pk=pk, then=Value(values[field.attname]))
+                    for pk, values in batch if field.attname in values
+                ]
+                if whens:
+                    updates[field.attname] = Case(*whens, default=F(field.attname), output_field=field)
+            if updates:
+                model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**updates)
+
+
+def restore_backup(user, fileobj, replace=False):
+    """
+    Restores a backup into `user`'s account in one database transaction.
+
+    Rows are inserted with bulk_create in dependency order and entity
+    references are remapped to the new pks; references to entities missing
+    from the backup are cleared. Backed up created_at / updated_at values
+    are put back afterwards (on backends that return the inserted pks). Balance signals are suppressed: the backed
+    up entity amounts already include every transaction.
+
+    An account with any transactions, entities, categories, budget or
+    gamification stats is only replaced when `replace` is set. Raises ValueError for invalid backups (nothing is
+    written then). Returns the restored counts per model.
+    """
+    restore = _Restore(user)
+    try:
+        with db_transaction.atomic(), suppress_balance_signals():
+            if _has_account_data(user) and not replace:
+                raise ValueError("The account already has data; restore with replace to overwrite it")
+            _delete_account_data(user)
+
+            for name, old_id, values in _read_records(fileobj):
+                restore.add(name, old_id, values)
+            restore.flush()
+
+            # bulk_create no pasa por las señales de conteo del predictor: se
+            # reconstruyen en la primera predicción
+            reset_category_model(user.pk)
+    except IntegrityError as e:
+        raise ValueError(f"Backup does not fit the account: {e}")
+
+    discard_parsing_context(user.pk)
+    return restore.counts
@@ -0,0 +1,81 @@
+import datetime
+import re
+
+# Piezas comunes de las notificaciones (SMS / push) de bancos mexicanos
+AMOUNT = r'\$\s?(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)(?:\s?(?:mxn|m\.n\.|pesos))?'
+# El comercio termina antes de "con", "el", "tarjeta", de puntuación o del fin de línea
+MERCHANT = r'(?P<merchant>[^\s].*?)(?=\s+(?:con|el|tarjeta|tdc|tdd|aut|autorizaci[oó]n)\b|[.,;](?:\s|$)|\s*$)'
+CARD = r'(?:terminaci[oó]n|terminada\s+en|termina\s+en|tarjeta|\*{1,4})\s*(?P<card>\d{4})\b'
+DATE = (
+    r'(?P<date>\d{1,2}/\d{1,2}/\d{2,4}'
+    r'|\d{1,2}[-\s](?:ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)[a-z]*\.?[-\s]\d{2,4})'
+)
+KIND = r'(?P<kind>compra|cargo|retiro|pago|dep[oó]sito|abono|transferencia\s+recibida)'
+TAIL = rf'(?:.*?{CARD})?(?:.*?{DATE})?'
+
+# (banco, patrón) en orden de prueba; el primero que coincide gana
+TEMPLATE_SOURCES = [
+    ('bbva', rf'^\s*bbva\b.*?{KIND}\b.*?por\s+{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+    ('banorte', rf'^\s*banorte\b.*?{KIND}\b.*?por\s+{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+    ('santander', rf'^\s*santander\b.*?{KIND}\b.*?por\s+{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+    ('citibanamex', rf'^\s*(?:citi)?banamex\b.*?{KIND}\b.*?(?:por|de)\s+{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+    ('nu', rf'^\s*(?:nu\b\W*)?compraste\s+{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+    ('spei', rf'(?P<kind>recibiste|abono|dep[oó]sito)\b.*?(?:spei\s+)?(?:de|por)\s+{AMOUNT}(?:\s+de\s+{MERCHANT})?{TAIL}'),
+    ('generic', rf'(?:{KIND}\b.*?)?{AMOUNT}\s+en\s+{MERCHANT}{TAIL}'),
+]
+TEMPLATES = [(bank, re.compile(source, re.IGNORECASE)) for bank, source in TEMPLATE_SOURCES]
+
+INCOME_KINDS = ('deposito', 'depósito', 'abono', 'recibiste', 'transferencia recibida')
+
+MONTHS = {
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'ago': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dic': 12,
+}
+_DATE_PARTS = re.compile(r'(\d{1,2})[/\-\s]([a-z]+|\d{1,2})\.?[/\-\s](\d{2,4})', re.IGNORECASE)
+
+
+def parse_notification_date(value):
+    """
+    "12/03/2024", "12/03/24" o "12 mar 2024" (día primero) -> date, o None
+    si no es una fecha válida.
+    """
+    match = _DATE_PARTS.match(value or '')
+    if not match:
+        return None
+    day, month, year = match.groups()
+    month = MONTHS.get(month[:3].lower()) if month.isalpha() else int(month)
+    year = int(year)
+    if year < 100:
+        year += 2000
+    try:
+        return datetime.date(year, month, int(day))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_bank_notification(text):
+    """
+    Applies the precompiled bank templates to a pasted notification.
+
+    Returns a dict with bank, type, amount, merchant, card_suffix and date
+    (any of the last three may be None), or None if no template matches.
+    """
+    if not text:
+        return None
+
+    for bank, pattern in TEMPLATES:
+        match = pattern.search(text)
+        if not match:
+            continue
+        fields = match.groupdict()
+        kind = (fields.get('kind') or '').lower()
+        merchant = fields.get('merchant')
+        return {
+            'bank': bank,
+            'type': 'income' if kind.startswith(INCOME_KINDS) else 'expense',
+            'amount': float(fields['amount'].replace(',', '')),
+            'merchant': merchant.strip() if merchant else None,
+            'card_suffix': fields.get('card'),
+            'date': parse_notification_date(fields.get('date')),
+        }
+    return None
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import tempfile
+from datetime import datetime
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Count, F, Max, Sum
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from .exporters import (
+    DATED_EXPORT_FORMATS, STREAM_BUFFER_BYTES, TRANSACTION_EXPORT_FORMATS, TRANSACTION_EXPORT_STREAMS,
+    TRANSACTION_EXPORT_VERSIONS, _gzipped,
+)
+from .export_jobs import get_export_storage
+from .models import ExportCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def export_cache_key(user, export_type, filters, transactions):
+    """
+    Digest of (user, export type and its renderer version, normalized
+    filters, data version), where the data version is the row count and
+    newest `updated_at` of the filtered transactions: any create, edit or
+    delete in the exported set changes it. Writes that bypass save()
+    (queryset.update) do not bump `updated_at`. Formats that print the render
+    date add it, so they are rendered again the next day.
+    """
+    version = transactions.order_by().aggregate(count=Count('id'), last_update=Max('updated_at'))
+    last_update = version['last_update'].isoformat() if version['last_update'] else None
+    payload = [
+        user.pk, export_type, TRANSACTION_EXPORT_VERSIONS[export_type], filters, version['count'], last_update,
+    ]
+    if export_type in DATED_EXPORT_FORMATS:
+        payload.append(datetime.now().strftime('%Y-%m-%d'))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_export(key, storage=None):
+    """The cache entry for `key` if its file is still stored (recording the hit), else None."""
+    storage = storage or get_export_storage()
+    entry = ExportCacheEntry.objects.filter(key=key).first()
+    if entry is None:
+        return None
+    if not storage.exists(entry.file_name):
+        entry.delete()  # el archivo desapareció del storage
+        return None
+    ExportCacheEntry.objects.filter(pk=entry.pk).update(last_accessed_at=timezone.now(), hits=F('hits') + 1)
+    return entry
+
+
+def store_export(user, export_type, key, output, storage=None):
+    """
+    Copies a rendered export (the binary file `output`, positioned at its
+    end) into the export storage, records it and trims the cache back under
+    its size limit. Returns the entry, or None if the storage cannot be
+    written: the cache is an optimization and never fails a download.
+    """
+    storage = storage or get_export_storage()
+    size = output.tell()
+    output.seek(0)
+    _, _, extension = TRANSACTION_EXPORT_FORMATS[export_type]
+    try:
+        file_name = storage.save(f"export-cache/{user.pk}/{key}.{extension}", File(output))
+    except Exception:
+        logger.exception("Could not store the %s export in the export cache", export_type)
+        return None
+
+    try:
+        with db_transaction.atomic():
+            entry = ExportCacheEntry.objects.create(
+                key=key, user=user, export_type=export_type, file_name=file_name, size=size
+            )
+    except IntegrityError:
+        # Another request rendered the same export meanwhile; keep theirs
+        storage.delete(file_name)
+        return ExportCacheEntry.objects.get(key=key)
+
+    evict_export_cache(storage, keep=entry.pk)
+    return entry
+
+
+def evict_export_cache(storage=None, max_bytes=None, keep=None):
+    """
+    Deletes least recently downloaded entries (and their files) until the
+    cache fits in EXPORT_CACHE_MAX_BYTES. `keep` (the entry about to be
+    served) is never evicted. Returns how many were evicted.
+    """
+    storage = storage or get_export_storage()
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'EXPORT_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+    total = ExportCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+    evicted = 0
+    for entry in ExportCacheEntry.objects.exclude(pk=keep).order_by('last_accessed_at').iterator():
+        if total <= max_bytes:
+            break
+        storage.delete(entry.file_name)
+        entry.delete()
+        total -= entry.size
+        evicted += 1
+    return evicted
+
+
+def _file_chunks(stored):
+    with stored:
+        yield from iter(lambda: stored.read(STREAM_BUFFER_BYTES), b'')
+
+
+def _stream_and_store(user, export_type, key, chunks, storage):
+    """
+    Passes `chunks` through to the client while copying them to a temp file,
+    which is stored in the cache once the last chunk is sent. A client that
+    disconnects closes the generator early and nothing is cached.
+    """
+    with tempfile.TemporaryFile() as output:
+        for chunk in chunks:
+            output.write(chunk)
+            yield chunk
+        store_export(user, export_type, key, output, storage)
+
+
+def cached_export_response(request, transactions, export_type, filters, filename, compress=False):
+    """
+    Serves an export through the cache with an ETag (the cache key). A client
+    repeating a download with If-None-Match gets a 304 without anything being
+    read or rendered. With `compress` the body is gzipped on the fly.
+
+    On a miss CSV and NDJSON are streamed as they are generated (the cache
+    copy is written alongside); the other formats are rendered into a temp
+    file, stored and served from it.
+
+    Entries live in the export storage, which every instance must share:
+    `get_export_storage` raises ImproperlyConfigured for per-instance disk
+    (Vercel) rather than caching files other instances cannot see.
+    """
+    key = export_cache_key(request.user, export_type, filters, transactions)
+    etag = f'"{key}-gzip"' if compress else f'"{key}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    storage = get_export_storage()
+    write, content_type, _ = TRANSACTION_EXPORT_FORMATS[export_type]
+    entry = get_cached_export(key, storage)
+    streamed = entry is None and export_type in TRANSACTION_EXPORT_STREAMS
+    if entry is not None:
+        body = storage.open(entry.file_name, 'rb')
+    elif streamed:
+        stream = TRANSACTION_EXPORT_STREAMS[export_type](transactions)
+        body = _stream_and_store(request.user, export_type, key, stream, storage)
+    else:
+        body = tempfile.TemporaryFile()
+        write(transactions, body)
+        store_export(request.user, export_type, key, body, storage)
+        body.seek(0)
+
+    if streamed or compress:
+        chunks = body if streamed else _file_chunks(body)
+        response = StreamingHttpResponse(_gzipped(chunks) if compress else chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+    else:
+        response = FileResponse(body, as_attachment=True, filename=filename, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Export-Cache'] = 'hit' if entry is not None else 'miss'
+    return response
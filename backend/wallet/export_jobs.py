@@ -0,0 +1,171 @@
+import hashlib
+import json
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .exporters import TRANSACTION_EXPORT_FORMATS
+from .models import ExportJob, Transaction
+
+# Filters shared by the transaction list, the in-request exports and export jobs
+TRANSACTION_FILTERS = ('type', 'category', 'related_entity_id', 'start_date', 'end_date')
+
+# A job still 'running' after this long is assumed lost with its worker
+STALE_RUNNING_SECONDS = 30 * 60
+
+
+def normalize_transaction_filters(params):
+    """
+    Keeps only the supported filters with a non-empty value, trimmed and with
+    valid dates (YYYY-MM-DD), as a dict with sorted keys. Equivalent requests
+    therefore normalize to the same dict (and the same `filters_digest`).
+    """
+    filters = {}
+    for key in TRANSACTION_FILTERS:
+        value = params.get(key)
+        if value is None:
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+        if key in ('start_date', 'end_date'):
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+            except ValueError:
+                continue
+        filters[key] = value
+    return dict(sorted(filters.items()))
+
+
+def filters_digest(filters):
+    return hashlib.sha256(json.dumps(filters, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def filter_transactions(transactions, filters):
+    """Applies normalized filters; dates are inclusive local dates."""
+    if 'type' in filters:
+        transactions = transactions.filter(type=filters['type'])
+    if 'category' in filters:
+        transactions = transactions.filter(category__iexact=filters['category'])
+    if 'related_entity_id' in filters:
+        transactions = transactions.filter(related_entity_id=filters['related_entity_id'])
+    if 'start_date' in filters:
+        transactions = transactions.filter(date__date__gte=filters['start_date'])
+    if 'end_date' in filters:
+        transactions = transactions.filter(date__date__lte=filters['end_date'])
+    return transactions
+
+
+def get_export_storage():
+    """
+    The storage of export job files and cached exports (settings.EXPORT_STORAGE).
+    Raises ImproperlyConfigured for a local FileSystemStorage when
+    EXPORT_STORAGE_MUST_BE_SHARED is set (Vercel): a file written by one
+    instance would be missing on the one serving the download.
+    """
+    config = getattr(settings, 'EXPORT_STORAGE', {})
+    backend = import_string(config.get('BACKEND', 'django.core.files.storage.FileSystemStorage'))
+    if getattr(settings, 'EXPORT_STORAGE_MUST_BE_SHARED', False) and issubclass(backend, FileSystemStorage):
+        raise ImproperlyConfigured(
+            "EXPORT_STORAGE_BACKEND must be a storage shared by every instance (e.g. S3), not the local disk"
+        )
+    return backend(**config.get('OPTIONS', {}))
+
+
+def enqueue_export_job(user, export_type, filters):
+    """
+    Returns (job, reused). A completed job of the same user, type and
+    filters finished within EXPORT_JOB_REUSE_SECONDS, or one still pending or
+    running, is returned instead of queueing a new one.
+    """
+    if export_type not in TRANSACTION_EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export type: {export_type}")
+    # Sin almacenamiento compartido el worker no podría entregar el archivo
+    storage = get_export_storage()
+
+    filters = normalize_transaction_filters(filters)
+    digest = filters_digest(filters)
+    same = ExportJob.objects.filter(user=user, export_type=export_type, filters_hash=digest)
+
+    now = timezone.now()
+    in_flight = same.filter(
+        Q(status='pending') | Q(status='running', started_at__gte=now - timedelta(seconds=STALE_RUNNING_SECONDS))
+    ).order_by('-created_at').first()
+    if in_flight:
+        return in_flight, True
+
+    reuse_since = now - timedelta(seconds=getattr(settings, 'EXPORT_JOB_REUSE_SECONDS', 600))
+    recent = same.filter(status='completed', finished_at__gte=reuse_since).order_by('-finished_at').first()
+    if recent and storage.exists(recent.file_name):
+        return recent, True
+
+    job = ExportJob.objects.create(user=user, export_type=export_type, filters=filters, filters_hash=digest)
+    return job, False
+
+
+def claim_next_export_job():
+    """
+    Marks the oldest pending job as running and returns it, or None. Rows
+    locked by another worker are skipped, so several workers can share the
+    queue.
+    """
+    with db_transaction.atomic():
+        job = (
+            ExportJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def run_export_job(job, storage=None):
+    """
+    Renders the job's export into a temp file and saves it to the export
+    storage. The job ends up 'completed' (with file_name and file_size) or
+    'failed' (with the error).
+    """
+    storage = storage or get_export_storage()
+    write, _, extension = TRANSACTION_EXPORT_FORMATS[job.export_type]
+    transactions = filter_transactions(
+        Transaction.objects.filter(user_id=job.user_id).order_by('-date'), job.filters
+    )
+    try:
+        with tempfile.TemporaryFile() as output:
+            write(transactions, output)
+            job.file_size = output.tell()
+            output.seek(0)
+            name = f"exports/{job.user_id}/{job.pk}_{timezone.now().strftime('%Y%m%d%H%M%S')}.{extension}"
+            job.file_name = storage.save(name, File(output))
+        job.status = 'completed'
+    except Exception:
+        job.status = 'failed'
+        job.error = traceback.format_exc()[-4000:]
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file_name', 'file_size', 'error', 'finished_at'])
+    return job
+
+
+def process_export_jobs(max_jobs=None):
+    """Runs pending jobs until the queue is empty (or `max_jobs` ran). Returns the count."""
+    storage = get_export_storage()
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_next_export_job()
+        if job is None:
+            break
+        run_export_job(job, storage)
+        processed += 1
+    return processed
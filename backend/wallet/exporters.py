@@ -1,369 +1,534 @@
+import csv
+import json
+import tempfile
+import zlib
+import zipfile
 import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from itertools import islice, zip_longest
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer, Frame
+from reportlab.platypus.doctemplate import LayoutError
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from django.http import HttpResponse
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.http import HttpResponse, FileResponse
+from .models import Transaction
+from .parquet import ParquetColumn, ParquetWriter
 from datetime import datetime
 from io import BytesIO
 
-def export_transactions_to_excel(transactions):
+# Rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Flat exports: bytes accumulated before each chunk is sent (and compressed)
+STREAM_BUFFER_BYTES = 64 * 1024
+
+# Columns of the flat (CSV / NDJSON) transaction exports
+TRANSACTION_EXPORT_FIELDS = (
+    'id', 'date', 'type', 'amount', 'category', 'description', 'payment_type',
+    'related_entity_id', 'transfer_related_entity_id', 'is_recurring', 'recurrence_frequency',
+)
+
+INCOME_COLOR = "2E7D32"  # Dark Green
+EXPENSE_COLOR = "C62828"  # Dark Red
+TABLE_HEADER_COLOR = "37474F"  # Blue Grey
+
+
+def _register_split_styles(workbook):
     """
-    Generates an Excel file from a queryset of transactions with a split view (Income vs Expenses).
+    Registers the named styles of the income/expense split sheets once per
+    workbook; cells then refer to them by name instead of carrying their own
+    Font/Fill/Border objects.
     """
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.title = "Transactions"
+    border_bottom = Border(bottom=Side(style='thin', color="CCCCCC"))
+    thick_top = Border(top=Side(style='medium'))
+    center = Alignment(horizontal='center')
+
+    styles = []
+    for side, color in (('income', INCOME_COLOR), ('expense', EXPENSE_COLOR)):
+        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        styles += [
+            NamedStyle(f'split_header_{side}', font=Font(bold=True, size=12, color="FFFFFF"), fill=fill, alignment=center),
+            NamedStyle(f'split_subheader_{side}', font=Font(bold=True, color="FFFFFF"), fill=fill, alignment=center),
+            NamedStyle(f'split_amount_{side}', font=Font(color=color), border=border_bottom, number_format='#,##0.00'),
+            NamedStyle(f'split_total_{side}', font=Font(bold=True, color=color), border=thick_top, number_format='$#,##0.00'),
+        ]
+    styles += [
+        NamedStyle('split_date', border=border_bottom, alignment=center),
+        NamedStyle('split_text', border=border_bottom),
+        NamedStyle('split_total_label', font=Font(bold=True), border=thick_top),
+        NamedStyle('split_net', font=Font(bold=True, size=14, color="000000"), alignment=center),
+        NamedStyle('split_net_negative', font=Font(bold=True, size=14, color=EXPENSE_COLOR), alignment=center),
+        # Plain tables of the bundle workbook
+        NamedStyle(
+            'table_header', font=Font(bold=True, color="FFFFFF"), alignment=center,
+            fill=PatternFill(start_color=TABLE_HEADER_COLOR, end_color=TABLE_HEADER_COLOR, fill_type="solid"),
+        ),
+        NamedStyle('table_text', border=border_bottom),
+        NamedStyle('table_amount', border=border_bottom, number_format='#,##0.00;[Red]-#,##0.00'),
+    ]
+    for style in styles:
+        workbook.add_named_style(style)
 
-    # Separate data
-    incomes = [t for t in transactions if t.type == 'income']
-    expenses = [t for t in transactions if t.type == 'expense']
 
-    # Styles
-    header_font = Font(bold=True, size=12, color="FFFFFF")
-    sub_header_font = Font(bold=True, color="FFFFFF")
-    
-    green_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid") # Dark Green
-    red_fill = PatternFill(start_color="C62828", end_color="C62828", fill_type="solid") # Dark Red
-    
+def _styled(worksheet, value, style):
+    cell = WriteOnlyCell(worksheet, value=value)
+    cell.style = style
+    return cell
+
+
+def _split_transaction_rows(transactions, transaction_type):
+    """
+    (date, "Category: description", amount) of one side of the split sheet,
+    read from a server-side cursor in EXPORT_CHUNK_SIZE chunks.
+    """
+    rows = transactions.filter(type=transaction_type).values_list(
+        'date', 'category', 'description', 'amount'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for date, category, description, amount in rows:
+        yield date.strftime('%Y-%m-%d') if date else "", f"{category or 'General'}: {description}", amount
+
+
+def _temp_file_response(write, content_type, filename):
+    """
+    Renders through `write(output)` into an anonymous temp file and streams it
+    back, so the generated file is never held in memory.
+    """
+    output = tempfile.TemporaryFile()
+    write(output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
+
+
+def write_transactions_excel(transactions, output):
+    """
+    Writes the income/expense split workbook to the binary file `output`.
+
+    The workbook is write-only: incomes and expenses are read side by side
+    from two cursors and each row is written as soon as it is built, so memory
+    stays flat however many transactions are exported.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    _register_split_styles(workbook)
+    _write_transactions_sheet(workbook, transactions)
+    workbook.save(output)
+
+
+def _write_transactions_sheet(workbook, transactions):
+    worksheet = workbook.create_sheet("Transactions")
+
+    # Column Widths (must be set before the first row is written)
+    for column, width in zip('ABCDEFG', (15, 30, 15, 3, 15, 30, 15)):  # D is a spacer
+        worksheet.column_dimensions[column].width = width
+
     # Main Headers
-    worksheet.merge_cells('A1:C1')
-    cell_a1 = worksheet['A1']
-    cell_a1.value = "INGRESOS (INCOME)"
-    cell_a1.font = header_font
-    cell_a1.fill = green_fill
-    cell_a1.alignment = Alignment(horizontal='center')
-
-    worksheet.merge_cells('E1:G1')
-    cell_e1 = worksheet['E1']
-    cell_e1.value = "GASTOS (EXPENSES)"
-    cell_e1.font = header_font
-    cell_e1.fill = red_fill
-    cell_e1.alignment = Alignment(horizontal='center')
+    worksheet.append([
+        _styled(worksheet, "INGRESOS (INCOME)", 'split_header_income'), None, None, None,
+        _styled(worksheet, "GASTOS (EXPENSES)", 'split_header_expense'), None, None,
+    ])
+    worksheet.merged_cells.add('A1:C1')
+    worksheet.merged_cells.add('E1:G1')
 
     # Sub Headers
-    columns = [
-        ('A', "Fecha", green_fill), ('B', "Descripción", green_fill), ('C', "Monto", green_fill),
-        ('E', "Fecha", red_fill), ('F', "Descripción", red_fill), ('G', "Monto", red_fill)
-    ]
-    
-    for col, title, fill in columns:
-        cell = worksheet[f'{col}2']
-        cell.value = title
-        cell.font = sub_header_font
-        cell.fill = fill
-        cell.alignment = Alignment(horizontal='center')
+    worksheet.append(
+        [_styled(worksheet, title, 'split_subheader_income') for title in ("Fecha", "Descripción", "Monto")]
+        + [None]
+        + [_styled(worksheet, title, 'split_subheader_expense') for title in ("Fecha", "Descripción", "Monto")]
+    )
 
     # Data
-    max_rows = max(len(incomes), len(expenses))
-    
     total_income = 0
     total_expense = 0
-    
-    border_bottom = Border(bottom=Side(style='thin', color="CCCCCC"))
-
-    for i in range(max_rows):
-        row_num = i + 3
-        
-        # Income
-        if i < len(incomes):
-            inc = incomes[i]
-            total_income += inc.amount
-            
-            # Date
-            cell_date = worksheet[f'A{row_num}']
-            cell_date.value = inc.date.strftime('%Y-%m-%d') if inc.date else ""
-            cell_date.border = border_bottom
-            cell_date.alignment = Alignment(horizontal='center')
-
-            # Description (combining Category + Description for context)
-            desc = f"{inc.category or 'General'}: {inc.description}"
-            cell_desc = worksheet[f'B{row_num}']
-            cell_desc.value = desc
-            cell_desc.border = border_bottom
-            
-            # Amount
-            cell_amt = worksheet[f'C{row_num}']
-            cell_amt.value = inc.amount
-            cell_amt.number_format = '#,##0.00'
-            cell_amt.font = Font(color="2E7D32") # Green text
-            cell_amt.border = border_bottom
-        
-        # Expense
-        if i < len(expenses):
-            exp = expenses[i]
-            total_expense += exp.amount
-            
-            # Date
-            cell_date = worksheet[f'E{row_num}']
-            cell_date.value = exp.date.strftime('%Y-%m-%d') if exp.date else ""
-            cell_date.border = border_bottom
-            cell_date.alignment = Alignment(horizontal='center')
-
-            # Description
-            desc = f"{exp.category or 'General'}: {exp.description}"
-            cell_desc = worksheet[f'F{row_num}']
-            cell_desc.value = desc
-            cell_desc.border = border_bottom
-            
-            # Amount
-            cell_amt = worksheet[f'G{row_num}']
-            cell_amt.value = exp.amount
-            cell_amt.number_format = '#,##0.00'
-            cell_amt.font = Font(color="C62828") # Red text
-            cell_amt.border = border_bottom
-
-    # Totals
-    total_row = max_rows + 4
-    
-    thick_top = Border(top=Side(style='medium'))
-
-    # Income Total
-    worksheet[f'A{total_row}'] = "TOTAL INGRESOS"
-    worksheet[f'A{total_row}'].font = Font(bold=True)
-    worksheet[f'A{total_row}'].border = thick_top
-    
-    cell = worksheet[f'C{total_row}']
-    cell.value = total_income
-    cell.number_format = '$#,##0.00'
-    cell.font = Font(bold=True, color="2E7D32")
-    cell.border = thick_top
-
-    # Expense Total
-    worksheet[f'E{total_row}'] = "TOTAL GASTOS"
-    worksheet[f'E{total_row}'].font = Font(bold=True)
-    worksheet[f'E{total_row}'].border = thick_top
-    
-    cell = worksheet[f'G{total_row}']
-    cell.value = total_expense
-    cell.number_format = '$#,##0.00'
-    cell.font = Font(bold=True, color="C62828")
-    cell.border = thick_top
+    max_rows = 0
+    rows = zip_longest(
+        _split_transaction_rows(transactions, 'income'),
+        _split_transaction_rows(transactions, 'expense'),
+    )
+    for income, expense in rows:
+        row = []
+        for entry, side in ((income, 'income'), (expense, 'expense')):
+            if side == 'expense':
+                row.append(None)
+            if entry is None:
+                row += [None, None, None]
+                continue
+            date, description, amount = entry
+            row += [
+                _styled(worksheet, date, 'split_date'),
+                _styled(worksheet, description, 'split_text'),
+                _styled(worksheet, amount, f'split_amount_{side}'),
+            ]
+        total_income += income[2] if income else 0
+        total_expense += expense[2] if expense else 0
+        worksheet.append(row)
+        max_rows += 1
+
+    # Totals (one blank row after the data, as in the split layout)
+    worksheet.append([])
+    worksheet.append([
+        _styled(worksheet, "TOTAL INGRESOS", 'split_total_label'), None,
+        _styled(worksheet, total_income, 'split_total_income'), None,
+        _styled(worksheet, "TOTAL GASTOS", 'split_total_label'), None,
+        _styled(worksheet, total_expense, 'split_total_expense'),
+    ])
 
     # Net Balance
-    net_row = total_row + 2
     net_val = total_income - total_expense
-    worksheet.merge_cells(f'A{net_row}:G{net_row}')
-    cell = worksheet[f'A{net_row}']
-    cell.value = f"BALANCE NETO: ${net_val:,.2f}"
-    cell.font = Font(bold=True, size=14, color="000000" if net_val >= 0 else "C62828")
-    cell.alignment = Alignment(horizontal='center')
-
-    # Column Widths
-    worksheet.column_dimensions['A'].width = 15
-    worksheet.column_dimensions['B'].width = 30
-    worksheet.column_dimensions['C'].width = 15
-    worksheet.column_dimensions['D'].width = 3 # Spacer
-    worksheet.column_dimensions['E'].width = 15
-    worksheet.column_dimensions['F'].width = 30
-    worksheet.column_dimensions['G'].width = 15
-
-    # Generate response
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    net_row = max_rows + 6
+    worksheet.append([])
+    worksheet.append([
+        _styled(worksheet, f"BALANCE NETO: ${net_val:,.2f}", 'split_net' if net_val >= 0 else 'split_net_negative'),
+    ])
+    worksheet.merged_cells.add(f'A{net_row}:G{net_row}')
+
+
+def _write_balance_sheet(workbook, entities):
+    """
+    Assets and liabilities side by side, each read from its own query, with
+    the split sheet styles (assets as income, liabilities as expenses).
+    """
+    worksheet = workbook.create_sheet("Balance Sheet")
+    for column, width in zip('ABCDE', (30, 15, 3, 30, 15)):  # C is a spacer
+        worksheet.column_dimensions[column].width = width
+
+    worksheet.append([
+        _styled(worksheet, "ACTIVOS (ASSETS)", 'split_header_income'), None, None,
+        _styled(worksheet, "PASIVOS (LIABILITIES)", 'split_header_expense'), None,
+    ])
+    worksheet.merged_cells.add('A1:B1')
+    worksheet.merged_cells.add('D1:E1')
+    worksheet.append(
+        [_styled(worksheet, title, 'split_subheader_income') for title in ("Nombre", "Monto")]
+        + [None]
+        + [_styled(worksheet, title, 'split_subheader_expense') for title in ("Nombre", "Monto")]
     )
-    response['Content-Disposition'] = f'attachment; filename=transactions_split_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    
-    workbook.save(response)
-    return response
+
+    totals = {'income': 0, 'expense': 0}
+    max_rows = 0
+    rows = zip_longest(
+        entities.filter(type='asset').values_list('name', 'amount').iterator(chunk_size=EXPORT_CHUNK_SIZE),
+        entities.filter(type='liability').values_list('name', 'amount').iterator(chunk_size=EXPORT_CHUNK_SIZE),
+    )
+    for asset, liability in rows:
+        row = []
+        for entry, side in ((asset, 'income'), (liability, 'expense')):
+            if side == 'expense':
+                row.append(None)
+            if entry is None:
+                row += [None, None]
+                continue
+            name, amount = entry
+            row += [_styled(worksheet, name, 'split_text'), _styled(worksheet, amount, f'split_amount_{side}')]
+            totals[side] += amount
+        worksheet.append(row)
+        max_rows += 1
+
+    worksheet.append([])
+    worksheet.append([
+        _styled(worksheet, "TOTAL ACTIVOS", 'split_total_label'),
+        _styled(worksheet, totals['income'], 'split_total_income'), None,
+        _styled(worksheet, "TOTAL PASIVOS", 'split_total_label'),
+        _styled(worksheet, totals['expense'], 'split_total_expense'),
+    ])
+
+    net_row = max_rows + 6
+    worksheet.append([])
+    worksheet.append([
+        _styled(worksheet, f"PATRIMONIO NETO: ${totals['income'] - totals['expense']:,.2f}", 'split_net'),
+    ])
+    worksheet.merged_cells.add(f'A{net_row}:E{net_row}')
+
+
+def _table_header(worksheet, titles, widths):
+    for column, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(column)].width = width
+    worksheet.append([_styled(worksheet, title, 'table_header') for title in titles])
+
+
+def _monthly_category_totals(transactions):
+    """(month, type, category, count, total) per month and category, grouped in SQL."""
+    return (
+        transactions.exclude(type='transfer')
+        .annotate(month=TruncMonth('date'))
+        .values_list('month', 'type', 'category')
+        .annotate(count=Count('id'), total=Sum('amount'))
+        .order_by('month', 'type', 'category')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def _write_monthly_summary_sheet(workbook, transactions):
+    worksheet = workbook.create_sheet("Monthly Summary")
+    _table_header(worksheet, ("Mes", "Tipo", "Categoría", "Movimientos", "Total"), (12, 12, 30, 14, 16))
+    for month, transaction_type, category, count, total in _monthly_category_totals(transactions):
+        worksheet.append([
+            _styled(worksheet, month.strftime('%Y-%m'), 'table_text'),
+            _styled(worksheet, 'Ingreso' if transaction_type == 'income' else 'Gasto', 'table_text'),
+            _styled(worksheet, category or 'General', 'table_text'),
+            _styled(worksheet, count, 'table_text'),
+            _styled(worksheet, total, 'table_amount'),
+        ])
+
+
+def _budget_category(name):
+    return (name or '').strip().lower()
+
+
+def _write_budget_sheet(workbook, transactions, budget):
+    """
+    Per month: the budgeted income against actual income, each fixed expense
+    category against what was spent in it, and unbudgeted spending.
+    """
+    worksheet = workbook.create_sheet("Budget vs Actual")
+    _table_header(worksheet, ("Mes", "Concepto", "Presupuesto", "Real", "Diferencia"), (12, 30, 16, 16, 16))
+    if budget is None:
+        worksheet.append(["Sin presupuesto configurado"])
+        return
+
+    budgeted = {}  # categoría normalizada -> (nombre a mostrar, monto mensual)
+    for category, amount in budget.fixed_expenses.values_list('category', 'amount'):
+        label, total = budgeted.get(_budget_category(category), (category, 0))
+        budgeted[_budget_category(category)] = (label, total + amount)
+
+    def write_month(month, income, spent):
+        # Diferencia a favor: más ingreso o menos gasto de lo planeado
+        rows = [("Ingresos", budget.monthly_income, income, income - budget.monthly_income)]
+        for key, (label, amount) in budgeted.items():
+            actual = spent.pop(key, 0)
+            rows.append((label, amount, actual, amount - actual))
+        unbudgeted = sum(spent.values())
+        rows.append(("Otros gastos (sin presupuesto)", 0, unbudgeted, -unbudgeted))
+        for concept, planned, actual, difference in rows:
+            worksheet.append([
+                _styled(worksheet, month.strftime('%Y-%m'), 'table_text'),
+                _styled(worksheet, concept, 'table_text'),
+                _styled(worksheet, planned, 'table_amount'),
+                _styled(worksheet, actual, 'table_amount'),
+                _styled(worksheet, difference, 'table_amount'),
+            ])
+
+    actuals = (
+        transactions.exclude(type='transfer')
+        .annotate(month=TruncMonth('date'))
+        .values_list('month', 'type', 'category')
+        .annotate(total=Sum('amount'))
+        .order_by('month')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    current = None
+    income = 0
+    spent = {}
+    for month, transaction_type, category, total in actuals:
+        if month != current:
+            if current is not None:
+                write_month(current, income, spent)
+            current, income, spent = month, 0, {}
+        if transaction_type == 'income':
+            income += total
+        else:
+            key = _budget_category(category)
+            spent[key] = spent.get(key, 0) + total
+    if current is not None:
+        write_month(current, income, spent)
+
+
+def write_workbook_bundle(transactions, entities, budget, output):
+    """
+    Writes one write-only workbook with the Transactions split sheet, the
+    Balance Sheet, the monthly summary by category and Budget vs Actual,
+    each sheet streamed from its own query.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    _register_split_styles(workbook)
+    _write_transactions_sheet(workbook, transactions)
+    _write_balance_sheet(workbook, entities)
+    _write_monthly_summary_sheet(workbook, transactions)
+    _write_budget_sheet(workbook, transactions, budget)
+    workbook.save(output)
+
+
+def export_workbook_bundle(transactions, entities, budget):
+    return _temp_file_response(
+        lambda output: write_workbook_bundle(transactions, entities, budget, output),
+        XLSX_CONTENT_TYPE,
+        f'flowcash_{datetime.now().strftime("%Y%m%d")}.xlsx',
+    )
+
 
 def export_vision_to_excel(entities):
     """
     Generates an Excel file from a queryset of VisionEntities (Assets/Liabilities) in split view.
     """
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.title = "Balance Sheet"
+    def write(output):
+        workbook = openpyxl.Workbook(write_only=True)
+        _register_split_styles(workbook)
+        _write_balance_sheet(workbook, entities)
+        workbook.save(output)
+
+    return _temp_file_response(
+        write, XLSX_CONTENT_TYPE, f'balance_sheet_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    )
 
-    # Separate data
-    assets = [e for e in entities if e.type == 'asset']
-    liabilities = [e for e in entities if e.type == 'liability']
-    
-    # Styles
-    header_font = Font(bold=True, size=12, color="FFFFFF")
-    sub_header_font = Font(bold=True, color="FFFFFF")
-    
-    green_fill = PatternFill(start_color="2E7D32", end_color="2E7D32", fill_type="solid") # Dark Green
-    red_fill = PatternFill(start_color="C62828", end_color="C62828", fill_type="solid") # Dark Red
-    
-    # Main Headers
-    worksheet.merge_cells('A1:B1')
-    cell_a1 = worksheet['A1']
-    cell_a1.value = "ACTIVOS (ASSETS)"
-    cell_a1.font = header_font
-    cell_a1.fill = green_fill
-    cell_a1.alignment = Alignment(horizontal='center')
-
-    worksheet.merge_cells('D1:E1')
-    cell_d1 = worksheet['D1']
-    cell_d1.value = "PASIVOS (LIABILITIES)"
-    cell_d1.font = header_font
-    cell_d1.fill = red_fill
-    cell_d1.alignment = Alignment(horizontal='center')
 
-    # Sub Headers
-    columns = [
-        ('A', "Nombre", green_fill), ('B', "Monto", green_fill),
-        ('D', "Nombre", red_fill), ('E', "Monto", red_fill)
-    ]
-    
-    for col, title, fill in columns:
-        cell = worksheet[f'{col}2']
-        cell.value = title
-        cell.font = sub_header_font
-        cell.fill = fill
-        cell.alignment = Alignment(horizontal='center')
+class _PageWriter:
+    """
+    Lays flowables out page by page straight onto a canvas, so only the
+    current page's flowables are built at a time (SimpleDocTemplate needs
+    the full list of flowables up front). The canvas still keeps every
+    finished page's drawing operations until `save()`, so memory grows with
+    the page count.
+    """
 
-    # Data
-    max_rows = max(len(assets), len(liabilities))
-    
-    total_assets = 0
-    total_liabilities = 0
-    
-    border_bottom = Border(bottom=Side(style='thin', color="CCCCCC"))
+    def __init__(self, canv, pagesize, left=30, right=30, top=30, bottom=18):
+        self.canv = canv
+        width, height = pagesize
+        self._frame_args = (left, bottom, width - left - right, height - top - bottom)
+        self.pages = 1
+        self.frame = Frame(*self._frame_args)
+        self.empty = True  # nothing drawn on the current page yet
+
+    def new_page(self):
+        self.canv.showPage()
+        self.pages += 1
+        self.frame = Frame(*self._frame_args)
+        self.empty = True
+
+    def add(self, flowables):
+        """
+        Draws the flowables in order, splitting (e.g. LongTable by rows) across
+        pages if needed. Raises LayoutError for a flowable that does not fit
+        even an empty page, as SimpleDocTemplate does.
+        """
+        flowables = list(flowables)
+        while flowables:
+            flowable = flowables.pop(0)
+            if self.frame.add(flowable, self.canv, trySplit=0):
+                self.empty = False
+                continue
+            parts = self.frame.split(flowable, self.canv)
+            if parts and self.frame.add(parts[0], self.canv, trySplit=0):
+                flowables[0:0] = parts[1:]
+            elif self.empty:
+                # Otra página vacía no le daría más espacio
+                raise LayoutError(f"{flowable.__class__.__name__} is too large for an empty page")
+            else:
+                flowables.insert(0, flowable)
+            self.new_page()
+
+    def finish(self):
+        self.canv.showPage()
+        self.canv.save()
+
+
+# Transactions per page of the PDF report; each page closes with its subtotal
+PDF_ROWS_PER_PAGE = 22
+
+PDF_COLUMN_WIDTHS = [110, 200, 100, 80, 100, 80]
+
+PDF_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F46E5')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ALIGN', (1, 1), (1, -1), 'LEFT'), # Left align description
+    ('ALIGN', (5, 1), (5, -1), 'RIGHT'), # Right align amount
+    # Subtotal and running total rows
+    ('BACKGROUND', (0, -2), (-1, -1), colors.HexColor('#E0E7FF')),
+    ('FONTNAME', (0, -2), (-1, -1), 'Helvetica-Bold'),
+    ('SPAN', (0, -2), (4, -2)),
+    ('SPAN', (0, -1), (4, -1)),
+    ('ALIGN', (0, -2), (0, -1), 'RIGHT'),
+])
+
+PDF_HEADER = ["Date", "Description", "Category", "Type", "Payment", "Amount"]
+
+
+def _pdf_page_table(rows, page_income, page_expense, total_income, total_expense):
+    data = [PDF_HEADER] + rows + [
+        [f"Page subtotal - Income: ${page_income:,.2f}  Expense: ${page_expense:,.2f}", "", "", "", "",
+         f"${page_income - page_expense:,.2f}"],
+        [f"Running total - Income: ${total_income:,.2f}  Expense: ${total_expense:,.2f}", "", "", "", "",
+         f"${total_income - total_expense:,.2f}"],
+    ]
+    table = LongTable(data, colWidths=PDF_COLUMN_WIDTHS, repeatRows=1)
+    table.setStyle(PDF_TABLE_STYLE)
+    return table
 
-    for i in range(max_rows):
-        row_num = i + 3
-        
-        # Asset
-        if i < len(assets):
-            asset = assets[i]
-            total_assets += asset.amount
-            
-            cell_name = worksheet[f'A{row_num}']
-            cell_name.value = asset.name
-            cell_name.border = border_bottom
-            
-            cell_amt = worksheet[f'B{row_num}']
-            cell_amt.value = asset.amount
-            cell_amt.number_format = '#,##0.00'
-            cell_amt.font = Font(color="2E7D32") # Green text
-            cell_amt.border = border_bottom
-        
-        # Liability
-        if i < len(liabilities):
-            liab = liabilities[i]
-            total_liabilities += liab.amount
-            
-            cell_name = worksheet[f'D{row_num}']
-            cell_name.value = liab.name
-            cell_name.border = border_bottom
-            
-            cell_amt = worksheet[f'E{row_num}']
-            cell_amt.value = liab.amount
-            cell_amt.number_format = '#,##0.00'
-            cell_amt.font = Font(color="C62828") # Red text
-            cell_amt.border = border_bottom
-
-    # Totals
-    total_row = max_rows + 4
-    thick_top = Border(top=Side(style='medium'))
-    
-    # Asset Total
-    worksheet[f'A{total_row}'] = "TOTAL ACTIVOS"
-    worksheet[f'A{total_row}'].font = Font(bold=True)
-    worksheet[f'A{total_row}'].border = thick_top
-    
-    cell = worksheet[f'B{total_row}']
-    cell.value = total_assets
-    cell.number_format = '$#,##0.00'
-    cell.font = Font(bold=True, color="2E7D32")
-    cell.border = thick_top
-
-    # Liability Total
-    worksheet[f'D{total_row}'] = "TOTAL PASIVOS"
-    worksheet[f'D{total_row}'].font = Font(bold=True)
-    worksheet[f'D{total_row}'].border = thick_top
-    
-    cell = worksheet[f'E{total_row}']
-    cell.value = total_liabilities
-    cell.number_format = '$#,##0.00'
-    cell.font = Font(bold=True, color="C62828")
-    cell.border = thick_top
-
-    # Net Worth
-    net_row = total_row + 2
-    worksheet.merge_cells(f'A{net_row}:E{net_row}')
-    cell = worksheet[f'A{net_row}']
-    cell.value = f"PATRIMONIO NETO: ${total_assets - total_liabilities:,.2f}"
-    cell.font = Font(bold=True, size=14)
-    cell.alignment = Alignment(horizontal='center')
-
-    # Column Widths
-    worksheet.column_dimensions['A'].width = 30
-    worksheet.column_dimensions['B'].width = 15
-    worksheet.column_dimensions['C'].width = 3 # Spacer
-    worksheet.column_dimensions['D'].width = 30
-    worksheet.column_dimensions['E'].width = 15
-
-    # Generate response
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    )
-    response['Content-Disposition'] = f'attachment; filename=balance_sheet_{datetime.now().strftime("%Y%m%d")}.xlsx'
-    
-    workbook.save(response)
-    return response
 
-def export_transactions_to_pdf(transactions):
+def render_transactions_pdf(transactions, output, rows_per_page=PDF_ROWS_PER_PAGE):
     """
-    Generates a PDF file from a queryset of transactions.
+    Writes the transaction report to the binary file `output`.
+
+    Rows are read with `.iterator()` and drawn one page-sized LongTable at a
+    time (header repeated on every page), each closed by the page subtotal
+    and the running totals. Returns the number of pages.
+
+    Memory is not bounded: reportlab holds the finished pages until the file
+    is saved, a few hundred bytes per row (see `benchmark_pdf_export`).
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(letter), rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=18)
-    
-    elements = []
+    canv = canvas.Canvas(output, pagesize=landscape(letter), pageCompression=1)
+    writer = _PageWriter(canv, landscape(letter))
     styles = getSampleStyleSheet()
-    
+
     # Title
-    title_style = styles['Title']
-    elements.append(Paragraph(f"Transaction Report - {datetime.now().strftime('%Y-%m-%d')}", title_style))
-    elements.append(Spacer(1, 12))
+    writer.add([
+        Paragraph(f"Transaction Report - {datetime.now().strftime('%Y-%m-%d')}", styles['Title']),
+        Spacer(1, 12),
+    ])
+
+    type_labels = dict(Transaction.TRANSACTION_TYPES)
+    payment_labels = dict(Transaction.PAYMENT_TYPES)
+    rows = transactions.values_list(
+        'date', 'description', 'category', 'type', 'payment_type', 'amount'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
 
-    # Table Data
-    data = [["Date", "Description", "Category", "Type", "Payment", "Amount"]]
-    
     total_income = 0
     total_expense = 0
-
-    for t in transactions:
-        date_str = t.date.strftime("%Y-%m-%d %H:%M") if t.date else ""
-        amount = float(t.amount)
-        
-        if t.type == 'income':
-            total_income += amount
-        elif t.type == 'expense':
-            total_expense += amount
-            
-        row = [
-            date_str,
-            t.description[:30] + ('...' if len(t.description) > 30 else ''), # Truncate long descriptions
-            t.category or "-",
-            t.get_type_display(),
-            t.get_payment_type_display() if t.payment_type else "-",
+    page_rows = []
+    page_income = 0
+    page_expense = 0
+    for date, description, category, transaction_type, payment_type, amount in rows:
+        amount = float(amount)
+        if transaction_type == 'income':
+            page_income += amount
+        elif transaction_type == 'expense':
+            page_expense += amount
+
+        # Celdas de una línea: un salto de línea alargaría la fila
+        description = " ".join(description.split())
+        page_rows.append([
+            date.strftime("%Y-%m-%d %H:%M") if date else "",
+            description[:30] + ('...' if len(description) > 30 else ''), # Truncate long descriptions
+            " ".join(category.split())[:30] if category else "-",
+            type_labels.get(transaction_type, transaction_type),
+            payment_labels.get(payment_type, payment_type) if payment_type else "-",
             f"${amount:,.2f}"
-        ]
-        data.append(row)
+        ])
 
-    # Table Style
-    table = Table(data, colWidths=[110, 200, 100, 80, 100, 80])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F46E5')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ALIGN', (1, 1), (1, -1), 'LEFT'), # Left align description
-        ('ALIGN', (5, 1), (5, -1), 'RIGHT'), # Right align amount
-    ]))
-    
-    elements.append(table)
-    elements.append(Spacer(1, 24))
+        if len(page_rows) == rows_per_page:
+            total_income += page_income
+            total_expense += page_expense
+            writer.add([_pdf_page_table(page_rows, page_income, page_expense, total_income, total_expense)])
+            writer.new_page()
+            page_rows = []
+            page_income = 0
+            page_expense = 0
+
+    if page_rows:
+        total_income += page_income
+        total_expense += page_expense
+        writer.add([_pdf_page_table(page_rows, page_income, page_expense, total_income, total_expense)])
 
     # Summary
     summary_style = ParagraphStyle(
@@ -372,22 +537,16 @@ def export_transactions_to_pdf(transactions):
         fontSize=12,
         spaceAfter=6
     )
-    
-    elements.append(Paragraph("<b>Summary:</b>", summary_style))
-    elements.append(Paragraph(f"Total Income: ${total_income:,.2f}", summary_style))
-    elements.append(Paragraph(f"Total Expense: ${total_expense:,.2f}", summary_style))
-    elements.append(Paragraph(f"Net Balance: ${total_income - total_expense:,.2f}", summary_style))
+    writer.add([
+        Spacer(1, 24),
+        Paragraph("<b>Summary:</b>", summary_style),
+        Paragraph(f"Total Income: ${total_income:,.2f}", summary_style),
+        Paragraph(f"Total Expense: ${total_expense:,.2f}", summary_style),
+        Paragraph(f"Net Balance: ${total_income - total_expense:,.2f}", summary_style),
+    ])
+    writer.finish()
+    return writer.pages
 
-    # Build PDF
-    doc.build(elements)
-    
-    pdf = buffer.getvalue()
-    buffer.close()
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename=transactions_{datetime.now().strftime("%Y%m%d")}.pdf'
-    response.write(pdf)
-    return response
 
 def export_vision_to_pdf(entities):
     """
@@ -462,3 +621,197 @@ def export_vision_to_pdf(entities):
     response['Content-Disposition'] = f'attachment; filename=balance_sheet_{datetime.now().strftime("%Y%m%d")}.pdf'
     response.write(pdf)
     return response
+
+
+def _flat_transaction_rows(transactions):
+    """
+    TRANSACTION_EXPORT_FIELDS tuples in the queryset's order, read from a
+    server-side cursor in EXPORT_CHUNK_SIZE chunks.
+    """
+    return transactions.values_list(*TRANSACTION_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _buffered(lines):
+    """Joins text lines into ~STREAM_BUFFER_BYTES UTF-8 chunks."""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= STREAM_BUFFER_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _LineBuffer:
+    """File-like target that hands back what csv.writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(transactions):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(TRANSACTION_EXPORT_FIELDS)
+    for row in _flat_transaction_rows(transactions):
+        row = list(row)
+        row[1] = row[1].isoformat() if row[1] else ''
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(transactions):
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    for row in _flat_transaction_rows(transactions):
+        record = dict(zip(TRANSACTION_EXPORT_FIELDS, row))
+        record['date'] = record['date'].isoformat() if record['date'] else None
+        record['amount'] = str(record['amount'])
+        yield encoder.encode(record) + '\n'
+
+
+def stream_transactions_csv(transactions):
+    """
+    CSV of a queryset of transactions as ~STREAM_BUFFER_BYTES chunks, one row
+    per transaction, produced with constant memory.
+    """
+    return _buffered(_csv_lines(transactions))
+
+
+def stream_transactions_ndjson(transactions):
+    """
+    NDJSON (one JSON object per line) of a queryset of transactions as
+    ~STREAM_BUFFER_BYTES chunks, produced with constant memory. Amounts are
+    strings to keep their exact decimals.
+    """
+    return _buffered(_ndjson_lines(transactions))
+
+
+def write_transactions_csv(transactions, output):
+    for chunk in stream_transactions_csv(transactions):
+        output.write(chunk)
+
+
+def write_transactions_ndjson(transactions, output):
+    for chunk in stream_transactions_ndjson(transactions):
+        output.write(chunk)
+
+
+# Rows per Parquet row group: the unit that is held in memory and compressed
+PARQUET_ROW_GROUP_SIZE = 50000
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+# Same columns as the flat exports, typed
+TRANSACTION_PARQUET_COLUMNS = [
+    ParquetColumn('id', 'int64', nullable=False),
+    ParquetColumn('date', 'timestamp', nullable=False),
+    ParquetColumn('type', 'string', nullable=False, dictionary=True),
+    ParquetColumn('amount', 'decimal', nullable=False, precision=12, scale=2),
+    ParquetColumn('category', 'string', dictionary=True),
+    ParquetColumn('description', 'string'),
+    ParquetColumn('payment_type', 'string', dictionary=True),
+    ParquetColumn('related_entity_id', 'string', dictionary=True),
+    ParquetColumn('transfer_related_entity_id', 'string', dictionary=True),
+    ParquetColumn('is_recurring', 'bool', nullable=False),
+    ParquetColumn('recurrence_frequency', 'string', dictionary=True),
+]
+
+VISION_PARQUET_COLUMNS = [
+    ParquetColumn('id', 'int64', nullable=False),
+    ParquetColumn('name', 'string', nullable=False),
+    ParquetColumn('type', 'string', nullable=False, dictionary=True),
+    ParquetColumn('category', 'string', dictionary=True),
+    ParquetColumn('amount', 'decimal', nullable=False, precision=15, scale=2),
+    ParquetColumn('interest_rate', 'decimal', precision=5, scale=2),
+    ParquetColumn('minimum_payment', 'decimal', precision=12, scale=2),
+    ParquetColumn('is_crypto', 'bool', nullable=False),
+    ParquetColumn('crypto_symbol', 'string', dictionary=True),
+    ParquetColumn('crypto_amount', 'decimal', precision=20, scale=8),
+    ParquetColumn('is_credit_card', 'bool', nullable=False),
+    ParquetColumn('cutoff_date', 'int32'),
+    ParquetColumn('payment_date', 'int32'),
+    ParquetColumn('issuer_bank', 'string', dictionary=True),
+    ParquetColumn('description', 'string'),
+    ParquetColumn('created_at', 'timestamp', nullable=False),
+    ParquetColumn('updated_at', 'timestamp', nullable=False),
+]
+
+
+def _write_parquet(queryset, columns, output):
+    """
+    Streams `queryset` rows from a server-side cursor into a Parquet file,
+    one row group per PARQUET_ROW_GROUP_SIZE rows.
+    """
+    rows = queryset.values_list(*[column.name for column in columns]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    writer = ParquetWriter(output, columns)
+    while True:
+        group = list(islice(rows, PARQUET_ROW_GROUP_SIZE))
+        if not group:
+            break
+        writer.write_row_group(group)
+    writer.close()
+
+
+def write_transactions_parquet(transactions, output):
+    _write_parquet(transactions, TRANSACTION_PARQUET_COLUMNS, output)
+
+
+def write_vision_parquet(entities, output):
+    _write_parquet(entities.order_by('id'), VISION_PARQUET_COLUMNS, output)
+
+
+def export_transactions_to_parquet_archive(transactions, entities):
+    """
+    Transactions and vision entities as two Parquet files in one zip (stored,
+    the pages are already compressed).
+    """
+    def write(output):
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+            with archive.open('transactions.parquet', 'w', force_zip64=True) as member:
+                write_transactions_parquet(transactions, member)
+            with archive.open('vision_entities.parquet', 'w') as member:
+                write_vision_parquet(entities, member)
+
+    return _temp_file_response(
+        write, 'application/zip', f'flowcash_{datetime.now().strftime("%Y%m%d")}_parquet.zip'
+    )
+
+
+# export type -> (writer(transactions, binary file), content type, file extension)
+TRANSACTION_EXPORT_FORMATS = {
+    'xlsx': (write_transactions_excel, XLSX_CONTENT_TYPE, 'xlsx'),
+    'pdf': (render_transactions_pdf, 'application/pdf', 'pdf'),
+    'csv': (write_transactions_csv, 'text/csv; charset=utf-8', 'csv'),
+    'ndjson': (write_transactions_ndjson, 'application/x-ndjson', 'ndjson'),
+    'parquet': (write_transactions_parquet, PARQUET_CONTENT_TYPE, 'parquet'),
+}
+
+# Formats produced row by row, which can be sent while they are generated
+TRANSACTION_EXPORT_STREAMS = {
+    'csv': stream_transactions_csv,
+    'ndjson': stream_transactions_ndjson,
+}
+
+# Bump a format's version whenever its output changes, so files rendered by
+# older code are not served from the export cache again
+TRANSACTION_EXPORT_VERSIONS = {
+    'xlsx': 1,
+    'pdf': 1,
+    'csv': 1,
+    'ndjson': 1,
+    'parquet': 1,
+}
+
+# Formats that print the render date (the PDF title): cached files expire daily
+DATED_EXPORT_FORMATS = ('pdf',)
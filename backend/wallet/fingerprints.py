@@ -0,0 +1,114 @@
+import hashlib
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Q
+from django.utils import timezone
+from .automaton import normalize_phrase
+from .models import Transaction
+
+# Same amount, type and account this many days apart (with another
+# description or date) makes a probable duplicate
+PROBABLE_DUPLICATE_DAYS = 3
+
+# A batch item matching a row stored this recently is a retried request
+# (timeouts, flaky connections); older matches are only probable duplicates
+RETRY_WINDOW_SECONDS = 120
+
+
+def transaction_fingerprint(user_id, date, amount, description, entity_id=None):
+    """
+    Hash of (user, local date, amount, normalized description, entity) that
+    identical movements share: a re-imported statement row or a retried
+    request gets the fingerprint of the row it repeats.
+    """
+    day = timezone.localtime(date).date() if timezone.is_aware(date) else date.date()
+    parts = [
+        str(user_id),
+        day.isoformat(),
+        str(Decimal(amount).quantize(Decimal('0.01'))),
+        normalize_phrase(description),
+        str(entity_id or ''),
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _aware_date(value):
+    date = Transaction._meta.get_field('date').to_python(value)
+    return timezone.make_aware(date) if timezone.is_naive(date) else date
+
+
+def fingerprint_for(transaction):
+    date = _aware_date(transaction.date)
+    return transaction_fingerprint(
+        transaction.user_id, date, transaction.amount, transaction.description, transaction.related_entity_id
+    )
+
+
+def classify_duplicates(user, transactions, stored_before=None):
+    """
+    Classifies unsaved transactions against the user's stored ones with a
+    single query. Returns one (status, existing pk) pair per transaction, in
+    order, where status is:
+
+        'duplicate'           a stored row has the same fingerprint
+        'probable_duplicate'  a stored row has the same amount, type and
+                              account within PROBABLE_DUPLICATE_DAYS days
+        'new'                 neither (existing pk is None)
+
+    Each stored row matches at most one transaction, so a batch repeating a
+    movement twice (two equal coffees) against one stored copy gets one
+    duplicate and one new row. With `stored_before` only rows created
+    earlier count, so an import does not match the rows it just wrote.
+    Fingerprints are filled in on the way.
+    """
+    if not transactions:
+        return []
+    for transaction in transactions:
+        transaction.user_id = user.pk
+        transaction.fingerprint = fingerprint_for(transaction)
+
+    dates = [_aware_date(t.date) for t in transactions]
+    window = timedelta(days=PROBABLE_DUPLICATE_DAYS)
+    stored = Transaction.objects.filter(user=user)
+    if stored_before is not None:
+        stored = stored.filter(created_at__lt=stored_before)
+    stored = (
+        stored.filter(
+            Q(fingerprint__in={t.fingerprint for t in transactions})
+            | Q(amount__in={t.amount for t in transactions}, date__gte=min(dates) - window, date__lte=max(dates) + window)
+        )
+        .order_by('date', 'pk')
+        .values_list('pk', 'fingerprint', 'amount', 'type', 'related_entity_id', 'date')
+    )
+    by_fingerprint = defaultdict(list)
+    by_amount = defaultdict(list)
+    for pk, fingerprint, amount, transaction_type, entity_id, date in stored:
+        by_fingerprint[fingerprint].append(pk)
+        by_amount[(amount, transaction_type)].append((pk, entity_id, date))
+
+    results = [('new', None)] * len(transactions)
+    used = set()
+    # Primero las coincidencias exactas, para que una probable no se quede con su fila
+    for index, transaction in enumerate(transactions):
+        for pk in by_fingerprint.get(transaction.fingerprint, ()):
+            if pk not in used:
+                used.add(pk)
+                results[index] = ('duplicate', pk)
+                break
+
+    for index, transaction in enumerate(transactions):
+        if results[index][0] != 'new':
+            continue
+        nearest = None
+        for pk, entity_id, date in by_amount.get((Decimal(transaction.amount), transaction.type), ()):
+            if pk in used or abs(date - dates[index]) > window:
+                continue
+            if entity_id and transaction.related_entity_id and entity_id != str(transaction.related_entity_id):
+                continue
+            if nearest is None or abs(date - dates[index]) < abs(nearest[1] - dates[index]):
+                nearest = (pk, date)
+        if nearest is not None:
+            used.add(nearest[0])
+            results[index] = ('probable_duplicate', nearest[0])
+    return results
@@ -0,0 +1,328 @@
+"""
+Copies users' data from the legacy Firestore collections into the Django
+models. Used by the `migrate_firebase` command; the Firestore client and the
+email -> uid lookup are passed in, so a local fake can stand in for both.
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from dateutil.relativedelta import relativedelta
+from django.db import connection, connections, transaction as db_transaction
+from django.utils import timezone
+from .fingerprints import classify_duplicates
+from .ml import reset_category_model
+from .models import (
+    Budget, Category, FirebaseMigrationCheckpoint, FixedExpense, Transaction, VisionEntity,
+)
+from .nlp import discard_parsing_context
+from .signals import suppress_balance_signals
+
+# Documents per Firestore request; later pages start after the previous page's last document
+FIRESTORE_PAGE_SIZE = 500
+
+# Emails per Firebase Auth get_users() call (the API maximum)
+AUTH_LOOKUP_BATCH = 100
+
+# Names the owner's uid field had over time, tried in order
+USER_ID_FIELDS = ('uid', 'userId', 'user_id')
+
+CATEGORY_COLLECTIONS = ('categories', 'Categories')
+ENTITY_COLLECTIONS = ('vision', 'vision_entities', 'visionEntities', 'assets', 'liabilities')
+TRANSACTION_COLLECTIONS = ('transactions', 'Transactions')
+SUBSCRIPTION_COLLECTIONS = ('subscriptions', 'Subscriptions')
+BUDGET_COLLECTIONS = ('budgets',)
+
+RECURRENCE_FREQUENCIES = ('weekly', 'monthly', 'yearly')
+PAYMENT_TYPES = {value for value, _ in Transaction.PAYMENT_TYPES}
+
+
+def firebase_uid_lookup(emails):
+    """{lowercased email: uid} from Firebase Auth, AUTH_LOOKUP_BATCH emails per call."""
+    from firebase_admin import auth
+
+    uids = {}
+    for start in range(0, len(emails), AUTH_LOOKUP_BATCH):
+        identifiers = [auth.EmailIdentifier(email) for email in emails[start:start + AUTH_LOOKUP_BATCH]]
+        for record in auth.get_users(identifiers).users:
+            if record.email:
+                uids[record.email.lower()] = record.uid
+    return uids
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value if value is not None else 0)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return Decimal('0.00')
+
+
+def _firestore_datetime(value, default=None):
+    # Timestamp de Firestore, cadena ISO o milisegundos desde epoch
+    if hasattr(value, 'timestamp'):
+        return datetime.fromtimestamp(value.timestamp(), tz=dt_timezone.utc)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000.0, tz=dt_timezone.utc)
+    return default
+
+
+class FirestoreMigration:
+    """
+    Migrates Django users' Firestore data, several users at a time.
+
+        migration = FirestoreMigration(firestore.client(), firebase_uid_lookup, workers=4)
+        results = migration.run(User.objects.all())
+
+    Each user is migrated in its own database transaction together with
+    its FirebaseMigrationCheckpoint, so a re-run skips completed users and
+    retries failed ones. Rows are written with bulk_create; transactions
+    whose fingerprint is already stored are skipped.
+    """
+
+    def __init__(self, db, uid_lookup, workers=4, page_size=FIRESTORE_PAGE_SIZE, log=None):
+        self.db = db
+        self.uid_lookup = uid_lookup
+        self.workers = workers
+        self.page_size = page_size
+        self.log = log or (lambda message: None)
+        self.user_fields = {}  # colección -> campo con el uid de la última coincidencia
+        self._lock = threading.Lock()
+
+    def run(self, users, force=False):
+        """
+        Migrates `users` (a queryset) and returns one (user, status, detail)
+        per user, detail being the counts or the error. Users whose
+        checkpoint is completed are left out unless `force`. On SQLite the
+        users are migrated one at a time.
+        """
+        if not force:
+            users = users.exclude(firebase_migration__status='completed')
+        users = list(users.exclude(email='').exclude(email__isnull=True))
+        if not users:
+            return []
+        uids = self.uid_lookup(sorted({user.email for user in users}))
+        uids = {email.lower(): uid for email, uid in uids.items()}
+        tasks = [(user, uids.get(user.email.lower())) for user in users]
+
+        # SQLite admite un solo escritor: ahí los usuarios van de uno en uno
+        if self.workers <= 1 or connection.vendor == 'sqlite':
+            return [self._migrate_user(user, uid) for user, uid in tasks]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda task: self._in_worker(*task), tasks))
+
+    def _in_worker(self, user, uid):
+        try:
+            return self._migrate_user(user, uid)
+        finally:
+            # Cada hilo abre sus propias conexiones
+            connections.close_all()
+
+    def _migrate_user(self, user, uid):
+        if not uid:
+            error = f"No Firebase account for {user.email}"
+            self._checkpoint(user, '', 'failed', error=error)
+            self.log(f"{user.email}: {error}")
+            return user, 'failed', error
+        try:
+            with db_transaction.atomic(), suppress_balance_signals():
+                counts = self.migrate_user_data(user, uid)
+                self._checkpoint(user, uid, 'completed', counts=counts)
+        except Exception:
+            error = traceback.format_exc()[-4000:]
+            self._checkpoint(user, uid, 'failed', error=error)
+            self.log(f"{user.email}: failed\n{error}")
+            return user, 'failed', error
+        discard_parsing_context(user.pk)
+        self.log(f"{user.email}: {counts}")
+        return user, 'completed', counts
+
+    @staticmethod
+    def _checkpoint(user, uid, status, counts=None, error=''):
+        FirebaseMigrationCheckpoint.objects.update_or_create(
+            user=user, defaults={'firebase_uid': uid, 'status': status, 'counts': counts or {}, 'error': error}
+        )
+
+    def user_pages(self, collections, uid):
+        """
+        Pages of the user's documents in the first of `collections` that has
+        any. A collection's uid field is learned from its last match and
+        queried first; the other USER_ID_FIELDS are still tried when it
+        finds nothing, since legacy documents mix them.
+        """
+        for name in collections:
+            with self._lock:
+                known = self.user_fields.get(name)
+            fields = ([known] if known else []) + [field for field in USER_ID_FIELDS if field != known]
+            for field in fields:
+                pages = self._pages(name, field, uid)
+                first = next(pages)
+                if first:
+                    with self._lock:
+                        self.user_fields[name] = field
+                    yield first
+                    yield from pages
+                    return
+
+    def _pages(self, collection, field, uid):
+        query = self.db.collection(collection).where(field, '==', uid).order_by('__name__').limit(self.page_size)
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            yield page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    def migrate_user_data(self, user, uid):
+        counts = dict.fromkeys(
+            ('categories', 'vision_entities', 'transactions', 'duplicates', 'recurring', 'fixed_expenses'), 0
+        )
+        started = timezone.now()
+        categories = set(Category.objects.filter(user=user).values_list('name', flat=True))
+
+        def add_categories(names):
+            new = {name for name in names if name} - categories
+            Category.objects.bulk_create([Category(user=user, name=name) for name in sorted(new)])
+            categories.update(new)
+            counts['categories'] += len(new)
+
+        for page in self.user_pages(CATEGORY_COLLECTIONS, uid):
+            add_categories(str(doc.to_dict().get('name') or '')[:100] for doc in page)
+
+        entity_ids = self._migrate_entities(user, uid, counts)
+
+        # Firestore entity amounts already include every transaction,
+        # so the migrated rows must not move the balances again.
+        for page in self.user_pages(TRANSACTION_COLLECTIONS, uid):
+            rows = [self._transaction(user, doc.to_dict(), entity_ids) for doc in page]
+            add_categories(row.category for row in rows)
+            self._insert_transactions(user, rows, started, counts, 'transactions')
+
+        for page in self.user_pages(SUBSCRIPTION_COLLECTIONS, uid):
+            rows = [self._subscription(user, doc.to_dict(), entity_ids) for doc in page]
+            add_categories(row.category for row in rows)
+            self._insert_transactions(user, rows, started, counts, 'recurring')
+
+        self._migrate_budget(user, uid, counts)
+
+        if counts['transactions'] or counts['recurring']:
+            # bulk_create no pasa por las señales de conteo del predictor
+            reset_category_model(user.pk)
+        return counts
+
+    def _migrate_entities(self, user, uid, counts):
+        """Creates missing entities and returns {Firestore doc id: Django pk as str}."""
+        existing = {
+            (name, entity_type): str(pk)
+            for pk, name, entity_type in VisionEntity.objects.filter(user=user).values_list('pk', 'name', 'type')
+        }
+        entity_ids = {}
+        for page in self.user_pages(ENTITY_COLLECTIONS, uid):
+            new = []
+            for doc in page:
+                data = doc.to_dict()
+                key = (str(data.get('name') or 'Unnamed')[:255], data.get('type') or 'asset')
+                if key in existing:
+                    entity_ids[doc.id] = existing[key]
+                    continue
+                new.append((doc.id, VisionEntity(
+                    user=user,
+                    name=key[0],
+                    type=key[1],
+                    amount=_decimal(data.get('amount')),
+                    category=data.get('category', 'General'),
+                    description=data.get('description', ''),
+                    is_crypto=bool(data.get('isCrypto', False)),
+                    is_credit_card=bool(data.get('isCreditCard', False)),
+                    cutoff_date=data.get('cutoffDate'),
+                    payment_date=data.get('paymentDate'),
+                    issuer_bank=data.get('issuerBank'),
+                )))
+            # Las transacciones se enlazan por pk: sin RETURNING hay que guardar una por una
+            objects = [entity for _, entity in new]
+            if connection.features.can_return_rows_from_bulk_insert:
+                VisionEntity.objects.bulk_create(objects)
+            else:
+                for entity in objects:
+                    entity.save()
+            for doc_id, entity in new:
+                existing[(entity.name, entity.type)] = entity_ids[doc_id] = str(entity.pk)
+            counts['vision_entities'] += len(new)
+        return entity_ids
+
+    @staticmethod
+    def _transaction(user, data, entity_ids):
+        payment_type = data.get('paymentType', 'cash')
+        return Transaction(
+            user=user,
+            description=str(data.get('description') or 'Sin descripción')[:255],
+            amount=_decimal(data.get('amount')),
+            type=data.get('type', 'expense'),
+            category=str(data.get('category') or 'General')[:100],
+            date=_firestore_datetime(data.get('date'), timezone.now()),
+            payment_type=payment_type if payment_type in PAYMENT_TYPES else None,
+            related_entity_id=entity_ids.get(data.get('relatedEntityId') or data.get('related_entity_id')),
+        )
+
+    @staticmethod
+    def _subscription(user, data, entity_ids):
+        """
+        Subscriptions became recurring transactions: the template is dated one
+        period before the next payment, so the recurrence job creates that one.
+        """
+        frequency = data.get('frequency')
+        if frequency not in RECURRENCE_FREQUENCIES:
+            frequency = 'monthly'
+        next_payment = _firestore_datetime(data.get('nextPaymentDate'), timezone.now())
+        period = {'weekly': relativedelta(weeks=1), 'monthly': relativedelta(months=1), 'yearly': relativedelta(years=1)}
+        return Transaction(
+            user=user,
+            description=str(data.get('name') or 'Subscription')[:255],
+            amount=_decimal(data.get('amount')),
+            type='expense',
+            category=str(data.get('category') or 'General')[:100],
+            date=next_payment - period[frequency],
+            is_recurring=True,
+            recurrence_frequency=frequency,
+            related_entity_id=entity_ids.get(data.get('relatedEntityId') or data.get('related_entity_id')),
+        )
+
+    @staticmethod
+    def _insert_transactions(user, rows, started, counts, key):
+        statuses = classify_duplicates(user, rows, stored_before=started)
+        new = [row for row, (status, _) in zip(rows, statuses) if status != 'duplicate']
+        Transaction.objects.bulk_create(new)
+        counts[key] += len(new)
+        counts['duplicates'] += len(rows) - len(new)
+
+    def _migrate_budget(self, user, uid, counts):
+        snapshot = self.db.collection('budgets').document(uid).get()
+        if not snapshot.exists:
+            snapshot = next((page[0] for page in self.user_pages(BUDGET_COLLECTIONS, uid) if page), None)
+        if snapshot is None:
+            return
+
+        data = snapshot.to_dict()
+        budget, _ = Budget.objects.update_or_create(
+            user=user,
+            defaults={'monthly_income': _decimal(data.get('monthlyIncome')), 'is_setup': bool(data.get('isSetup', False))},
+        )
+        names = set(budget.fixed_expenses.values_list('name', flat=True))
+        new = [
+            FixedExpense(
+                budget=budget,
+                name=str(expense.get('name') or '')[:255],
+                amount=_decimal(expense.get('amount')),
+                category=str(expense.get('category') or 'General')[:100],
+            )
+            for expense in data.get('fixedExpenses') or []
+            if expense.get('name') and expense.get('name') not in names
+        ]
+        FixedExpense.objects.bulk_create(new)
+        counts['fixed_expenses'] += len(new)
@@ -0,0 +1,202 @@
+import hashlib
+import heapq
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from .automaton import normalize_phrase
+
+# Candidates kept after the trigram filter for the edit-distance rerank
+SHORTLIST_SIZE = 8
+
+# Scored word windows kept in a caller's window cache (oldest dropped first)
+WINDOW_CACHE_SIZE = 512
+
+# Nombres de hasta EXACT_NAME_LENGTH letras solo coinciden exactos ("caja" no es
+# "casa" ni "cada"), y hasta ONE_EDIT_NAME_LENGTH con una edición como máximo
+EXACT_NAME_LENGTH = 4
+ONE_EDIT_NAME_LENGTH = 7
+
+
+def trigrams(text):
+    """
+    Character trigrams of an already normalized string, padded with spaces so
+    short names like "bbva" still produce a few.
+    """
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a, b, bound):
+    """
+    Levenshtein distance between `a` and `b`, or None as soon as it is known
+    to exceed `bound`. Only the diagonal band of width 2 * bound is computed.
+    """
+    if abs(len(a) - len(b)) > bound:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        low = max(1, i - bound)
+        high = min(len(b), i + bound)
+        current = [bound + 1] * (len(b) + 1)
+        current[0] = i
+        for j in range(low, high + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[low - 1:high + 1]) > bound:
+            return None
+        previous = current
+
+    distance = previous[len(b)]
+    return distance if distance <= bound else None
+
+
+def allowed_edits(length, threshold):
+    """
+    Edits a name of `length` letters may differ by: what `threshold` allows,
+    but none for short names and one for medium ones, which common words
+    are otherwise one edit away from.
+    """
+    if length <= EXACT_NAME_LENGTH:
+        return 0
+    bound = int(length * (1 - threshold))
+    return min(bound, 1) if length <= ONE_EDIT_NAME_LENGTH else bound
+
+
+@lru_cache(maxsize=1024)
+def _normalize_char(char):
+    return normalize_phrase(char).replace(' ', '')
+
+
+def word_spans(text):
+    """
+    The words of `normalize_phrase(text)` as (word, start, end), where
+    text[start:end] is the word as written (accents and case included).
+    """
+    spans = []
+    word, start, end = '', None, None
+    for position, char in enumerate(text):
+        if start is not None and unicodedata.combining(char):
+            end = position + 1
+            continue
+        normalized = _normalize_char(char)
+        if normalized:
+            if start is None:
+                start = position
+            word += normalized
+            end = position + 1
+        elif start is not None:
+            spans.append((word, start, end))
+            word, start = '', None
+    if start is not None:
+        spans.append((word, start, end))
+    return spans
+
+
+class FuzzyMatcher:
+    """
+    Approximate matcher of names (entities, categories) inside an utterance,
+    for speech-to-text errors like "tarjeta bebeva" -> "Tarjeta BBVA".
+
+    Names are normalized with `normalize_phrase()` and indexed by character
+    trigram once. A lookup ranks every (word window of the text, name) pair by
+    shared trigrams (Dice coefficient) and reranks only the best few by a
+    bounded edit distance, spaces ignored so "tarjeta be be va" still reads
+    "tarjeta bbva". Short names must match exactly (see `allowed_edits`).
+    """
+
+    def __init__(self, names=()):
+        self._names = []  # [(name without spaces, trigram count, value)]
+        # word count -> trigram -> [name position]
+        self._index = defaultdict(lambda: defaultdict(list))
+        self._max_words = 0
+        digest = hashlib.sha1()
+        for name, value in names:
+            normalized = normalize_phrase(name)
+            if not normalized:
+                continue
+            grams = trigrams(normalized)
+            position = len(self._names)
+            word_count = normalized.count(' ') + 1
+            self._names.append((normalized.replace(' ', ''), len(grams), value))
+            self._max_words = max(self._max_words, word_count)
+            for gram in grams:
+                self._index[word_count][gram].append(position)
+            digest.update(repr((normalized, value)).encode('utf-8'))
+        # Identifica los nombres y su orden: las cachés de ventanas guardan posiciones
+        self.digest = digest.hexdigest()
+
+    def __len__(self):
+        return len(self._names)
+
+    def match(self, text, threshold=0.6, window_cache=None):
+        """
+        Returns (value, score, (start, end)) for the best name found in
+        `text`, or None if no name scores at least `threshold`. `score` is
+        1 - distance / length (1.0 for an exact match) and text[start:end] is
+        the matched span as written.
+
+        `window_cache` is a dict the caller keeps between calls over a
+        growing text (live transcripts): the trigram scores of each word
+        window are stored there, so only windows with new words are scored.
+        """
+        spans = word_spans(text)
+        if not spans or not self._names:
+            return None
+        words = [word for word, _, _ in spans]
+
+        if window_cache is not None and window_cache.get('digest') != self.digest:
+            window_cache.clear()
+            window_cache.update(digest=self.digest, windows={})
+        windows = window_cache['windows'] if window_cache is not None else None
+
+        # A name may be heard as one more word than it has ("bbva" -> "be be va"),
+        # never as fewer: "tarjeta" alone is not "tarjeta oro"
+        names = self._names
+        pairs = []
+        for size in range(1, min(self._max_words + 1, len(words)) + 1):
+            for start in range(len(words) - size + 1):
+                window = ' '.join(words[start:start + size])
+                scores = windows.get(window) if windows is not None else None
+                if scores is None:
+                    scores = self._score_window(window, size)
+                    if windows is not None:
+                        if len(windows) >= WINDOW_CACHE_SIZE:
+                            windows.pop(next(iter(windows)))
+                        windows[window] = scores
+                pairs.extend((score, window, position, start, size) for score, position in scores)
+
+        best = None
+        for _, window, position, start, size in heapq.nlargest(SHORTLIST_SIZE, pairs, key=lambda pair: pair[0]):
+            name, _, value = names[position]
+            candidate = window.replace(' ', '')
+            length = max(len(candidate), len(name))
+            distance = bounded_edit_distance(candidate, name, allowed_edits(len(name), threshold))
+            if distance is None:
+                continue
+            score = 1 - distance / length
+            if best is None or score > best[1] or (score == best[1] and len(window) > len(best[2])):
+                best = (value, score, window, (spans[start][1], spans[start + size - 1][2]))
+        if best is None:
+            return None
+        value, score, _, span = best
+        return value, score, span
+
+    def _score_window(self, window, size):
+        """[(Dice coefficient, name position)] for the names sharing trigrams with `window`."""
+        grams = trigrams(window)
+        shared = defaultdict(int)
+        for word_count in (size, size - 1):
+            index = self._index.get(word_count)
+            if not index:
+                continue
+            for gram in grams:
+                for position in index.get(gram, ()):
+                    shared[position] += 1
+        window_grams = len(grams)
+        return [
+            (2 * count / (window_grams + self._names[position][1]), position)
+            for position, count in shared.items()
+        ]
@@ -0,0 +1,181 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from django.conf import settings
+
+# Artifact layout (little-endian):
+#   magic b'FCGM' | format version (u32) | header length (u32) | header JSON
+#   token offsets: (n_tokens + 1) x u32 into the token blob
+#   token blob: UTF-8 tokens, sorted by their bytes, concatenated
+#   counts: n_tokens x n_categories x u32, one row per token
+# Tokens are found by binary search directly over the buffer, so a large
+# artifact can be memory-mapped instead of parsed into Python objects.
+MAGIC = b'FCGM'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<4sII')
+
+# Artifacts above this size are memory-mapped rather than read into memory
+MMAP_THRESHOLD_BYTES = 4 * 1024 * 1024
+
+
+def write_global_model(path, categories, doc_counts, token_rows):
+    """
+    Writes the artifact. `categories` and `doc_counts` are parallel lists;
+    `token_rows` maps token -> list of per-category counts.
+    """
+    tokens = sorted(token_rows, key=lambda t: t.encode('utf-8'))
+    word_counts = [0] * len(categories)
+    for row in token_rows.values():
+        for i, count in enumerate(row):
+            word_counts[i] += count
+
+    header = json.dumps({
+        'categories': categories,
+        'doc_counts': doc_counts,
+        'word_counts': word_counts,
+        'n_tokens': len(tokens),
+    }, separators=(',', ':')).encode('utf-8')
+
+    blob = bytearray()
+    offsets = [0]
+    for token in tokens:
+        blob += token.encode('utf-8')
+        offsets.append(len(blob))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        f.write(blob)
+        row_format = struct.Struct(f'<{len(categories)}I')
+        for token in tokens:
+            f.write(row_format.pack(*token_rows[token]))
+    os.replace(tmp_path, path)
+
+
+class GlobalCategoryModel:
+    """
+    Read-only view over a global category model artifact, trained across all
+    users by the `train_global_category_model` command. Category names are
+    normalized (see `wallet.automaton.normalize_phrase`).
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        magic, version, header_length = _PREFIX.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('Unsupported global category model artifact')
+
+        position = _PREFIX.size
+        header = json.loads(bytes(buffer[position:position + header_length]).decode('utf-8'))
+        position += header_length
+
+        self.categories = header['categories']
+        self.category_index = {category: i for i, category in enumerate(self.categories)}
+        self.doc_counts = header['doc_counts']
+        self.word_counts = header['word_counts']
+        self.total_docs = sum(self.doc_counts)
+        self.vocab_size = header['n_tokens']
+
+        self._offsets_start = position
+        position += 4 * (self.vocab_size + 1)
+        self._blob_start = position
+        blob_length = struct.unpack_from('<I', buffer, position - 4)[0]
+        self._rows_start = position + blob_length
+        self._row_format = struct.Struct(f'<{len(self.categories)}I')
+        self.token_counts = lru_cache(maxsize=65536)(self._token_counts)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD_BYTES:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            return cls(f.read())
+
+    def _token_at(self, index):
+        start, end = struct.unpack_from('<II', self._buffer, self._offsets_start + 4 * index)
+        return bytes(self._buffer[self._blob_start + start:self._blob_start + end])
+
+    def _token_counts(self, token):
+        """
+        Per-category counts of a token (tuple), or None if it is not in the
+        vocabulary.
+        """
+        key = token.encode('utf-8')
+        index = bisect_left(_TokenView(self), key)
+        if index == self.vocab_size or self._token_at(index) != key:
+            return None
+        return self._row_format.unpack_from(self._buffer, self._rows_start + index * self._row_format.size)
+
+    def __contains__(self, token):
+        return self.token_counts(token) is not None
+
+    def doc_share(self, category_index):
+        return self.doc_counts[category_index] / self.total_docs
+
+    def token_prob(self, category_index, counts):
+        """
+        Laplace-smoothed P(token | category) from a `token_counts()` row
+        (None for an unseen token).
+        """
+        count = counts[category_index] if counts else 0
+        return (count + 1) / (self.word_counts[category_index] + self.vocab_size)
+
+
+class _TokenView:
+    """Sequence adapter so bisect can search the sorted token blob in place."""
+
+    def __init__(self, model):
+        self._model = model
+
+    def __len__(self):
+        return self._model.vocab_size
+
+    def __getitem__(self, index):
+        return self._model._token_at(index)
+
+
+_global_model = None
+_global_model_loaded = False
+_global_model_lock = threading.Lock()
+
+
+def get_global_model():
+    """
+    Returns the worker's global model, loading it on first use from
+    settings.GLOBAL_CATEGORY_MODEL_PATH, or None if there is no artifact.
+    """
+    global _global_model, _global_model_loaded
+    if not _global_model_loaded:
+        with _global_model_lock:
+            if not _global_model_loaded:
+                _global_model = load_global_model()
+                _global_model_loaded = True
+    return _global_model
+
+
+def load_global_model(path=None):
+    path = path or getattr(settings, 'GLOBAL_CATEGORY_MODEL_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return GlobalCategoryModel.load(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error loading global category model: {e}")
+        return None
+
+
+def reset_global_model(model=None):
+    """
+    Replaces the worker's global model (None forces a reload on next use).
+    Used after retraining and in tests.
+    """
+    global _global_model, _global_model_loaded
+    with _global_model_lock:
+        _global_model = model
+        _global_model_loaded = model is not None
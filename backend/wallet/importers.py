@@ -0,0 +1,524 @@
+import codecs
+import csv
+import datetime
+import re
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import openpyxl
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from .automaton import normalize_phrase
+from .bank_notifications import parse_notification_date
+from .fingerprints import classify_duplicates
+from .ml import get_category_predictor, reset_category_model
+from .models import Transaction, VisionEntity
+from .signals import recompute_balances
+
+# Statement rows parsed, categorized and inserted per step (one progress event each)
+IMPORT_CHUNK_SIZE = 2000
+
+IMPORT_FORMATS = ('xlsx', 'csv', 'ofx')
+
+# Row errors kept in the import summary; the rest are only counted
+IMPORT_MAX_ERRORS = 50
+
+# Rows scanned for the header when a profile does not fix `header_row`
+HEADER_SCAN_ROWS = 30
+
+# Columns a profile can map. Each one is a header name (compared without
+# accents, case or punctuation), a 0-based column index, or a list of
+# candidates; the first one present wins.
+PROFILE_COLUMNS = ('date', 'description', 'amount', 'debit', 'credit', 'type', 'category', 'payment_type')
+
+# Other profile settings:
+#   header_row    1-based row with the headers; 0 = no header (indexes only).
+#                 By default the first row naming the required columns.
+#   date_format   strptime format; by default ISO dates and day-first dates
+#   decimal       decimal separator of text amounts: '.' (default) or ','
+#   invert_sign   positive amounts are expenses (credit card statements)
+#   delimiter     CSV delimiter; sniffed by default
+#   encoding      CSV encoding; UTF-8, or cp1252 when the file is not UTF-8
+#   sheet         XLSX sheet name; the active sheet by default
+PROFILE_OPTIONS = ('header_row', 'date_format', 'decimal', 'invert_sign', 'delimiter', 'encoding', 'sheet')
+
+GENERIC_PROFILE = {
+    'date': [
+        'fecha', 'fecha operacion', 'fecha de operacion', 'fecha movimiento', 'fecha de movimiento',
+        'fecha valor', 'date', 'transaction date', 'posted date',
+    ],
+    'description': [
+        'descripcion', 'concepto', 'concepto referencia', 'detalle', 'movimiento', 'description',
+        'details', 'payee', 'memo', 'referencia',
+    ],
+    'amount': ['monto', 'importe', 'cantidad', 'amount', 'valor'],
+    'debit': ['cargo', 'cargos', 'retiro', 'retiros', 'debito', 'debit', 'withdrawal', 'withdrawals'],
+    'credit': ['abono', 'abonos', 'deposito', 'depositos', 'credito', 'credit', 'deposit', 'deposits'],
+    'type': ['tipo', 'type'],
+    'category': ['categoria', 'category'],
+    'payment_type': ['payment type', 'tipo de pago'],
+}
+
+IMPORT_PROFILES = {
+    'generic': GENERIC_PROFILE,
+    # Card statements list charges as positive amounts
+    'credit_card': {**GENERIC_PROFILE, 'invert_sign': True},
+    # The app's own CSV export
+    'flowcash': {
+        'date': 'date', 'description': 'description', 'amount': 'amount', 'type': 'type',
+        'category': 'category', 'payment_type': 'payment_type', 'header_row': 1,
+    },
+}
+
+# Values of a "type" column; anything else falls back to the amount sign
+TYPE_VALUES = {
+    'income': 'income', 'ingreso': 'income', 'abono': 'income', 'deposito': 'income', 'credito': 'income',
+    'credit': 'income',
+    'expense': 'expense', 'gasto': 'expense', 'cargo': 'expense', 'retiro': 'expense', 'debito': 'expense',
+    'debit': 'expense',
+    'transfer': 'transfer', 'transferencia': 'transfer',
+}
+
+PAYMENT_TYPES = {value for value, _ in Transaction.PAYMENT_TYPES}
+
+_OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)(?=</STMTTRN>|<STMTTRN>|</BANKTRANLIST>|\Z)', re.IGNORECASE | re.DOTALL)
+_OFX_FIELD = r'<{}>\s*([^<\r\n]*)'
+_COMPACT_DATE = re.compile(r'(\d{4})(\d{2})(\d{2})(?:(\d{2})(\d{2})(\d{2})?)?')
+
+
+def get_import_profile(profile):
+    """
+    Resolves a profile name (built in or from the STATEMENT_IMPORT_PROFILES
+    setting) or a custom mapping dict. Raises ValueError for unknown names,
+    unknown keys or mappings without date, description and amount columns.
+    """
+    if profile is None or profile == '':
+        profile = 'generic'
+    if isinstance(profile, str):
+        profiles = {**IMPORT_PROFILES, **getattr(settings, 'STATEMENT_IMPORT_PROFILES', {})}
+        if profile not in profiles:
+            raise ValueError(f"Unknown import profile: {profile}")
+        profile = profiles[profile]
+    if not isinstance(profile, dict):
+        raise ValueError("An import profile is a name or a column mapping")
+
+    unknown = set(profile) - set(PROFILE_COLUMNS) - set(PROFILE_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown profile keys: {', '.join(sorted(unknown))}")
+
+    resolved = {key: profile[key] for key in PROFILE_OPTIONS if profile.get(key) not in (None, '')}
+    for key in PROFILE_COLUMNS:
+        candidates = profile.get(key)
+        if candidates is None:
+            candidates = []
+        elif not isinstance(candidates, list):
+            candidates = [candidates]
+        for candidate in candidates:
+            if isinstance(candidate, bool) or not isinstance(candidate, (str, int)):
+                raise ValueError(f"Invalid column for {key}: {candidate!r}")
+        resolved[key] = [c if isinstance(c, int) else normalize_phrase(c) for c in candidates]
+
+    if not resolved['date'] or not resolved['description']:
+        raise ValueError("An import profile needs date and description columns")
+    if not (resolved['amount'] or resolved['debit'] or resolved['credit']):
+        raise ValueError("An import profile needs an amount column or debit/credit columns")
+    if resolved.get('decimal', '.') not in ('.', ','):
+        raise ValueError("decimal must be '.' or ','")
+    header_row = resolved.get('header_row')
+    if header_row is not None and (isinstance(header_row, bool) or not isinstance(header_row, int) or header_row < 0):
+        raise ValueError("header_row must be a row number (0 for no header)")
+    return resolved
+
+
+def detect_import_format(fileobj, filename=None):
+    """'xlsx', 'csv' or 'ofx' from the file name, else from the first bytes."""
+    extension = (filename or '').rsplit('.', 1)[-1].lower() if '.' in (filename or '') else ''
+    if extension in ('xlsx', 'xlsm'):
+        return 'xlsx'
+    if extension in ('ofx', 'qfx'):
+        return 'ofx'
+    if extension in ('csv', 'txt', 'tsv'):
+        return 'csv'
+
+    head = fileobj.read(512)
+    fileobj.seek(0)
+    if head.startswith(b'PK'):
+        return 'xlsx'
+    if b'OFXHEADER' in head.upper() or b'<OFX>' in head.upper():
+        return 'ofx'
+    return 'csv'
+
+
+def _parse_date(value, date_format=None):
+    if isinstance(value, datetime.datetime):
+        # Las celdas de solo fecha llegan de openpyxl como medianoche
+        moment = value.replace(hour=12) if timezone.is_naive(value) and value.time() == datetime.time(0) else value
+    elif isinstance(value, datetime.date):
+        moment = datetime.datetime.combine(value, datetime.time(12))
+    else:
+        text = str(value or '').strip()
+        if not text:
+            raise ValueError("missing date")
+        if date_format:
+            moment = datetime.datetime.strptime(text, date_format)
+        else:
+            moment = _parse_date_text(text)
+            if moment is None:
+                raise ValueError(f"unrecognized date {text!r}")
+
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _parse_date_text(text):
+    # ISO (exportaciones, CSV de bancos en línea) y compacto de OFX: año primero
+    try:
+        return datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        pass
+    match = _COMPACT_DATE.match(text)
+    if match and len(text) >= 8 and text[:8].isdigit():
+        year, month, day, hour, minute, second = (int(part or 0) for part in match.groups())
+        if hour == minute == second == 0:
+            hour = 12
+        try:
+            return datetime.datetime(year, month, day, hour, minute, second)
+        except ValueError:
+            return None
+    # Estados de cuenta mexicanos: día primero, con mes numérico o abreviado
+    date = parse_notification_date(text.lower())
+    return datetime.datetime.combine(date, datetime.time(12)) if date else None
+
+
+def _parse_amount(value, decimal='.'):
+    """Decimal from a cell ("$1,234.50", "(80.00)", "1.234,50", 12.5), None when empty."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+
+    text = str(value).strip()
+    negative = (text.startswith('(') and text.endswith(')')) or text.endswith('-')
+    text = re.sub(r'[^\d,.\-]', '', text.strip('()').rstrip('-'))
+    if not text or text == '-':
+        return None
+    if decimal == ',':
+        text = text.replace('.', '').replace(',', '.')
+    else:
+        text = text.replace(',', '')
+    try:
+        amount = Decimal(text).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"unrecognized amount {value!r}")
+    return -amount if negative else amount
+
+
+class StatementReader:
+    """
+    Reads a statement as mapped rows without loading it whole: XLSX through
+    openpyxl's read-only mode, CSV line by line and OFX one <STMTTRN> at a
+    time. The header is located on construction, so a file that does not fit
+    the profile raises ValueError before anything is imported.
+
+    Iterating yields (line number, {column: raw value}); `total` is the
+    number of data rows when the format tells it upfront (else None).
+    """
+
+    def __init__(self, fileobj, file_format=None, profile=None, filename=None):
+        self.profile = get_import_profile(profile)
+        self.format = file_format or detect_import_format(fileobj, filename)
+        if self.format not in IMPORT_FORMATS:
+            raise ValueError(f"Unsupported statement format: {self.format}")
+        self.fileobj = fileobj
+        self.total = None
+        self._workbook = None
+        try:
+            self._rows = self._ofx_rows() if self.format == 'ofx' else self._table_rows()
+        except Exception:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+    def _table_rows(self):
+        if self.format == 'xlsx':
+            lines = self._xlsx_lines()
+        else:
+            lines = self._csv_lines()
+
+        header_row = self.profile.get('header_row')
+        if header_row == 0:
+            columns = self._map_columns(None)
+        else:
+            scanned = list(islice(lines, header_row or HEADER_SCAN_ROWS))
+            first = header_row - 1 if header_row else 0
+            columns = None
+            for position in range(first, len(scanned)):
+                columns = self._map_columns(scanned[position][1])
+                if columns is not None:
+                    break
+            if columns is None:
+                raise ValueError("No header row with the profile's date, description and amount columns")
+            lines = _chain(scanned[position + 1:], lines)
+            if self.total is not None:
+                self.total = max(self.total - position - 1, 0)
+
+        return self._mapped_rows(lines, columns)
+
+    def _map_columns(self, header):
+        names = [normalize_phrase(value) for value in header] if header is not None else []
+        columns = {}
+        for key in PROFILE_COLUMNS:
+            for candidate in self.profile[key]:
+                if isinstance(candidate, int):
+                    columns[key] = candidate
+                    break
+                if candidate in names:
+                    columns[key] = names.index(candidate)
+                    break
+        if 'date' not in columns or 'description' not in columns:
+            return None
+        if not ({'amount', 'debit', 'credit'} & set(columns)):
+            return None
+        return columns
+
+    @staticmethod
+    def _mapped_rows(lines, columns):
+        for line, values in lines:
+            if not any(value not in (None, '') and str(value).strip() for value in values):
+                continue
+            yield line, {key: values[index] if index < len(values) else None for key, index in columns.items()}
+
+    def _xlsx_lines(self):
+        try:
+            self._workbook = openpyxl.load_workbook(self.fileobj, read_only=True, data_only=True)
+        except Exception as e:
+            raise ValueError(f"Unreadable XLSX file: {e}")
+        sheet = self.profile.get('sheet')
+        if sheet and sheet not in self._workbook.sheetnames:
+            raise ValueError(f"No sheet named {sheet}")
+        worksheet = self._workbook[sheet] if sheet else self._workbook.active
+        self.total = worksheet.max_row
+        return self._closing(enumerate(worksheet.iter_rows(values_only=True), start=1))
+
+    def _closing(self, rows):
+        try:
+            yield from rows
+        finally:
+            self.close()
+
+    def _csv_lines(self):
+        sample = self.fileobj.read(64 * 1024)
+        self.fileobj.seek(0)
+        encoding = self.profile.get('encoding')
+        if not encoding:
+            try:
+                codecs.getincrementaldecoder('utf-8')().decode(sample)
+                encoding = 'utf-8-sig'
+            except UnicodeDecodeError:
+                encoding = 'cp1252'
+        try:
+            text = sample.decode(encoding, errors='ignore')
+        except LookupError:
+            raise ValueError(f"Unknown encoding: {encoding}")
+
+        delimiter = self.profile.get('delimiter')
+        if not delimiter:
+            try:
+                delimiter = csv.Sniffer().sniff('\n'.join(text.splitlines()[:20]), delimiters=',;\t|').delimiter
+            except csv.Error:
+                delimiter = ','
+        reader = csv.reader(codecs.iterdecode(self.fileobj, encoding), delimiter=delimiter)
+        return ((reader.line_num, row) for row in reader)
+
+    def _ofx_rows(self):
+        data = self.fileobj.read()
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.decode('cp1252', errors='replace')
+        if '<STMTTRN>' not in text.upper():
+            raise ValueError("No transactions in the OFX file")
+        self.total = len(re.findall('<STMTTRN>', text, re.IGNORECASE))
+
+        def rows():
+            for index, match in enumerate(_OFX_TRANSACTION.finditer(text), start=1):
+                block = match.group(1)
+                fields = {}
+                for tag in ('DTPOSTED', 'TRNAMT', 'NAME', 'MEMO', 'TRNTYPE'):
+                    found = re.search(_OFX_FIELD.format(tag), block, re.IGNORECASE)
+                    fields[tag] = found.group(1).strip() if found else ''
+                yield index, {
+                    'date': fields['DTPOSTED'][:14],
+                    'description': fields['NAME'] or fields['MEMO'],
+                    'amount': fields['TRNAMT'],
+                }
+
+        return rows()
+
+
+def _chain(first, rest):
+    yield from first
+    yield from rest
+
+
+def parse_statement_row(values, profile):
+    """
+    (date, description, type, amount, category, payment_type) of a mapped
+    row. Raises ValueError with the reason when the row cannot be imported.
+    """
+    date = _parse_date(values.get('date'), profile.get('date_format'))
+    description = str(values.get('description') or '').strip()
+    if not description:
+        raise ValueError("missing description")
+
+    decimal = profile.get('decimal', '.')
+    amount = _parse_amount(values.get('amount'), decimal)
+    if amount is None:
+        debit = _parse_amount(values.get('debit'), decimal)
+        credit = _parse_amount(values.get('credit'), decimal)
+        if debit:
+            amount = -abs(debit)
+        elif credit:
+            amount = abs(credit)
+    elif profile.get('invert_sign'):
+        amount = -amount
+    if not amount:
+        raise ValueError("missing amount")
+
+    transaction_type = TYPE_VALUES.get(normalize_phrase(values.get('type')))
+    if transaction_type is None:
+        transaction_type = 'expense' if amount < 0 else 'income'
+    if abs(amount) >= Decimal('1e10'):
+        raise ValueError(f"amount out of range: {amount}")
+
+    category = str(values.get('category') or '').strip()[:100] or None
+    payment_type = str(values.get('payment_type') or '').strip()
+    return date, description[:255], transaction_type, abs(amount), category, payment_type if payment_type in PAYMENT_TYPES else None
+
+
+def _check_entity(user, entity_id):
+    if entity_id in (None, ''):
+        return None
+    try:
+        entity_pk = int(entity_id)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid entity_id: {entity_id}")
+    if not VisionEntity.objects.filter(user=user, pk=entity_pk).exists():
+        raise ValueError(f"Unknown entity_id: {entity_id}")
+    return str(entity_pk)
+
+
+def import_statement_events(user, reader, entity_id=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports the rows of a StatementReader into `user`'s account and returns
+    a generator of progress events: one {"processed", "imported", "skipped",
+    "duplicates", "total"} per chunk and a final one with "done", the
+    income/expense totals, the first row errors and the probable duplicates.
+
+    Each chunk is committed in its own database transaction before its
+    event is yielded, so no transaction stays open while the caller streams
+    the progress: rows already stored (same fingerprint) are skipped, rows
+    missing a category get one from the batch predictor, the rest are
+    written with bulk_create and their balance effect on `entity_id` is
+    applied once per chunk. An import stopped halfway keeps the chunks
+    already reported; importing the statement again skips them as
+    duplicates. Rows that cannot be parsed are skipped and reported;
+    probable duplicates are imported and reported with the stored row they
+    resemble.
+    """
+    try:
+        entity_id = _check_entity(user, entity_id)
+    except ValueError:
+        reader.close()
+        raise
+    profile = reader.profile
+
+    def events():
+        progress = {'processed': 0, 'imported': 0, 'skipped': 0, 'duplicates': 0, 'total': reader.total}
+        totals = {'income': Decimal(0), 'expense': Decimal(0), 'transfer': Decimal(0)}
+        errors, probable = [], []
+        started = timezone.now()
+        # Se carga una vez: reset_category_model en cada chunk no lo reconstruye a mitad del import
+        predictor = None
+        rows = iter(reader)
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                objects, lines = [], []
+                for line, values in chunk:
+                    try:
+                        date, description, transaction_type, amount, category, payment_type = parse_statement_row(values, profile)
+                    except ValueError as e:
+                        progress['skipped'] += 1
+                        if len(errors) < IMPORT_MAX_ERRORS:
+                            errors.append({'line': line, 'error': str(e)})
+                        continue
+                    objects.append(Transaction(
+                        user=user, date=date, description=description, type=transaction_type, amount=amount,
+                        category=category, payment_type=payment_type, related_entity_id=entity_id,
+                    ))
+                    lines.append(line)
+
+                # Filas ya importadas (estados de cuenta que se traslapan) no se repiten
+                statuses = classify_duplicates(user, objects, stored_before=started)
+                new_objects = []
+                for obj, line, (status, existing) in zip(objects, lines, statuses):
+                    if status == 'duplicate':
+                        progress['duplicates'] += 1
+                        continue
+                    if status == 'probable_duplicate' and len(probable) < IMPORT_MAX_ERRORS:
+                        probable.append({'line': line, 'transaction_id': existing})
+                    new_objects.append(obj)
+                objects = new_objects
+
+                missing = [obj for obj in objects if obj.category is None]
+                if missing:
+                    if predictor is None:
+                        predictor = get_category_predictor(user)
+                    for obj, category in zip(missing, predictor.predict_many([obj.description for obj in missing])):
+                        obj.category = category
+                for obj in objects:
+                    totals[obj.type] += obj.amount
+
+                if objects:
+                    with db_transaction.atomic():
+                        Transaction.objects.bulk_create(objects)
+                        # bulk_create no pasa por las señales de saldos ni por las de conteo del predictor
+                        recompute_balances(objects)
+                        reset_category_model(user.pk)
+
+                progress['processed'] += len(chunk)
+                progress['imported'] += len(objects)
+                yield dict(progress)
+        finally:
+            reader.close()
+
+        yield {
+            **progress,
+            'done': True,
+            'income': str(totals['income']),
+            'expense': str(totals['expense']),
+            'transfer': str(totals['transfer']),
+            'errors': errors,
+            'probable_duplicates': probable,
+        }
+
+    return events()
+
+
+def import_statement(user, reader, entity_id=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Runs a whole import and returns its final summary event."""
+    summary = None
+    for summary in import_statement_events(user, reader, entity_id, chunk_size):
+        pass
+    return summary
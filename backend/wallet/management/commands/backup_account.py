@@ -0,0 +1,25 @@
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from wallet.backup import write_backup
+
+
+class Command(BaseCommand):
+    help = "Write a user's full backup (gzip-compressed JSON lines) to a file or stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', type=str)
+        parser.add_argument('--output', type=str, help='Destination file (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        if options.get('output'):
+            with open(options['output'], 'wb') as output:
+                write_backup(user, output)
+            self.stderr.write(self.style.SUCCESS(f"Backup of {user.username} written to {options['output']}"))
+        else:
+            write_backup(user, sys.stdout.buffer)
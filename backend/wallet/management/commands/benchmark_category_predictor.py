@@ -0,0 +1,145 @@
+import csv
+import json
+import random
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from wallet.models import Transaction
+from wallet.ml import CategoryPredictor
+
+# Synthetic corpus: each category has its own merchants/words, and every
+# description mixes in shared noise so the classes overlap realistically.
+SYNTHETIC_VOCABULARY = {
+    'Comida': ['tacos', 'tortas', 'pizza', 'sushi', 'restaurante', 'cafe', 'panaderia', 'hamburguesa'],
+    'Transporte': ['uber', 'didi', 'metro', 'gasolina', 'caseta', 'estacionamiento', 'taxi', 'camion'],
+    'Supermercado': ['walmart', 'soriana', 'costco', 'chedraui', 'despensa', 'mandado', 'frutas', 'verduras'],
+    'Servicios': ['cfe', 'telmex', 'izzi', 'agua', 'luz', 'internet', 'telefono', 'recibo'],
+    'Entretenimiento': ['netflix', 'spotify', 'cine', 'steam', 'concierto', 'boletos', 'teatro', 'videojuego'],
+    'Salud': ['farmacia', 'doctor', 'consulta', 'dentista', 'medicinas', 'laboratorio', 'analisis', 'gimnasio'],
+    'Hogar': ['renta', 'mantenimiento', 'muebles', 'plomero', 'limpieza', 'ferreteria', 'jardin', 'pintura'],
+    'Ingresos': ['sueldo', 'nomina', 'deposito', 'bono', 'aguinaldo', 'reembolso', 'honorarios', 'venta'],
+}
+SYNTHETIC_NOISE = ['centro', 'norte', 'sur', 'sucursal', 'mexico', 'online', 'tienda', 'plaza', 'mensual', 'semana']
+
+
+def synthetic_corpus(size, seed):
+    rng = random.Random(seed)
+    categories = list(SYNTHETIC_VOCABULARY)
+    corpus = []
+    for _ in range(size):
+        category = rng.choice(categories)
+        words = rng.sample(SYNTHETIC_VOCABULARY[category], k=rng.randint(1, 2))
+        # Some descriptions borrow a word from another category
+        if rng.random() < 0.15:
+            words.append(rng.choice(SYNTHETIC_VOCABULARY[rng.choice(categories)]))
+        words += rng.sample(SYNTHETIC_NOISE, k=rng.randint(0, 2))
+        rng.shuffle(words)
+        corpus.append((' '.join(words), category))
+    return corpus
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark CategoryPredictor accuracy and latency with k-fold cross validation (JSON report)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', type=str, help='CSV (description,category) or JSON list of [description, category]')
+        parser.add_argument('--username', type=str, help="Use this user's transactions as the corpus")
+        parser.add_argument('--synthetic', type=int, default=2000, help='Size of the synthetic corpus (default source)')
+        parser.add_argument('--folds', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--with-category-names', action='store_true',
+            help='Give the predictor the corpus category names, enabling the name/keyword strategies',
+        )
+
+    def handle(self, *args, **options):
+        corpus, source = self.load_corpus(options)
+        folds = options['folds']
+        if folds < 2 or len(corpus) < folds:
+            raise CommandError(f'Need at least {folds} documents and 2 folds (got {len(corpus)})')
+
+        rng = random.Random(options['seed'])
+        corpus = list(corpus)
+        rng.shuffle(corpus)
+        category_names = {category.lower() for _, category in corpus}
+
+        correct = 0
+        evaluated = 0
+        train_times = []
+        latencies = []
+        peak_memory = 0
+        model_bytes = 0
+
+        for fold in range(folds):
+            test = corpus[fold::folds]
+            train = [doc for i, doc in enumerate(corpus) if i % folds != fold]
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            predictor = CategoryPredictor(None)
+            predictor.fit(train)
+            if options['with_category_names']:
+                predictor.user_categories = set(category_names)
+            train_times.append(time.perf_counter() - started)
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            model_bytes = max(model_bytes, len(predictor.dumps()))
+
+            for description, category in test:
+                started = time.perf_counter()
+                predicted = predictor.predict(description)
+                latencies.append(time.perf_counter() - started)
+                evaluated += 1
+                if predicted and predicted.lower() == category.lower():
+                    correct += 1
+
+        latencies.sort()
+        report = {
+            'source': source,
+            'documents': len(corpus),
+            'categories': len(category_names),
+            'folds': folds,
+            'accuracy': round(correct / evaluated, 4),
+            'train_seconds_mean': round(sum(train_times) / len(train_times), 6),
+            'predict_ms_p50': round(percentile(latencies, 0.50) * 1000, 4),
+            'predict_ms_p99': round(percentile(latencies, 0.99) * 1000, 4),
+            'train_peak_memory_bytes': peak_memory,
+            'serialized_model_bytes': model_bytes,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def load_corpus(self, options):
+        if options.get('corpus'):
+            path = options['corpus']
+            with open(path, encoding='utf-8') as f:
+                if path.endswith('.json'):
+                    rows = json.load(f)
+                else:
+                    rows = list(csv.reader(f))
+            corpus = [(str(r[0]), str(r[1])) for r in rows if len(r) >= 2 and r[0] and r[1]]
+            return corpus, path
+
+        if options.get('username'):
+            user = get_user_model().objects.filter(username=options['username']).first()
+            if user is None:
+                raise CommandError(f"User {options['username']} not found")
+            corpus = list(Transaction.objects.filter(user=user).exclude(
+                description__isnull=True
+            ).exclude(
+                description__exact=''
+            ).exclude(
+                category__isnull=True
+            ).exclude(
+                category__exact=''
+            ).values_list('description', 'category'))
+            return corpus, f"user:{user.username}"
+
+        return synthetic_corpus(options['synthetic'], options['seed']), f"synthetic:{options['synthetic']}"
@@ -0,0 +1,150 @@
+import json
+import random
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from wallet.spanish_numbers import find_spanish_numbers
+from wallet.management.commands.benchmark_category_predictor import percentile
+
+# Hand-labelled speech-to-text utterances (malformed ones included): the default corpus
+LABELLED_CORPUS_PATH = Path(__file__).resolve().parents[2] / 'data' / 'number_utterances.json'
+
+UNITS = [
+    'cero', 'uno', 'dos', 'tres', 'cuatro', 'cinco', 'seis', 'siete', 'ocho', 'nueve',
+    'diez', 'once', 'doce', 'trece', 'catorce', 'quince', 'dieciséis', 'diecisiete', 'dieciocho', 'diecinueve',
+    'veinte', 'veintiuno', 'veintidós', 'veintitrés', 'veinticuatro', 'veinticinco', 'veintiséis',
+    'veintisiete', 'veintiocho', 'veintinueve',
+]
+TENS = ['', '', '', 'treinta', 'cuarenta', 'cincuenta', 'sesenta', 'setenta', 'ochenta', 'noventa']
+HUNDREDS = [
+    '', 'ciento', 'doscientos', 'trescientos', 'cuatrocientos', 'quinientos',
+    'seiscientos', 'setecientos', 'ochocientos', 'novecientos',
+]
+
+TEMPLATES = [
+    'gasté {n} pesos en tacos',
+    'pagué {n} de luz',
+    '{n} en gasolina con la tarjeta',
+    'ingreso de {n} pesos por nómina',
+    'compré dos tacos de {n}',
+    'anota {n} pesos con {c} centavos en el súper',
+]
+
+# Mapa de palabras del parser anterior, como referencia de la mejora
+LEGACY_WORDS = {
+    'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5,
+    'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10,
+    'veinte': 20, 'treinta': 30, 'cuarenta': 40, 'cincuenta': 50,
+    'sesenta': 60, 'setenta': 70, 'ochenta': 80, 'noventa': 90,
+    'cien': 100, 'ciento': 100, 'doscientos': 200, 'trescientos': 300,
+    'cuatrocientos': 400, 'quinientos': 500, 'mil': 1000,
+}
+
+
+def spell_below_thousand(n, apocope=False):
+    hundreds, rest = divmod(n, 100)
+    words = []
+    if hundreds:
+        words.append('cien' if n == 100 else HUNDREDS[hundreds])
+    if rest:
+        if rest < 30:
+            word = UNITS[rest]
+        else:
+            tens, units = divmod(rest, 10)
+            word = TENS[tens] + (f' y {UNITS[units]}' if units else '')
+        # "veintiún mil", "treinta y un millones"
+        if apocope and word.endswith('uno'):
+            word = word[:-3] + ('ún' if word.endswith('veintiuno') else 'un')
+        words.append(word)
+    return ' '.join(words)
+
+
+def spell_number(n):
+    """Spanish words for 0 <= n < 10**9, as speech-to-text would write them."""
+    if n == 0:
+        return 'cero'
+    millions, rest = divmod(n, 1000000)
+    thousands, rest = divmod(rest, 1000)
+    parts = []
+    if millions:
+        parts.append('un millón' if millions == 1 else f'{spell_below_thousand(millions, apocope=True)} millones')
+    if thousands:
+        parts.append('mil' if thousands == 1 else f'{spell_below_thousand(thousands, apocope=True)} mil')
+    if rest:
+        parts.append(spell_below_thousand(rest))
+    return ' '.join(parts)
+
+
+def synthetic_utterances(size, seed):
+    """
+    Utterances spelled by `spell_number`, i.e. by the grammar the parser
+    implements: parsing them back is a self-consistency check, not accuracy.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        magnitude = rng.choice([100, 1000, 10000, 1000000, 10000000])
+        n = rng.randint(3, magnitude - 1)
+        template = rng.choice(TEMPLATES)
+        cents = rng.randint(1, 99) if '{c}' in template else 0
+        text = template.format(n=spell_number(n), c=spell_number(cents))
+        corpus.append((text, round(n + cents / 100, 2)))
+    return corpus
+
+
+def legacy_amount(text):
+    return sum(LEGACY_WORDS.get(word, 0) for word in text.split())
+
+
+def parse_amount(text):
+    numbers = find_spanish_numbers(text)
+    return max(numbers, key=lambda number: number[0])[0] if numbers else 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the Spanish number parser on labelled utterances (JSON report). '
+        'With --synthetic the corpus is generated from the parser\'s own grammar, so the '
+        'score is reported as self_consistency rather than accuracy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corpus', type=str, default=str(LABELLED_CORPUS_PATH),
+            help='JSON list of [utterance, expected amount] (default: the bundled hand-labelled utterances)',
+        )
+        parser.add_argument('--synthetic', type=int, help='Use a generated corpus of this size instead')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options.get('synthetic'):
+            corpus = synthetic_utterances(options['synthetic'], options['seed'])
+            source = f"synthetic:{options['synthetic']}"
+            metric = 'self_consistency'
+        else:
+            with open(options['corpus'], encoding='utf-8') as f:
+                corpus = [(str(text), float(expected)) for text, expected in json.load(f)]
+            source = options['corpus']
+            metric = 'accuracy'
+
+        correct = 0
+        legacy_correct = 0
+        latencies = []
+        for text, expected in corpus:
+            started = time.perf_counter()
+            amount = parse_amount(text)
+            latencies.append(time.perf_counter() - started)
+            correct += abs(amount - expected) < 0.005
+            legacy_correct += abs(legacy_amount(text) - expected) < 0.005
+
+        latencies.sort()
+        report = {
+            'source': source,
+            'utterances': len(corpus),
+            metric: round(correct / len(corpus), 4) if corpus else None,
+            f'legacy_{metric}': round(legacy_correct / len(corpus), 4) if corpus else None,
+            'parse_us_p50': round(percentile(latencies, 0.50) * 1e6, 2) if corpus else None,
+            'parse_us_p99': round(percentile(latencies, 0.99) * 1e6, 2) if corpus else None,
+            'utterances_per_second': round(len(corpus) / sum(latencies)) if corpus else None,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
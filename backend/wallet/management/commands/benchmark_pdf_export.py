@@ -0,0 +1,92 @@
+import json
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from wallet.exporters import render_transactions_pdf
+from wallet.models import Transaction
+from wallet.signals import suppress_balance_signals
+
+BENCHMARK_USERNAME = '__pdf_export_benchmark__'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the PDF transaction report: render time and peak memory per row count (JSON report). '
+        'Peak memory grows linearly with the rows, since reportlab keeps finished pages until save(); '
+        'peak_memory_bytes_per_row is the growth since the previous row count.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=str, default='1000,10000,50000', help='Comma separated row counts')
+        parser.add_argument('--no-memory', action='store_true', help='Skip the (slower) tracemalloc pass')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['rows'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--rows must be a comma separated list of integers')
+
+        # Synthetic rows live in a transaction that is always rolled back
+        results = []
+        with db_transaction.atomic(), suppress_balance_signals():
+            user = get_user_model().objects.create(username=BENCHMARK_USERNAME)
+            created = 0
+            previous = None
+            for size in sorted(sizes):
+                self.create_rows(user, created, size)
+                created = size
+                result = self.measure(user, size, not options['no_memory'])
+                if previous and 'peak_memory_bytes' in result and size > previous['rows']:
+                    growth = result['peak_memory_bytes'] - previous['peak_memory_bytes']
+                    result['peak_memory_bytes_per_row'] = round(growth / (size - previous['rows']))
+                results.append(result)
+                previous = result
+            db_transaction.set_rollback(True)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def create_rows(self, user, start, end):
+        now = timezone.now()
+        types = ['expense', 'expense', 'income', 'transfer']
+        Transaction.objects.bulk_create([
+            Transaction(
+                user=user,
+                amount=Decimal(i % 5000) + Decimal('0.99'),
+                type=types[i % len(types)],
+                description=f'Synthetic transaction {i} with a longer description',
+                category=['Comida', 'Transporte', 'Servicios', None][i % 4],
+                payment_type=['cash', 'credit_card', None][i % 3],
+                date=now - timedelta(minutes=i),
+            )
+            for i in range(start, end)
+        ], batch_size=5000)
+
+    def measure(self, user, size, with_memory):
+        queryset = Transaction.objects.filter(user=user).order_by('-date')
+
+        with tempfile.TemporaryFile() as output:
+            started = time.perf_counter()
+            pages = render_transactions_pdf(queryset, output)
+            seconds = time.perf_counter() - started
+            file_bytes = output.tell()
+
+        result = {
+            'rows': size,
+            'pages': pages,
+            'render_seconds': round(seconds, 3),
+            'rows_per_second': round(size / seconds),
+            'file_bytes': file_bytes,
+        }
+        if with_memory:
+            with tempfile.TemporaryFile() as output:
+                tracemalloc.start()
+                render_transactions_pdf(queryset, output)
+                result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        return result
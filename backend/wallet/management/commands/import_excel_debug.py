@@ -2,7 +2,10 @@ import openpyxl
 from datetime import datetime
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from wallet.fingerprints import fingerprint_for
 from wallet.models import Transaction
+from wallet.signals import recompute_balances
+from wallet.ml import rebuild_category_counts, invalidate_category_model
 
 class Command(BaseCommand):
     help = 'Import transactions from Excel export for debugging'
@@ -27,7 +30,7 @@ class Command(BaseCommand):
         self.stdout.write(f'Cleared {count} existing transactions for {username}')
 
         try:
-            wb = openpyxl.load_workbook(file_path)
+            wb = openpyxl.load_workbook(file_path, read_only=True)
             ws = wb.active
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error loading Excel: {e}'))
@@ -39,6 +42,7 @@ class Command(BaseCommand):
         
         incomes_created = 0
         expenses_created = 0
+        to_create = []
         
         for row in ws.iter_rows(min_row=3, values_only=True):
             # Row is a tuple of values
@@ -53,14 +57,14 @@ class Command(BaseCommand):
                     date_obj = self.parse_date(date_str)
                     category, description = self.parse_desc(desc_raw)
                     
-                    Transaction.objects.create(
+                    to_create.append(Transaction(
                         user=user,
                         type='income',
                         amount=amount,
                         date=date_obj,
                         category=category,
                         description=description
-                    )
+                    ))
                     incomes_created += 1
                 except Exception as e:
                     self.stdout.write(self.style.WARNING(f'Skipped Income Row: {e}'))
@@ -75,18 +79,30 @@ class Command(BaseCommand):
                     date_obj = self.parse_date(date_str)
                     category, description = self.parse_desc(desc_raw)
                     
-                    Transaction.objects.create(
+                    to_create.append(Transaction(
                         user=user,
                         type='expense',
                         amount=amount,
                         date=date_obj,
                         category=category,
                         description=description
-                    )
+                    ))
                     expenses_created += 1
                 except Exception as e:
                     self.stdout.write(self.style.WARNING(f'Skipped Expense Row: {e}'))
 
+        wb.close()
+
+        # bulk_create skips the signals that set fingerprints
+        for transaction in to_create:
+            transaction.fingerprint = fingerprint_for(transaction)
+
+        # bulk_create skips the balance signals: the new rows' net effect is applied once at the end.
+        Transaction.objects.bulk_create(to_create, batch_size=1000)
+        recompute_balances(to_create)
+        rebuild_category_counts(user)
+        invalidate_category_model(user.id)
+
         self.stdout.write(self.style.SUCCESS(f'Successfully imported {incomes_created} incomes and {expenses_created} expenses for {username}'))
 
     def parse_date(self, date_val):
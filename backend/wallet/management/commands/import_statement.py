@@ -0,0 +1,45 @@
+import json
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from wallet.importers import IMPORT_FORMATS, StatementReader, import_statement_events
+
+
+class Command(BaseCommand):
+    help = 'Import a bank statement (XLSX, CSV or OFX) into a user account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_path', type=str)
+        parser.add_argument('username', type=str)
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Statement format (guessed by default)')
+        parser.add_argument('--profile', type=str, default='generic', help='Profile name or a JSON column mapping')
+        parser.add_argument('--entity-id', type=str, help='Account (vision entity) the statement belongs to')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        profile = options['profile']
+        if profile.lstrip().startswith('{'):
+            try:
+                profile = json.loads(profile)
+            except json.JSONDecodeError as e:
+                raise CommandError(f'Invalid --profile JSON: {e}')
+
+        started = time.perf_counter()
+        summary = None
+        try:
+            with open(options['file_path'], 'rb') as statement:
+                reader = StatementReader(statement, options['format'], profile, options['file_path'])
+                for summary in import_statement_events(user, reader, options['entity_id']):
+                    if not summary.get('done'):
+                        self.stdout.write(f"{summary['processed']} rows read, {summary['imported']} imported")
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(summary, indent=2, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} transactions into {user.username} in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,37 @@
+import json
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from wallet.backup import restore_backup
+
+
+class Command(BaseCommand):
+    help = 'Restore a backup written by backup_account into a user account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('backup_path', type=str)
+        parser.add_argument('username', type=str)
+        parser.add_argument('--create-user', action='store_true', help='Create the user if it does not exist')
+        parser.add_argument('--replace', action='store_true', help="Overwrite the account's existing data")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if options['create_user']:
+            user, _ = User.objects.get_or_create(username=options['username'])
+        else:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['username']} does not exist (use --create-user)")
+
+        started = time.perf_counter()
+        try:
+            with open(options['backup_path'], 'rb') as backup:
+                counts = restore_backup(user, backup, replace=options['replace'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(counts, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f'Restored into {user.username} in {time.perf_counter() - started:.2f}s'
+        ))
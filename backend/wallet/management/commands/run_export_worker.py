@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from wallet.export_jobs import process_export_jobs
+
+
+class Command(BaseCommand):
+    help = 'Process queued export jobs (ExportJob), polling for new ones unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds between polls of an empty queue')
+        parser.add_argument('--max-jobs', type=int, help='Exit after processing this many jobs')
+
+    def handle(self, *args, **options):
+        max_jobs = options.get('max_jobs')
+        processed = 0
+        while True:
+            remaining = None if max_jobs is None else max_jobs - processed
+            count = process_export_jobs(max_jobs=remaining)
+            processed += count
+            if count:
+                self.stdout.write(f'Processed {count} export job(s)')
+            if options['once'] or (max_jobs is not None and processed >= max_jobs):
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Export worker done: {processed} job(s)'))
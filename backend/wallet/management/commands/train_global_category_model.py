@@ -0,0 +1,70 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from wallet.models import Transaction
+from wallet.ml import document_tokens
+from wallet.automaton import normalize_phrase
+from wallet.global_model import write_global_model, reset_global_model
+
+class Command(BaseCommand):
+    help = 'Train the anonymized global category model used for users with little history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, help='Artifact path (default: settings.GLOBAL_CATEGORY_MODEL_PATH)')
+        parser.add_argument(
+            '--min-users', type=int, default=3,
+            help='Keep only categories and tokens used by at least this many distinct users',
+        )
+
+    def handle(self, *args, **options):
+        output = options.get('output') or settings.GLOBAL_CATEGORY_MODEL_PATH
+        min_users = options['min_users']
+
+        # Only aggregated counts leave this loop; user ids are used solely to
+        # drop categories and tokens that fewer than `min_users` people share.
+        doc_counts = defaultdict(int)
+        token_counts = defaultdict(lambda: defaultdict(int))
+        category_users = defaultdict(set)
+        token_users = defaultdict(set)
+
+        rows = Transaction.objects.exclude(
+            description__isnull=True
+        ).exclude(
+            description__exact=''
+        ).exclude(
+            category__isnull=True
+        ).values_list('user_id', 'description', 'category').iterator(chunk_size=5000)
+
+        for user_id, description, category in rows:
+            tokens = document_tokens(description, category)
+            category = normalize_phrase(category)
+            if not tokens or not category:
+                continue
+
+            doc_counts[category] += 1
+            category_users[category].add(user_id)
+            for token, count in tokens.items():
+                token_counts[token][category] += count
+                token_users[token].add(user_id)
+
+        categories = sorted(c for c, users in category_users.items() if len(users) >= min_users)
+        token_rows = {}
+        for token, per_category in token_counts.items():
+            if len(token_users[token]) < min_users:
+                continue
+            row = [per_category.get(category, 0) for category in categories]
+            if any(row):
+                token_rows[token] = row
+
+        if not categories or not token_rows:
+            self.stdout.write(self.style.WARNING(
+                f'Not enough shared data to train a global model (min users: {min_users})'
+            ))
+            return
+
+        write_global_model(output, categories, [doc_counts[c] for c in categories], token_rows)
+        reset_global_model()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote global category model to {output}: {len(categories)} categories, {len(token_rows)} tokens'
+        ))
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0009_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_version', models.IntegerField(default=0)),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('trained_revision', models.PositiveIntegerField(blank=True, null=True)),
+                ('data', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='category_model', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0010_categorymodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryTokenCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('token', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_token_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CategoryDocCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=100)),
+                ('doc_count', models.IntegerField(default=0)),
+                ('word_count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_doc_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='categorytokencount',
+            constraint=models.UniqueConstraint(fields=('user', 'category', 'token'), name='unique_category_token_count'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorydoccount',
+            constraint=models.UniqueConstraint(fields=('user', 'category'), name='unique_category_doc_count'),
+        ),
+    ]
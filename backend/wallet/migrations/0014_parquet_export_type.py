@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0013_exportcacheentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportcacheentry',
+            name='export_type',
+            field=models.CharField(choices=[('xlsx', 'Excel'), ('pdf', 'PDF'), ('csv', 'CSV'), ('ndjson', 'NDJSON'), ('parquet', 'Parquet')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='export_type',
+            field=models.CharField(choices=[('xlsx', 'Excel'), ('pdf', 'PDF'), ('csv', 'CSV'), ('ndjson', 'NDJSON'), ('parquet', 'Parquet')], max_length=10),
+        ),
+    ]
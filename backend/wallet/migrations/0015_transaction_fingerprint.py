@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:23
+
+import hashlib
+import re
+import unicodedata
+from decimal import Decimal
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Frozen copies of wallet.fingerprints.transaction_fingerprint and
+# wallet.automaton.normalize_phrase as of this migration, so later changes to
+# them cannot change what the backfill writes.
+def _normalize_phrase(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^a-z0-9ñ\s]', ' ', text).split())
+
+
+def _transaction_fingerprint(user_id, date, amount, description, entity_id=None):
+    day = timezone.localtime(date).date() if timezone.is_aware(date) else date.date()
+    parts = [
+        str(user_id),
+        day.isoformat(),
+        str(Decimal(amount).quantize(Decimal('0.01'))),
+        _normalize_phrase(description),
+        str(entity_id or ''),
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    Transaction = apps.get_model('wallet', 'Transaction')
+    connection = schema_editor.connection
+    # bulk_update arma un CASE por fila; un UPDATE preparado por fila es mucho más rápido
+    sql = 'UPDATE {} SET {} = %s WHERE {} = %s'.format(
+        connection.ops.quote_name(Transaction._meta.db_table),
+        connection.ops.quote_name('fingerprint'),
+        connection.ops.quote_name('id'),
+    )
+    rows = Transaction.objects.using(connection.alias).order_by('pk').values_list(
+        'pk', 'user_id', 'date', 'amount', 'description', 'related_entity_id'
+    ).iterator(chunk_size=2000)
+    batch = []
+    with connection.cursor() as cursor:
+        for pk, user_id, date, amount, description, entity_id in rows:
+            batch.append((_transaction_fingerprint(user_id, date, amount, description, entity_id), pk))
+            if len(batch) >= 2000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0014_parquet_export_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('fingerprint__isnull', False)), fields=['user', 'fingerprint'], name='transaction_fingerprint'),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
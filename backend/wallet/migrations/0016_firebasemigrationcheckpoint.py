@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0015_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirebaseMigrationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('firebase_uid', models.CharField(blank=True, default='', max_length=128)),
+                ('status', models.CharField(choices=[('completed', 'Completed'), ('failed', 'Failed')], max_length=10)),
+                ('counts', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='firebase_migration', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0016_firebasemigrationcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParsingContextVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='parsing_context_version', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
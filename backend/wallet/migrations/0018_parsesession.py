@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wallet', '0017_parsingcontextversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParseSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=64)),
+                ('text', models.TextField(blank=True, default='')),
+                ('draft', models.JSONField(blank=True, null=True)),
+                ('memo', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parse_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='parsesession',
+            constraint=models.UniqueConstraint(fields=('user', 'session_id'), name='unique_parse_session'),
+        ),
+    ]
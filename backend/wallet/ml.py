@@ -1,7 +1,71 @@
 import re
 import math
-from collections import defaultdict
-from .models import Transaction, Category
+import json
+import zlib
+import threading
+from pathlib import Path
+from collections import defaultdict, OrderedDict, Counter
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F
+from .models import Transaction, Category, CategoryModel, CategoryDocCount, CategoryTokenCount
+from .automaton import KeywordAutomaton, normalize_phrase
+from .global_model import get_global_model
+
+# Bump when the tokenizer or the serialized format changes: persisted models
+# with another version are retrained on next use, and their token counts are
+# rebuilt from the transaction history.
+MODEL_VERSION = 2
+
+# Count rows per INSERT ... ON CONFLICT statement
+UPSERT_BATCH_SIZE = 200
+
+# Stopwords en español para limpiar ruido
+STOPWORDS = frozenset({
+    'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
+    'y', 'e', 'ni', 'o', 'u',
+    'a', 'ante', 'bajo', 'cabe', 'con', 'contra', 'de', 'desde',
+    'en', 'entre', 'hacia', 'hasta', 'para', 'por', 'segun',
+    'sin', 'so', 'sobre', 'tras',
+    'pago', 'transferencia', 'spei', 'compra', 'cargo'
+})
+
+# Base de Conocimiento de Keywords Comunes: {keyword: [concepts]}. Keywords
+# can span several words ("mercado libre"); they are compiled once per worker
+# into an Aho-Corasick automaton.
+with open(Path(__file__).resolve().parent / 'data' / 'category_keywords.json', encoding='utf-8') as keywords_file:
+    COMMON_KEYWORDS = json.load(keywords_file)
+
+KEYWORD_AUTOMATON = KeywordAutomaton(COMMON_KEYWORDS.items())
+KEYWORD_CONCEPTS = list(dict.fromkeys(
+    concept for concepts in COMMON_KEYWORDS.values() for concept in concepts
+))
+
+# Minimum number of documents before Naive Bayes is trusted
+MIN_TRAINING_DOCS = 5
+
+# Weight of the global cold-start model when blended with a user's history,
+# in pseudo-words per category and pseudo-documents overall.
+GLOBAL_PRIOR_WORDS = 50
+GLOBAL_PRIOR_DOCS = 10
+
+
+def tokenize(text):
+    """
+    Tokeniza el texto: minúsculas, elimina puntuación, split por espacios.
+    Filtra stopwords y palabras cortas.
+    """
+    if not text:
+        return []
+    text = str(text).lower()
+    # Reemplazar todo lo que no sea alfanumérico con espacios
+    text = re.sub(r'[^a-z0-9\u00C0-\u00FF\s]', ' ', text) # \u00C0-\u00FF incluye acentos
+    # Split y eliminar espacios vacíos y stopwords
+    tokens = [
+        t for t in text.split()
+        if len(t) > 2 and t not in STOPWORDS
+    ]
+    return tokens
 
 class CategoryPredictor:
     def __init__(self, user):
@@ -14,128 +78,122 @@ class CategoryPredictor:
         self.total_docs = 0
         self.is_trained = False
         
+        # Memoized log-probability matrix, see _naive_bayes_base()
+        self._nb_base = None
+        self._token_rows = {}
+        self._candidates = None
+
         # User specific categories loaded from DB
         self.user_categories = set()
         
         # Base de Conocimiento de Keywords Comunes (Common Knowledge Base)
         # Mapea palabras clave a categorías "estándar" o conceptos
-        self.common_keywords = {
-            'uber': ['transporte', 'viajes'],
-            'didi': ['transporte', 'viajes'],
-            'taxi': ['transporte', 'viajes'],
-            'gasolina': ['transporte', 'auto', 'coche'],
-            'shell': ['transporte', 'auto', 'gasolina'],
-            'bp': ['transporte', 'auto', 'gasolina'],
-            
-            'netflix': ['entretenimiento', 'suscripciones'],
-            'spotify': ['entretenimiento', 'suscripciones'],
-            'youtube': ['entretenimiento', 'suscripciones'],
-            'cine': ['entretenimiento', 'salidas'],
-            'steam': ['entretenimiento', 'juegos'],
-            
-            'cfe': ['servicios', 'hogar', 'luz', 'electricidad'],
-            'luz': ['servicios', 'hogar'],
-            'agua': ['servicios', 'hogar'],
-            'internet': ['servicios', 'hogar', 'internet'],
-            'telmex': ['servicios', 'hogar', 'internet'],
-            'totalplay': ['servicios', 'hogar', 'internet'],
-            'gas': ['servicios', 'hogar'],
-            
-            'walmart': ['supermercado', 'comida', 'hogar'],
-            'soriana': ['supermercado', 'comida', 'hogar'],
-            'costco': ['supermercado', 'comida', 'hogar'],
-            'oxxo': ['supermercado', 'comida', 'tienda'],
-            'restaurante': ['comida', 'restaurantes'],
-            'tacos': ['comida', 'restaurantes'],
-            'pizza': ['comida', 'restaurantes'],
-            'cafe': ['comida', 'cafe'],
-            'starbucks': ['comida', 'cafe'],
-            
-            'sueldo': ['ingresos', 'salario', 'nomina'],
-            'nomina': ['ingresos', 'salario'],
-            'deposito': ['ingresos', 'transferencia'],
-            
-            'renta': ['hogar', 'vivienda'],
-            'hipoteca': ['hogar', 'vivienda'],
-            'mantenimiento': ['hogar', 'servicios'],
-            
-            'gym': ['salud', 'deporte'],
-            'gimnasio': ['salud', 'deporte'],
-            'doctor': ['salud', 'medico'],
-            'farmacia': ['salud', 'medicamentos'],
-        }
-        
+        self.common_keywords = COMMON_KEYWORDS
+        self._concepts = None
+
         # Stopwords en español para limpiar ruido
-        self.stopwords = {
-            'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
-            'y', 'e', 'ni', 'o', 'u',
-            'a', 'ante', 'bajo', 'cabe', 'con', 'contra', 'de', 'desde',
-            'en', 'entre', 'hacia', 'hasta', 'para', 'por', 'segun',
-            'sin', 'so', 'sobre', 'tras',
-            'pago', 'transferencia', 'spei', 'compra', 'cargo'
-        }
+        self.stopwords = STOPWORDS
 
     def _tokenize(self, text):
-        """
-        Tokeniza el texto: minúsculas, elimina puntuación, split por espacios.
-        Filtra stopwords y palabras cortas.
-        """
-        if not text:
-            return []
-        text = str(text).lower()
-        # Reemplazar todo lo que no sea alfanumérico con espacios
-        text = re.sub(r'[^a-z0-9\u00C0-\u00FF\s]', ' ', text) # \u00C0-\u00FF incluye acentos
-        # Split y eliminar espacios vacíos y stopwords
-        tokens = [
-            t for t in text.split() 
-            if len(t) > 2 and t not in self.stopwords
-        ] 
-        return tokens
+        return tokenize(text)
+
+    def _load_user_categories(self):
+        # Cargar categorías del usuario para el matching híbrido
+        user_cats = Category.objects.filter(user=self.user).values_list('name', flat=True)
+        self.user_categories = set(c.lower() for c in user_cats)
+        self._concepts = None
+        self._candidates = None
 
     def train(self):
         """
-        Entrena el modelo usando el historial de transacciones del usuario.
+        Carga el modelo desde los conteos incrementales del usuario
+        (CategoryDocCount / CategoryTokenCount), que las señales de
+        Transaction mantienen al día. No recorre el historial.
         Carga también las categorías disponibles del usuario.
         """
-        # 0. Cargar categorías del usuario para el matching híbrido
-        user_cats = Category.objects.filter(user=self.user).values_list('name', flat=True)
-        self.user_categories = set(c.lower() for c in user_cats)
-        
-        # 1. Obtener transacciones del usuario
-        transactions = Transaction.objects.filter(user=self.user).exclude(
-            description__isnull=True
-        ).exclude(
-            description__exact=''
-        ).exclude(
-            category__isnull=True
-        ).values('description', 'category')
-        
-        count = len(transactions)
-        
+        self._load_user_categories()
+
+        doc_counts = CategoryDocCount.objects.filter(user=self.user, doc_count__gt=0).values_list(
+            'category', 'doc_count', 'word_count'
+        )
+        for category, doc_count, word_count in doc_counts:
+            self.category_doc_counts[category] = doc_count
+            self.category_counts[category] = word_count
+            self.total_docs += doc_count
+
+        token_counts = CategoryTokenCount.objects.filter(user=self.user, count__gt=0).values_list(
+            'category', 'token', 'count'
+        )
+        for category, token, count in token_counts:
+            self.vocab.add(token)
+            self.word_counts[category][token] = count
+
         # Si hay pocas transacciones, marcaremos como no entrenado para NB,
         # PERO aún podemos usar el matching por keywords y nombre.
-        if count >= 5:
-            self.is_trained = True
-            self.total_docs = count
-            
-            # 2. Construir frecuencias para Naive Bayes
-            for t in transactions:
-                category = t['category']
-                if not category:
-                    continue
-                    
-                tokens = self._tokenize(t['description'])
-                if not tokens:
-                    continue
-                
-                self.category_doc_counts[category] += 1
-                
-                for token in tokens:
-                    self.vocab.add(token)
-                    self.word_counts[category][token] += 1
-                    self.category_counts[category] += 1
-        else:
-            self.is_trained = False
+        self.is_trained = self.total_docs >= MIN_TRAINING_DOCS
+
+    def fit(self, documents):
+        """
+        Entrena en memoria desde pares (description, category), sin tocar
+        los conteos persistidos. Usado para reconstruirlos y para evaluar.
+        """
+        for description, category in documents:
+            tokens = document_tokens(description, category)
+            if not tokens:
+                continue
+
+            self.category_doc_counts[category] += 1
+            self.total_docs += 1
+
+            for token, count in tokens.items():
+                self.vocab.add(token)
+                self.word_counts[category][token] += count
+                self.category_counts[category] += count
+
+        self._nb_base = None
+        self._token_rows = {}
+        self._candidates = None
+        self.is_trained = self.total_docs >= MIN_TRAINING_DOCS
+
+    def dumps(self):
+        """
+        Serializes the trained state as zlib-compressed JSON:
+        {"v", "total_docs", "trained", "user_categories",
+         "categories": {category: [doc_count, word_count, {token: count}]}}
+        The vocabulary is implied by the per-category token counts.
+        """
+        payload = {
+            'v': MODEL_VERSION,
+            'total_docs': self.total_docs,
+            'trained': self.is_trained,
+            'user_categories': sorted(self.user_categories),
+            'categories': {
+                category: [
+                    self.category_doc_counts[category],
+                    self.category_counts[category],
+                    dict(self.word_counts[category]),
+                ]
+                for category in self.category_doc_counts
+            },
+        }
+        return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def loads(cls, user, data):
+        """
+        Rebuilds a predictor from `dumps()` output without touching the DB.
+        """
+        payload = json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+        predictor = cls(user)
+        predictor.total_docs = payload['total_docs']
+        predictor.is_trained = payload['trained']
+        predictor.user_categories = set(payload['user_categories'])
+        for category, (doc_count, word_count, tokens) in payload['categories'].items():
+            predictor.category_doc_counts[category] = doc_count
+            predictor.category_counts[category] = word_count
+            predictor.word_counts[category].update(tokens)
+            predictor.vocab.update(tokens)
+        return predictor
 
     def predict(self, description):
         """
@@ -144,12 +202,55 @@ class CategoryPredictor:
         2. Diccionario de Keywords Comunes mapeado a Categorías del Usuario (Prioridad Media)
         3. Naive Bayes con historial (Prioridad Baja / Refinamiento)
         """
+        return self._predict_with_strategy(description)[0]
+
+    def predict_top_k(self, description, k=3):
+        """
+        Predicción explicada: la categoría de `predict()`, la estrategia que la
+        produjo ('name', 'keyword', 'naive_bayes' o None) y las k categorías
+        más probables según Naive Bayes con su probabilidad posterior
+        normalizada (log-sum-exp). `confidence` es la probabilidad NB de la
+        categoría predicha, o None si Naive Bayes no la conoce.
+        """
+        category, strategy = self._predict_with_strategy(description)
+
+        top_k = []
+        probabilities = {}
+        tokens = self._tokenize(description) if description else []
+        scores = self._naive_bayes_scores(tokens) if tokens and self._naive_bayes_available() else None
+        if scores:
+            max_score = max(score for _, score in scores)
+            weights = [(label, math.exp(score - max_score)) for label, score in scores]
+            total = sum(weight for _, weight in weights)
+            ranked = sorted(weights, key=lambda item: item[1], reverse=True)
+            top_k = [
+                {"category": label, "probability": round(weight / total, 4)}
+                for label, weight in ranked[:max(k, 1)]
+            ]
+            probabilities = {label.lower(): weight / total for label, weight in weights}
+
+        confidence = probabilities.get(category.lower()) if category else None
+        return {
+            "predicted_category": category,
+            "strategy": strategy,
+            "confidence": round(confidence, 4) if confidence is not None else None,
+            "top_k": top_k,
+        }
+
+    def _naive_bayes_available(self):
+        # Solo si está entrenado o hay un modelo global para usuarios nuevos
+        return self.is_trained or get_global_model() is not None
+
+    def _predict_with_strategy(self, description):
+        """
+        Devuelve (categoría, estrategia) para `predict()` y `predict_top_k()`.
+        """
         if not description:
-            return None
+            return None, None
         
         tokens = self._tokenize(description)
         if not tokens:
-            return None
+            return None, None
             
         # --- Estrategia 1: Coincidencia Directa (Name Match) ---
         # Si la descripción contiene el nombre de una categoría existente
@@ -166,86 +267,452 @@ class CategoryPredictor:
                 # Haremos una búsqueda rápida inversa si es necesario, o retornamos el token.
                 # Dado que guardamos en lower, vamos a intentar devolverlo 'Title Case' si no tenemos el map original.
                 # Mejor: iterar sobre las categorias originales si queremos exactitud, pero por performance:
-                return token.title() 
+                return token.title(), 'name'
 
         # --- Estrategia 2: Keywords Comunes (Common Knowledge) ---
         # Ejemplo: "Agua" -> map a 'servicios', 'hogar'. User tiene 'Servicios'. Match!
-        detected_concepts = set()
-        for token in tokens:
-            if token in self.common_keywords:
-                detected_concepts.update(self.common_keywords[token])
-        
-        # Ver si algún concepto detectado existe en las categorías del usuario
-        for concept in detected_concepts:
-            if concept in self.user_categories:
-                return concept.title()
-                
-            # Intento de matching parcial (ej. 'servicios' matchea 'servicios básicos')
-            for user_cat in self.user_categories:
-                if concept in user_cat: # substring match
-                    return user_cat.title()
+        # El autómata encuentra keywords de una o varias palabras en una sola pasada.
+        concept_index = self._concept_index()
+        for _, _, concepts in KEYWORD_AUTOMATON.search(description):
+            for concept in concepts:
+                user_cat = concept_index.get(concept)
+                if user_cat:
+                    return user_cat.title(), 'keyword'
 
         # --- Estrategia 3: Naive Bayes (History) ---
-        # Solo si está entrenado
-        if self.is_trained:
-            return self._predict_naive_bayes(tokens)
+        if self._naive_bayes_available():
+            category = self._predict_naive_bayes(tokens)
+            if category:
+                return category, 'naive_bayes'
             
-        return None
+        return None, None
 
     def _predict_naive_bayes(self, tokens):
         """
         Ejecuta la predicción Naive Bayes estándar.
         Incluye 'Zero Hit Guard' para evitar falsos positivos por Priors dominantes.
         """
+        scores = self._naive_bayes_scores(tokens)
+        if scores is None:
+            return None
+
         best_category = None
         max_log_prob = -float('inf')
-        
-        # Vocab size para Laplace smoothing
-        vocab_size = len(self.vocab)
-        
+        for category, posterior in scores:
+            if posterior > max_log_prob:
+                max_log_prob = posterior
+                best_category = category
+
+        return best_category
+
+    def _concept_index(self):
+        """
+        Índice {concepto: categoría del usuario} calculado una vez por modelo:
+        coincidencia exacta o, si no hay, la primera categoría que contiene el
+        concepto (ej. 'servicios' matchea 'servicios básicos').
+        """
+        if self._concepts is None:
+            ordered_categories = sorted(self.user_categories)
+            index = {}
+            for concept in KEYWORD_CONCEPTS:
+                if concept in self.user_categories:
+                    index[concept] = concept
+                    continue
+                for user_cat in ordered_categories:
+                    if concept in user_cat: # substring match
+                        index[concept] = user_cat
+                        break
+            self._concepts = index
+        return self._concepts
+
+    def _naive_bayes_scores(self, tokens):
+        """
+        Log-posterior de cada categoría como lista [(category, score)], o None
+        si ninguna palabra está en el vocabulario.
+        """
+        global_model = get_global_model()
+        if global_model is not None:
+            return self._blended_scores(tokens, global_model)
+
         # ZERO HIT GUARD: Contar cuántas palabras de la descripción
         # realmente existen en nuestro vocabulario aprendido.
-        hits = 0
-        for token in tokens:
-            if token in self.vocab:
-                hits += 1
-        
         # Si ninguna palabra se ha visto antes, NB solo retornará la categoría más común (Prior).
         # Esto suele ser incorrecto para palabras nuevas (ej. "Agua" -> "Transporte").
         # En este caso, es mejor no adivinar.
-        if hits == 0:
+        if not any(token in self.vocab for token in tokens):
             return None
-        
-        # Iterar sobre cada categoría posible
-        for category in self.category_doc_counts:
-            # Calcular Prior: P(Category)
-            prior = math.log(self.category_doc_counts[category] / self.total_docs)
-            
-            # Calcular Likelihood: P(Description | Category)
-            log_likelihood = 0
-            total_words_in_category = self.category_counts[category]
-            
-            for token in tokens:
-                # Laplace Smoothing
-                word_count = self.word_counts[category].get(token, 0)
-                prob_word_given_cat = (word_count + 1) / (total_words_in_category + vocab_size)
-                log_likelihood += math.log(prob_word_given_cat)
-            
-            posterior = prior + log_likelihood
-            
-            if posterior > max_log_prob:
-                max_log_prob = posterior
-                best_category = category
-        
-        return best_category
+
+        categories, priors, unseen = self._naive_bayes_base()
+        scores = priors
+        for token in tokens:
+            row = self._token_log_probs(token) if token in self.vocab else unseen
+            scores = [score + log_prob for score, log_prob in zip(scores, row)]
+
+        return list(zip(categories, scores))
+
+    def _blended_scores(self, tokens, global_model):
+        """
+        Naive Bayes sobre las categorías del usuario usando el modelo global como
+        prior de Dirichlet:
+            P(t|c) = (n_usuario(t,c) + M * P_global(t|c)) / (N_usuario(c) + M)
+        Sin historial equivale al modelo global (restringido a las categorías
+        que el usuario tiene); con mucho historial domina el modelo personal.
+        """
+        candidates = self._blend_candidates(global_model)
+        if not candidates:
+            return None
+        if not any(token in self.vocab or token in global_model for token in tokens):
+            return None
+
+        global_rows = [global_model.token_counts(token) for token in tokens]
+        unseen_prob = 1 / (len(self.vocab) + 1)
+        global_docs = sum(global_model.doc_counts[g] for _, _, g in candidates if g is not None)
+        total_docs = self.total_docs + GLOBAL_PRIOR_DOCS
+
+        scores = []
+        for label, category, global_index in candidates:
+            docs = self.category_doc_counts.get(category, 0)
+            words = self.category_counts.get(category, 0)
+            counts = self.word_counts.get(category, {})
+
+            share = global_model.doc_counts[global_index] / global_docs if global_index is not None else 0
+            score = math.log((docs + GLOBAL_PRIOR_DOCS * share) / total_docs)
+            for token, row in zip(tokens, global_rows):
+                prior_prob = global_model.token_prob(global_index, row) if global_index is not None else unseen_prob
+                score += math.log((counts.get(token, 0) + GLOBAL_PRIOR_WORDS * prior_prob) / (words + GLOBAL_PRIOR_WORDS))
+            scores.append((label, score))
+
+        return scores
+
+    def _blend_candidates(self, global_model):
+        """
+        Categorías candidatas [(label, categoría en historial o None, índice global o None)]:
+        las del historial del usuario y sus categorías sin historial que el modelo
+        global conoce. Se calcula una vez por modelo global.
+        """
+        if self._candidates is None or self._candidates[0] is not global_model:
+            candidates = []
+            seen = set()
+            for category in self.category_doc_counts:
+                key = normalize_phrase(category)
+                seen.add(key)
+                candidates.append((category, category, global_model.category_index.get(key)))
+
+            for name in sorted(self.user_categories):
+                key = normalize_phrase(name)
+                global_index = global_model.category_index.get(key)
+                if key not in seen and global_index is not None:
+                    seen.add(key)
+                    candidates.append((name.title(), None, global_index))
+
+            self._candidates = (global_model, candidates)
+        return self._candidates[1]
+
+    def _naive_bayes_base(self):
+        """
+        Parte fija de la matriz (categorías × vocabulario) de log-probabilidades:
+        orden de categorías, log-priors y la fila de una palabra no vista
+        (Laplace: log(1 / (palabras_categoría + |vocab|))). Se calcula una vez
+        por modelo cargado.
+        """
+        if self._nb_base is None:
+            categories = list(self.category_doc_counts)
+            vocab_size = len(self.vocab)
+            priors = [math.log(self.category_doc_counts[c] / self.total_docs) for c in categories]
+            unseen = [-math.log(self.category_counts[c] + vocab_size) for c in categories]
+            self._nb_base = (categories, priors, unseen)
+        return self._nb_base
+
+    def _token_log_probs(self, token):
+        """
+        Fila de la matriz para una palabra del vocabulario: log P(token | categoría)
+        con Laplace smoothing, memoizada para que predecir en lote no repita logs.
+        """
+        row = self._token_rows.get(token)
+        if row is None:
+            categories, _, unseen = self._naive_bayes_base()
+            row = [
+                math.log(self.word_counts[category].get(token, 0) + 1) + base
+                for category, base in zip(categories, unseen)
+            ]
+            self._token_rows[token] = row
+        return row
+
+    def predict_many(self, descriptions):
+        """
+        Predice una lista de descripciones en orden, reutilizando la matriz de
+        log-probabilidades y las descripciones repetidas.
+        """
+        predictions = {}
+        results = []
+        for description in descriptions:
+            key = description if isinstance(description, str) else str(description or '')
+            if key not in predictions:
+                predictions[key] = self.predict(key)
+            results.append(predictions[key])
+        return results
+
+def document_tokens(description, category):
+    """
+    Token counts a single transaction contributes to its category, or None
+    if it does not count as a training document.
+    """
+    if not description or not category:
+        return None
+    tokens = tokenize(description)
+    if not tokens:
+        return None
+    return Counter(tokens)
+
+
+def update_category_counts(user_id, old, new):
+    """
+    Applies the count deltas of a transaction write, where `old` and `new`
+    are (description, category) pairs or None (created / deleted).
+    Returns True if any count changed.
+    """
+    old_category = old[1] if old else None
+    new_category = new[1] if new else None
+    old_tokens = document_tokens(*old) if old else None
+    new_tokens = document_tokens(*new) if new else None
+
+    if old_category == new_category and old_tokens == new_tokens:
+        return False
+
+    with db_transaction.atomic():
+        if old_tokens:
+            _apply_document_delta(user_id, old_category, old_tokens, -1)
+        if new_tokens:
+            _apply_document_delta(user_id, new_category, new_tokens, 1)
+    return bool(old_tokens or new_tokens)
+
+
+def _apply_document_delta(user_id, category, tokens, sign):
+    # Un upsert por tabla (ON CONFLICT, igual en PostgreSQL y SQLite): guardados
+    # concurrentes suman sobre la misma fila en vez de chocar con el UNIQUE
+    words = sum(tokens.values())
+    _upsert_counts(CategoryDocCount, ('user_id', 'category'), ('doc_count', 'word_count'), [
+        (user_id, category, sign, sign * words),
+    ])
+    # Orden fijo de filas para que dos transacciones no se bloqueen en cruz
+    _upsert_counts(CategoryTokenCount, ('user_id', 'category', 'token'), ('count',), [
+        (user_id, category, token, sign * count) for token, count in sorted(tokens.items())
+    ])
+
+    if sign < 0:
+        CategoryTokenCount.objects.filter(user_id=user_id, category=category, count__lte=0).delete()
+        CategoryDocCount.objects.filter(user_id=user_id, category=category, doc_count__lte=0).delete()
+
+
+def _upsert_counts(model, key_columns, count_columns, rows):
+    """
+    INSERT ... ON CONFLICT (key) DO UPDATE adding the rows' counts to the
+    stored ones, in a single statement.
+    """
+    if not rows:
+        return
+    connection = db_transaction.get_connection()
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = key_columns + count_columns
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    sql = 'INSERT INTO {table} ({columns}) VALUES {{values}} ON CONFLICT ({keys}) DO UPDATE SET {updates}'.format(
+        table=table,
+        columns=', '.join(quote(column) for column in columns),
+        keys=', '.join(quote(column) for column in key_columns),
+        updates=', '.join(
+            f'{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}' for column in count_columns
+        ),
+    )
+    with connection.cursor() as cursor:
+        # SQLite limita los parámetros por sentencia
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                sql.format(values=', '.join([placeholders] * len(batch))),
+                [value for row in batch for value in row],
+            )
+
+
+def rebuild_category_counts(user):
+    """
+    Rebuilds the user's incremental counts from the full transaction history.
+    Only needed once per user (first use, MODEL_VERSION change) or after
+    writes that bypass the signals, such as bulk_create.
+    """
+    transactions = Transaction.objects.filter(user=user).exclude(
+        description__isnull=True
+    ).exclude(
+        description__exact=''
+    ).exclude(
+        category__isnull=True
+    ).values_list('description', 'category')
+
+    predictor = CategoryPredictor(user)
+    predictor.fit(transactions.iterator(chunk_size=2000))
+
+    with db_transaction.atomic():
+        CategoryTokenCount.objects.filter(user=user).delete()
+        CategoryDocCount.objects.filter(user=user).delete()
+        CategoryDocCount.objects.bulk_create([
+            CategoryDocCount(
+                user=user,
+                category=category,
+                doc_count=doc_count,
+                word_count=predictor.category_counts[category],
+            )
+            for category, doc_count in predictor.category_doc_counts.items()
+        ], batch_size=1000)
+        CategoryTokenCount.objects.bulk_create([
+            CategoryTokenCount(user=user, category=category, token=token, count=count)
+            for category, tokens in predictor.word_counts.items()
+            for token, count in tokens.items()
+        ], batch_size=1000)
+
+
+class _PredictorCache:
+    """
+    In-process LRU of loaded predictors keyed by user id. Entries are evicted
+    by the total size of their serialized state rather than by count, so a
+    few users with long histories cannot pin the worker's memory.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # {user_id: (revision, predictor, size)}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, revision):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != revision:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, revision, predictor, size):
+        with self._lock:
+            self._discard(user_id)
+            if size > self.max_bytes:
+                return
+            self._entries[user_id] = (revision, predictor, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+
+_predictor_cache = _PredictorCache(getattr(settings, 'CATEGORY_MODEL_CACHE_BYTES', 32 * 1024 * 1024))
+
+
+def invalidate_category_model(user_id):
+    """
+    Marks the persisted model of a user as stale. Called from the Transaction
+    and Category signals; the next prediction retrains and persists it again.
+    """
+    CategoryModel.objects.filter(user_id=user_id).update(revision=F('revision') + 1)
+    _predictor_cache.discard(user_id)
+
+
+def reset_category_model(user_id):
+    """
+    Drops the persisted model of a user, so the next prediction rebuilds the
+    counts from the full history. Cheaper than `rebuild_category_counts`
+    right after bulk writes of many transactions (restores, imports).
+    """
+    CategoryModel.objects.filter(user_id=user_id).delete()
+    _predictor_cache.discard(user_id)
+
+
+def get_category_predictor(user):
+    """
+    Returns a trained predictor for the user, from (in order) the in-process
+    cache, the persisted CategoryModel snapshot, or a fresh `train()` from the
+    incremental counts whose result is persisted for the next request and the
+    other workers.
+    """
+    state = CategoryModel.objects.filter(user=user).values_list(
+        'revision', 'trained_revision', 'model_version'
+    ).first()
+
+    if state is None:
+        state = (CategoryModel.objects.get_or_create(user=user)[0].revision, None, None)
+    revision, trained_revision, model_version = state
+
+    if trained_revision == revision and model_version == MODEL_VERSION:
+        predictor = _predictor_cache.get(user.pk, revision)
+        if predictor is not None:
+            return predictor
+
+        data = CategoryModel.objects.filter(user=user).values_list('data', flat=True).first()
+        if data:
+            predictor = CategoryPredictor.loads(user, data)
+            _predictor_cache.put(user.pk, revision, predictor, len(data))
+            return predictor
+
+    if model_version != MODEL_VERSION:
+        rebuild_category_counts(user)
+
+    predictor = CategoryPredictor(user)
+    predictor.train()
+    data = predictor.dumps()
+
+    # Only mark the snapshot fresh if nothing was written while training
+    CategoryModel.objects.filter(user=user, revision=revision).update(
+        model_version=MODEL_VERSION,
+        trained_revision=revision,
+        data=data,
+    )
+    _predictor_cache.put(user.pk, revision, predictor, len(data))
+    return predictor
+
+
+def predict_categories_for_user(user, descriptions):
+    """
+    Batch version of predict_category_for_user: loads the predictor once and
+    returns the predictions in the same order as `descriptions`.
+    """
+    try:
+        predictor = get_category_predictor(user)
+        return predictor.predict_many(descriptions)
+    except Exception as e:
+        print(f"Error in lightweight ML batch prediction: {e}")
+        return [None] * len(descriptions)
+
+
+def explain_category_for_user(user, description, k=3):
+    """
+    Helper for predict_top_k; on failure behaves like an empty prediction.
+    """
+    try:
+        predictor = get_category_predictor(user)
+        return predictor.predict_top_k(description, k)
+    except Exception as e:
+        print(f"Error in lightweight ML prediction: {e}")
+        return {"predicted_category": None, "strategy": None, "confidence": None, "top_k": []}
+
 
 def predict_category_for_user(user, description):
     """
-    Helper function to create predictor, train, and predict in one go.
+    Helper function to load the user's predictor and predict in one go.
     """
     try:
-        predictor = CategoryPredictor(user)
-        predictor.train()
+        predictor = get_category_predictor(user)
         return predictor.predict(description)
     except Exception as e:
         print(f"Error in lightweight ML prediction: {e}")
@@ -42,10 +42,22 @@ class Transaction(models.Model):
         help_text="Duration of the recurrence in months (1-36). Null means indefinite.",
     )
     last_recurrence_date = models.DateTimeField(null=True, blank=True, help_text="Last time a recurring transaction was generated from this one")
+
+    # Hash of (user, local date, amount, normalized description, entity), see wallet.fingerprints
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'fingerprint'],
+                condition=models.Q(fingerprint__isnull=False),
+                name='transaction_fingerprint',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.description} - {self.amount}"
 
@@ -134,3 +146,180 @@ class GamificationStats(models.Model):
 
     def __str__(self):
         return f"Gamification for {self.user.username}"
+
+class CategoryDocCount(models.Model):
+    """
+    Naive Bayes document/word totals per (user, category), maintained
+    incrementally by the Transaction signals.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_doc_counts')
+    category = models.CharField(max_length=100)
+    doc_count = models.IntegerField(default=0)
+    word_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_category_doc_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.category}: {self.doc_count} docs ({self.user.username})"
+
+class CategoryTokenCount(models.Model):
+    """
+    Naive Bayes token frequency per (user, category, token), maintained
+    incrementally by the Transaction signals.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_token_counts')
+    category = models.CharField(max_length=100)
+    token = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'token'], name='unique_category_token_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.category}/{self.token}: {self.count} ({self.user.username})"
+
+class CategoryModel(models.Model):
+    """
+    Trained category predictor state for one user, serialized by
+    `wallet.ml.CategoryPredictor.dumps()`.
+
+    `revision` is bumped on every write that can change the prediction
+    (transactions, categories); the snapshot is fresh while
+    `trained_revision` matches it and `model_version` matches the code.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='category_model')
+    model_version = models.IntegerField(default=0)
+    revision = models.PositiveIntegerField(default=0)
+    trained_revision = models.PositiveIntegerField(null=True, blank=True)
+    data = models.BinaryField(default=bytes)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Category model for {self.user.username} (v{self.model_version})"
+
+class ParsingContextVersion(models.Model):
+    """
+    Per-user counter of VisionEntity name changes. Workers rebuild their
+    cached voice parsing context (`wallet.nlp.get_parsing_context`) when it
+    moves; balance updates leave it alone.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='parsing_context_version')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Parsing context v{self.version} ({self.user.username})"
+
+class ParseSession(models.Model):
+    """
+    State of an incremental parse session (`wallet.nlp.update_parse_session`):
+    the last transcript, its draft and the word windows the fuzzy matchers
+    already scored. Kept in the database so consecutive updates may be
+    served by different workers or instances.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='parse_sessions')
+    session_id = models.CharField(max_length=64)
+    text = models.TextField(blank=True, default='')
+    draft = models.JSONField(null=True, blank=True)
+    memo = models.JSONField(default=dict, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_id'], name='unique_parse_session'),
+        ]
+
+    def __str__(self):
+        return f"Parse session {self.session_id} ({self.user.username})"
+
+class ExportJob(models.Model):
+    """
+    A transaction export rendered outside the request by the
+    `run_export_worker` command and kept in the export storage
+    (settings.EXPORT_STORAGE) until downloaded.
+
+    `filters` holds the normalized filter params and `filters_hash` their
+    digest, so repeated requests can reuse a recent completed job.
+    """
+    EXPORT_TYPES = [
+        ('xlsx', 'Excel'),
+        ('pdf', 'PDF'),
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+        ('parquet', 'Parquet'),
+    ]
+
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    export_type = models.CharField(max_length=10, choices=EXPORT_TYPES)
+    filters = models.JSONField(default=dict, blank=True)
+    filters_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    file_size = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'export_type', 'filters_hash', 'status'], name='export_job_lookup'),
+            models.Index(fields=['status', 'created_at'], name='export_job_queue'),
+        ]
+
+    def __str__(self):
+        return f"{self.export_type} export #{self.pk} ({self.status}) for {self.user.username}"
+
+class ExportCacheEntry(models.Model):
+    """
+    A rendered export file, addressed by a digest of what it was rendered
+    from (see wallet.export_cache), so identical re-downloads skip rendering.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_cache_entries')
+    export_type = models.CharField(max_length=10, choices=ExportJob.EXPORT_TYPES)
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.export_type} export {self.key[:12]} for {self.user.username}"
+
+class FirebaseMigrationCheckpoint(models.Model):
+    """
+    Outcome of migrating one user's Firestore data (see the
+    `migrate_firebase` command). Completed users are skipped on re-runs;
+    failed ones are retried.
+    """
+    STATUSES = [
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='firebase_migration')
+    firebase_uid = models.CharField(max_length=128, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUSES)
+    counts = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Firebase migration of {self.user.username} ({self.status})"
@@ -1,8 +1,154 @@
 import re
-from .ml import CategoryPredictor
-from .models import VisionEntity
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .ml import get_category_predictor
+from .models import ParseSession, ParsingContextVersion, VisionEntity
+from .automaton import KeywordAutomaton
+from .fuzzy import FuzzyMatcher
+from .bank_notifications import parse_bank_notification
+from .spanish_numbers import find_spanish_numbers
 
-def parse_voice_command(text, user):
+# Maximum number of users whose parsing context is kept per worker
+PARSING_CONTEXT_CACHE_SIZE = 512
+
+# Sesiones de parseo incremental (transcripción en vivo)
+PARSE_SESSION_TTL_SECONDS = getattr(settings, 'PARSE_SESSION_TTL_SECONDS', 120)
+
+# Puntaje mínimo (1 - distancia / longitud) para aceptar un nombre aproximado
+FUZZY_MATCH_THRESHOLD = 0.65
+
+
+class ParsingContext:
+    """
+    Per-user state reused across `parse_voice_command` calls: an automaton
+    over the lowercased entity names, fuzzy matchers over the entity and
+    category names, and the user's category predictor.
+
+    `signature` (the user's ParsingContextVersion) detects entity name
+    changes made by other workers; the predictor is validated on its own by
+    `get_category_predictor` (Transaction and Category writes).
+    """
+
+    def __init__(self, signature, entities):
+        entities = [(name, (entity_id, name)) for entity_id, name in entities]
+        self.signature = signature
+        self.entity_matcher = KeywordAutomaton(entities, normalize=str.lower, whole_words=False)
+        self.entity_fuzzy = FuzzyMatcher(entities)
+        self.predictor = None
+        self._category_fuzzy = (None, None)  # (predictor, matcher)
+
+    def match_entity(self, text):
+        """
+        Returns ((entity_id, name), (start, end)) of the longest entity name
+        contained in the lowercased text (earliest on ties), or None. Linear
+        in len(text).
+        """
+        best = None
+        for start, end, value in self.entity_matcher.iter_matches(text):
+            if best is None or (end - start, -start) > (best[1] - best[0], -best[0]):
+                best = (start, end, value)
+        return (best[2], best[:2]) if best else None
+
+    def fuzzy_match_entity(self, text, threshold=FUZZY_MATCH_THRESHOLD, window_cache=None):
+        """
+        Fallback for speech-to-text errors ("tarjeta bebeva" -> "Tarjeta BBVA").
+        Returns ((entity_id, name), score, (start, end)) or None.
+        """
+        return self.entity_fuzzy.match(text, threshold, window_cache)
+
+    def find_entity(self, text, window_cache=None):
+        """
+        Exact match first (the automaton prefers the longest name, like the
+        old length-sorted scan), then the fuzzy fallback for transcription
+        errors ("tarjeta bebeva" -> "Tarjeta BBVA").
+        Returns (entity_id, name, score, (start, end)) or None, text[start:end]
+        being the matched span as written; `text` is expected in lowercase.
+        `window_cache` is passed to the fuzzy matcher.
+        """
+        match = self.match_entity(text)
+        if match:
+            (entity_id, name), span = match
+            return entity_id, name, 1.0, span
+        fuzzy = self.fuzzy_match_entity(text, window_cache=window_cache)
+        if fuzzy:
+            (entity_id, name), score, span = fuzzy
+            return entity_id, name, score, span
+        return None
+
+    def predict_category(self, description, window_cache=None):
+        """
+        Predictor first; a misheard category name ("trasporte" -> "Transporte")
+        only when it has no answer.
+        """
+        category = self.predictor.predict(description) if self.predictor else None
+        if category is None:
+            fuzzy = self.fuzzy_match_category(description, window_cache=window_cache)
+            if fuzzy:
+                category = fuzzy[0]
+        return category
+
+    def fuzzy_match_category(self, text, threshold=FUZZY_MATCH_THRESHOLD, window_cache=None):
+        """
+        Closest user category name in the text as (category, score), or None.
+        The matcher is rebuilt whenever the predictor (and with it the user's
+        categories) is replaced.
+        """
+        predictor, matcher = self._category_fuzzy
+        if predictor is not self.predictor:
+            categories = sorted(self.predictor.user_categories) if self.predictor else []
+            matcher = FuzzyMatcher((name, name) for name in categories)
+            self._category_fuzzy = (self.predictor, matcher)
+        match = matcher.match(text, threshold, window_cache)
+        return (match[0].title(), match[1]) if match else None
+
+
+_contexts = OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def discard_parsing_context(user_id):
+    """
+    Marks the user's parsing context as stale in every worker. Called by the
+    VisionEntity signals when names change, and after bulk entity writes
+    that skip them (restores, migrations).
+    """
+    updated = ParsingContextVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+    if not updated:
+        ParsingContextVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+    with _contexts_lock:
+        _contexts.pop(user_id, None)
+
+
+def get_parsing_context(user):
+    """
+    Returns the user's parsing context, rebuilding the entity matcher only
+    when their entity names changed.
+    """
+    signature = ParsingContextVersion.objects.filter(user=user).values_list('version', flat=True).first()
+
+    with _contexts_lock:
+        context = _contexts.get(user.pk)
+        if context is not None:
+            _contexts.move_to_end(user.pk)
+
+    if context is None or context.signature != signature:
+        entities = VisionEntity.objects.filter(user=user).values_list('id', 'name')
+        context = ParsingContext(signature, entities)
+        with _contexts_lock:
+            _contexts[user.pk] = context
+            while len(_contexts) > PARSING_CONTEXT_CACHE_SIZE:
+                _contexts.popitem(last=False)
+
+    context.predictor = get_category_predictor(user)
+    return context
+
+
+def parse_voice_command(text, user, context=None, memo=None):
     """
     Parsea un comando de voz transcrito para extraer:
     - Monto (float)
@@ -12,6 +158,11 @@ def parse_voice_command(text, user):
     
     Ejemplo entrada: "Gasté quinientos cincuenta pesos en Oxxo para unas papas"
     Ejemplo salida: { amount: 550.0, description: "Oxxo papas", category: "Supermercado" }
+
+    `context` permite reutilizar un ParsingContext ya cargado (lotes) y
+    `memo` (un dict que guarda quien llama) las ventanas de palabras ya
+    puntuadas por los matchers aproximados en llamadas anteriores
+    (sesiones incrementales): solo se puntúan las ventanas con palabras nuevas.
     """
     if not text:
         return None
@@ -30,49 +181,29 @@ def parse_voice_command(text, user):
         # Removemos el monto del texto para no confundirlo con descripción
         text = text.replace(amount_match.group(0), "")
     else:
-        # 3. Conversión básica de texto a número (para casos comunes donde STT falla)
-        # Esto es muy básico, idealmente usaríamos una librería como 'text2num' si fuera crítico
-        # Mapeo simple de unidades y decenas comunes en gastos rápidos
-        text_nums = {
-            'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5,
-            'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10,
-            'veinte': 20, 'treinta': 30, 'cuarenta': 40, 'cincuenta': 50,
-            'sesenta': 60, 'setenta': 70, 'ochenta': 80, 'noventa': 90,
-            'cien': 100, 'ciento': 100, 'doscientos': 200, 'trescientos': 300,
-            'cuatrocientos': 400, 'quinientos': 500, 'mil': 1000
-        }
-        
-        words = text.split()
-        temp_amount = 0
-        
-        # Buscamos palabras numéricas y las sumamos (muy naive, pero funciona para "veinte pesos" o "mil quinientos")
-        for w in words:
-            if w in text_nums:
-                # Si encontramos un número, lo sumamos y lo removemos del texto para la descripción
-                temp_amount += text_nums[w]
-                text = text.replace(w, "")
-        
-        if temp_amount > 0:
-            amount = float(temp_amount)
+        # 3. Números escritos en palabras (para casos comunes donde STT no da dígitos)
+        # "dos mil trescientos cuarenta y cinco", "cien pesos con cincuenta centavos".
+        # Si hay varios ("dos tacos de cincuenta") tomamos el mayor como monto.
+        numbers = find_spanish_numbers(text)
+        if numbers:
+            value, start, end = max(numbers, key=lambda number: number[0])
+            amount = float(value)
+            text = text[:start] + text[end:]
 
     # 3.5. Extracción de Entidad (VisionEntity)
     related_entity_id = None
     related_entity_name = None
+    related_entity_score = None
     
     # Solo buscamos si hay usuario (por si acaso)
-    if user and not user.is_anonymous:
-        user_entities = VisionEntity.objects.filter(user=user)
-        # Ordenamos por longitud de nombre descendente para matchear nombres más largos primero
-        sorted_entities = sorted(user_entities, key=lambda e: len(e.name), reverse=True)
-        
-        for entity in sorted_entities:
-            entity_name_normalized = entity.name.lower()
-            if entity_name_normalized in text:
-                related_entity_id = entity.id
-                related_entity_name = entity.name
-                # Removemos el nombre de la entidad del texto
-                text = text.replace(entity_name_normalized, "")
-                break
+    if context is None and user and not user.is_anonymous:
+        context = get_parsing_context(user)
+    if context is not None:
+        found = context.find_entity(text, _window_cache(memo, 'entity'))
+        if found:
+            related_entity_id, related_entity_name, related_entity_score, (start, end) = found
+            # Removemos el nombre de la entidad del texto, tal como se escribió
+            text = text[:start] + text[end:]
 
     # 4. Limpieza (Stopwords y palabras de relleno)
     stopwords = [
@@ -108,11 +239,11 @@ def parse_voice_command(text, user):
         description = "Gasto general"
 
     # 4. Predicción de Categoría
-    predictor = CategoryPredictor(user)
-    # Entrenamos (carga datos del usuario)
-    predictor.train()
-    
-    predicted_category = predictor.predict(description)
+    # Modelo persistido/cacheado del usuario (solo reentrena si hubo cambios)
+    if context is not None:
+        predicted_category = context.predict_category(description, _window_cache(memo, 'category'))
+    else:
+        predicted_category = get_category_predictor(user).predict(description)
     
     # 5. Determinar Tipo (Gasto vs Ingreso vs Transferencia)
     # Por defecto es Gasto (expense)
@@ -128,5 +259,110 @@ def parse_voice_command(text, user):
         "type": transaction_type,
         "original_text": original_text,
         "relatedEntityId": related_entity_id,
-        "relatedEntityName": related_entity_name
+        "relatedEntityName": related_entity_name,
+        "relatedEntityScore": related_entity_score
+    }
+
+
+def _window_cache(memo, kind):
+    return memo.setdefault(kind, {}) if memo is not None else None
+
+
+def update_parse_session(user, text, session_id=None, final=False):
+    """
+    Parseo incremental de una transcripción que va creciendo ("gasté",
+    "gasté doscientos", "gasté doscientos en tacos con tarjeta oro"...).
+
+    El estado de la sesión (último texto, último borrador y las ventanas de
+    palabras ya puntuadas por los matchers de entidad/categoría) se guarda
+    en la base de datos (ParseSession), no en la caché local del proceso:
+    con varios workers de gunicorn o instancias de Vercel cada llamada puede
+    caer en un proceso distinto. Cada llamada solo puntúa las ventanas con
+    palabras nuevas; una sesión sin uso por PARSE_SESSION_TTL_SECONDS vuelve
+    a empezar y con `final` se cierra.
+
+    Devuelve (session_id, draft, changed), donde `changed` son las claves del
+    borrador que cambiaron respecto a la llamada anterior.
+    """
+    session_id = session_id or uuid.uuid4().hex
+    expired = timezone.now() - timedelta(seconds=PARSE_SESSION_TTL_SECONDS)
+    session = ParseSession.objects.filter(user=user, session_id=session_id, updated_at__gte=expired).first()
+    if session is None:
+        # Sesiones abandonadas del usuario (incluida una vencida con este id)
+        ParseSession.objects.filter(user=user, updated_at__lt=expired).delete()
+        session = ParseSession(user=user, session_id=session_id)
+
+    if session.pk is not None and text == session.text:
+        draft = session.draft
+    else:
+        draft = parse_voice_command(text, user, memo=session.memo)
+
+    previous = session.draft or {}
+    changed = [field for field, value in (draft or {}).items() if previous.get(field) != value]
+
+    if final:
+        ParseSession.objects.filter(user=user, session_id=session_id).delete()
+    else:
+        ParseSession.objects.update_or_create(
+            user=user, session_id=session_id, defaults={'text': text, 'draft': draft, 'memo': session.memo},
+        )
+    return session_id, draft, changed
+
+
+def parse_notification_batch(lines, user):
+    """
+    Parsea muchas líneas pegadas (notificaciones SMS/push del banco o comandos
+    libres) con un solo ParsingContext. Devuelve un generador de resultados,
+    uno por línea no vacía y en el mismo orden, para poder enviarlos en
+    streaming.
+
+    Las líneas que coinciden con una plantilla bancaria (ver
+    `bank_notifications`) traen además date, cardSuffix y bank; el resto pasa
+    por `parse_voice_command`. Un error en una línea no detiene el lote.
+    """
+    # El contexto se carga antes de empezar a emitir resultados
+    context = get_parsing_context(user) if user and not user.is_anonymous else None
+
+    def results():
+        for index, line in enumerate(lines):
+            line = (line or '').strip()
+            if not line:
+                continue
+            try:
+                result = _parse_notification_line(line, user, context)
+            except Exception as e:
+                result = {"error": str(e), "original_text": line}
+            yield {"index": index, **result}
+
+    return results()
+
+
+def _parse_notification_line(line, user, context):
+    notification = parse_bank_notification(line)
+    if notification is None:
+        result = parse_voice_command(line, user, context)
+        result["source"] = "voice"
+        return result
+
+    description = notification["merchant"] or "Gasto general"
+    found = context.find_entity(line.lower()) if context else None
+    related_entity_id, related_entity_name, related_entity_score = found[:3] if found else (None, None, None)
+    if context is not None:
+        category = context.predict_category(description)
+    else:
+        category = get_category_predictor(user).predict(description)
+
+    return {
+        "amount": notification["amount"],
+        "category": category,
+        "description": description.capitalize(),
+        "type": notification["type"],
+        "original_text": line,
+        "relatedEntityId": related_entity_id,
+        "relatedEntityName": related_entity_name,
+        "relatedEntityScore": related_entity_score,
+        "date": notification["date"].isoformat() if notification["date"] else None,
+        "cardSuffix": notification["card_suffix"],
+        "bank": notification["bank"],
+        "source": "template",
     }
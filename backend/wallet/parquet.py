@@ -0,0 +1,321 @@
+"""
+Minimal Apache Parquet writer (format 1.0 data pages, Thrift compact
+metadata) for the columnar exports. pyarrow does not fit the serverless
+bundle, and the exports only need flat tables of a few column kinds:
+
+    int32, int64, bool, string, timestamp (UTC, microseconds) and
+    decimal(precision, scale) stored as exact unscaled integers.
+
+String columns can be dictionary-encoded (category, type, ...). Pages are
+gzip-compressed, which every reader (pandas/pyarrow, DuckDB, Spark, Polars)
+supports. Rows are written in row groups, so a writer only holds one group.
+"""
+import datetime
+import struct
+import zlib
+
+MAGIC = b'PAR1'
+
+# parquet.thrift enums
+BOOLEAN, INT32, INT64, BYTE_ARRAY, FIXED_LEN_BYTE_ARRAY = 0, 1, 2, 6, 7
+REQUIRED, OPTIONAL = 0, 1
+CONVERTED_UTF8, CONVERTED_DECIMAL, CONVERTED_TIMESTAMP_MICROS = 0, 5, 10
+ENCODING_PLAIN, ENCODING_RLE, ENCODING_RLE_DICTIONARY = 0, 3, 8
+CODEC_UNCOMPRESSED, CODEC_GZIP = 0, 2
+DATA_PAGE, DICTIONARY_PAGE = 0, 2
+
+# Thrift compact protocol field types
+_T_TRUE, _T_FALSE, _T_I32, _T_I64, _T_BINARY, _T_LIST, _T_STRUCT = 1, 2, 5, 6, 8, 9, 12
+_THRIFT_TYPES = {'i32': _T_I32, 'i64': _T_I64, 'binary': _T_BINARY, 'list': _T_LIST, 'struct': _T_STRUCT}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _thrift_value(kind, value):
+    if kind in ('i32', 'i64'):
+        return _varint((value << 1) ^ (value >> 63))  # zigzag
+    if kind == 'binary':
+        value = value.encode('utf-8') if isinstance(value, str) else value
+        return _varint(len(value)) + value
+    if kind == 'struct':
+        return value  # ya codificado con _thrift_struct
+    if kind == 'list':
+        item_kind, items = value
+        item_type = _THRIFT_TYPES[item_kind]
+        header = bytes([len(items) << 4 | item_type]) if len(items) < 15 else bytes([0xF0 | item_type]) + _varint(len(items))
+        return header + b''.join(_thrift_value(item_kind, item) for item in items)
+    raise ValueError(kind)
+
+
+def _thrift_struct(*fields):
+    """
+    Encodes a struct from (field id, kind, value) triples in increasing id
+    order; fields whose value is None are optional and left out.
+    """
+    out = bytearray()
+    last_id = 0
+    for field_id, kind, value in fields:
+        if value is None:
+            continue
+        field_type = (_T_TRUE if value else _T_FALSE) if kind == 'bool' else _THRIFT_TYPES[kind]
+        delta = field_id - last_id
+        if 0 < delta <= 15:
+            out.append(delta << 4 | field_type)
+        else:
+            out.append(field_type)
+            out += _thrift_value('i32', field_id)
+        if kind != 'bool':
+            out += _thrift_value(kind, value)
+        last_id = field_id
+    out.append(0)  # STOP
+    return bytes(out)
+
+
+def _pack_bits(values, width):
+    """
+    Packs groups of 8 values, `width` bits each, least significant bit first.
+    The last group is zero padded; readers know how many values there are.
+    """
+    out = bytearray()
+    for start in range(0, len(values), 8):
+        packed = 0
+        for offset, value in enumerate(values[start:start + 8]):
+            packed |= value << (offset * width)
+        out += packed.to_bytes(width, 'little')
+    return bytes(out)
+
+
+def _bit_packed(values, width):
+    """RLE/bit-packing hybrid encoding made of a single bit-packed run."""
+    if not values:
+        return b''
+    return _varint((len(values) + 7) // 8 << 1 | 1) + _pack_bits(values, width)
+
+
+def _decimal_bytes(precision):
+    """Smallest two's complement width holding any `precision`-digit unscaled value."""
+    size = 1
+    while 2 ** (8 * size - 1) - 1 < 10 ** precision - 1:
+        size += 1
+    return size
+
+
+class ParquetColumn:
+    """
+    One flat column. `kind` is 'int32', 'int64', 'bool', 'string',
+    'timestamp' or 'decimal' (with `precision` and `scale`); `dictionary`
+    only applies to strings.
+    """
+
+    def __init__(self, name, kind, nullable=True, dictionary=False, precision=None, scale=None):
+        self.name = name
+        self.kind = kind
+        self.nullable = nullable
+        self.dictionary = dictionary and kind == 'string'
+        self.precision = precision
+        self.scale = scale
+        self.type_length = None
+        if kind in ('int64', 'timestamp'):
+            self.physical_type = INT64
+        elif kind == 'int32':
+            self.physical_type = INT32
+        elif kind == 'bool':
+            self.physical_type = BOOLEAN
+        elif kind == 'string':
+            self.physical_type = BYTE_ARRAY
+        elif kind == 'decimal':
+            # Hasta 18 dígitos cabe en un INT64; más allá, bytes de ancho fijo
+            if precision <= 18:
+                self.physical_type = INT64
+            else:
+                self.physical_type = FIXED_LEN_BYTE_ARRAY
+                self.type_length = _decimal_bytes(precision)
+        else:
+            raise ValueError(f"Unsupported column kind: {kind}")
+
+    def schema_element(self):
+        converted = scale = precision = logical = None
+        if self.kind == 'string':
+            converted = CONVERTED_UTF8
+            logical = _thrift_struct((1, 'struct', _thrift_struct()))
+        elif self.kind == 'timestamp':
+            converted = CONVERTED_TIMESTAMP_MICROS
+            unit = _thrift_struct((2, 'struct', _thrift_struct()))  # MICROS
+            logical = _thrift_struct((8, 'struct', _thrift_struct((1, 'bool', True), (2, 'struct', unit))))
+        elif self.kind == 'decimal':
+            converted, scale, precision = CONVERTED_DECIMAL, self.scale, self.precision
+            logical = _thrift_struct((5, 'struct', _thrift_struct((1, 'i32', scale), (2, 'i32', precision))))
+        return _thrift_struct(
+            (1, 'i32', self.physical_type),
+            (2, 'i32', self.type_length),
+            (3, 'i32', OPTIONAL if self.nullable else REQUIRED),
+            (4, 'binary', self.name),
+            (6, 'i32', converted),
+            (7, 'i32', scale),
+            (8, 'i32', precision),
+            (10, 'struct', logical),
+        )
+
+    def to_physical(self, value):
+        if self.kind == 'timestamp':
+            delta = value - EPOCH
+            return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        if self.kind == 'decimal':
+            unscaled = int(value.scaleb(self.scale).to_integral_value())
+            if self.type_length:
+                return unscaled.to_bytes(self.type_length, 'big', signed=True)
+            return unscaled
+        if self.kind == 'string':
+            return str(value).encode('utf-8')
+        return value
+
+    def plain(self, values):
+        if self.physical_type == INT64:
+            return struct.pack(f'<{len(values)}q', *values)
+        if self.physical_type == INT32:
+            return struct.pack(f'<{len(values)}i', *values)
+        if self.physical_type == BOOLEAN:
+            return _pack_bits([int(bool(v)) for v in values], 1)
+        if self.physical_type == BYTE_ARRAY:
+            return b''.join(struct.pack('<I', len(v)) + v for v in values)
+        return b''.join(values)  # FIXED_LEN_BYTE_ARRAY
+
+
+class ParquetWriter:
+    """
+    Writes rows (tuples in `columns` order) to a binary file object:
+
+        writer = ParquetWriter(output, columns)
+        writer.write_row_group(rows)   # once per chunk
+        writer.close()                 # footer; the file is valid after this
+    """
+
+    def __init__(self, output, columns, compression='gzip', created_by='flowcash'):
+        self.output = output
+        self.columns = list(columns)
+        self.codec = CODEC_GZIP if compression == 'gzip' else CODEC_UNCOMPRESSED
+        self.created_by = created_by
+        self.row_groups = []
+        self.num_rows = 0
+        self.offset = 0
+        self._write(MAGIC)
+
+    def _write(self, data):
+        self.output.write(data)
+        self.offset += len(data)
+
+    def _compress(self, data):
+        if self.codec == CODEC_GZIP:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        return data
+
+    def _write_page(self, page_type, body, header_field, header):
+        compressed = self._compress(body)
+        page_header = _thrift_struct(
+            (1, 'i32', page_type),
+            (2, 'i32', len(body)),
+            (3, 'i32', len(compressed)),
+            (header_field, 'struct', header),
+        )
+        offset = self.offset
+        self._write(page_header)
+        self._write(compressed)
+        return offset, len(page_header) + len(body), len(page_header) + len(compressed)
+
+    def write_row_group(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        chunks = []
+        total_size = 0
+        for column, values in zip(self.columns, zip(*rows)):
+            chunk, size = self._write_column_chunk(column, values)
+            chunks.append(chunk)
+            total_size += size
+        self.row_groups.append(_thrift_struct(
+            (1, 'list', ('struct', chunks)),
+            (2, 'i64', total_size),
+            (3, 'i64', len(rows)),
+        ))
+        self.num_rows += len(rows)
+
+    def _write_column_chunk(self, column, values):
+        present = [column.to_physical(v) for v in values if v is not None]
+        levels = b''
+        if column.nullable:
+            packed = _bit_packed([0 if v is None else 1 for v in values], 1)
+            levels = struct.pack('<I', len(packed)) + packed
+        elif len(present) != len(values):
+            raise ValueError(f"Column {column.name} is not nullable")
+
+        dictionary_offset = None
+        uncompressed = compressed = 0
+        if column.dictionary and present:
+            index = {}
+            keys = [index.setdefault(value, len(index)) for value in present]
+            dictionary = list(index)
+            width = max(len(dictionary) - 1, 1).bit_length()
+            dictionary_offset, raw, written = self._write_page(
+                DICTIONARY_PAGE, column.plain(dictionary), 7,
+                _thrift_struct((1, 'i32', len(dictionary)), (2, 'i32', ENCODING_PLAIN)),
+            )
+            uncompressed += raw
+            compressed += written
+            body = levels + bytes([width]) + _bit_packed(keys, width)
+            encoding = ENCODING_RLE_DICTIONARY
+        else:
+            body = levels + column.plain(present)
+            encoding = ENCODING_PLAIN
+
+        data_offset, raw, written = self._write_page(
+            DATA_PAGE, body, 5,
+            _thrift_struct(
+                (1, 'i32', len(values)),
+                (2, 'i32', encoding),
+                (3, 'i32', ENCODING_RLE),
+                (4, 'i32', ENCODING_RLE),
+            ),
+        )
+        uncompressed += raw
+        compressed += written
+
+        encodings = [ENCODING_PLAIN, ENCODING_RLE] + ([ENCODING_RLE_DICTIONARY] if dictionary_offset is not None else [])
+        metadata = _thrift_struct(
+            (1, 'i32', column.physical_type),
+            (2, 'list', ('i32', encodings)),
+            (3, 'list', ('binary', [column.name])),
+            (4, 'i32', self.codec),
+            (5, 'i64', len(values)),
+            (6, 'i64', uncompressed),
+            (7, 'i64', compressed),
+            (9, 'i64', data_offset),
+            (11, 'i64', dictionary_offset),
+        )
+        chunk_offset = dictionary_offset if dictionary_offset is not None else data_offset
+        return _thrift_struct((2, 'i64', chunk_offset), (3, 'struct', metadata)), uncompressed
+
+    def close(self):
+        root = _thrift_struct((4, 'binary', 'schema'), (5, 'i32', len(self.columns)))
+        footer = _thrift_struct(
+            (1, 'i32', 1),
+            (2, 'list', ('struct', [root] + [column.schema_element() for column in self.columns])),
+            (3, 'i64', self.num_rows),
+            (4, 'list', ('struct', self.row_groups)),
+            (6, 'binary', self.created_by),
+        )
+        self._write(footer)
+        self._write(struct.pack('<I', len(footer)))
+        self._write(MAGIC)
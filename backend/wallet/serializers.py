@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Transaction, Budget, FixedExpense, Category, VisionEntity, GamificationStats, DevicePushToken
+from .models import Transaction, Budget, FixedExpense, Category, VisionEntity, GamificationStats, DevicePushToken, ExportJob
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -56,6 +56,12 @@ class DevicePushTokenSerializer(serializers.ModelSerializer):
         fields = ['id', 'expo_push_token', 'platform', 'created_at', 'updated_at']
         read_only_fields = ('created_at', 'updated_at')
 
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'export_type', 'filters', 'status', 'file_size', 'error', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
 class FixedExpenseSerializer(serializers.ModelSerializer):
     class Meta:
         model = FixedExpense
@@ -1,159 +1,396 @@
+import threading
+from contextlib import contextmanager
+from django.db.models import F, QuerySet, Sum
 from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction as db_transaction
-from .models import Transaction, VisionEntity
+from django.utils import timezone
+from .models import Transaction, VisionEntity, Category
+from .fingerprints import fingerprint_for
+from .ml import invalidate_category_model, update_category_counts
+from .nlp import discard_parsing_context
 from decimal import Decimal
 
+# Per-thread registry of pending balance buffers, keyed by the savepoint stack
+# that was active when the buffer was opened.
+_local = threading.local()
+
+
+class BalanceBuffer:
+    """
+    Accumulates balance deltas for the current database transaction and applies
+    them once, in `transaction.on_commit`.
+
+    Entity types are only known at flush time, so every effect is stored as a
+    pair of deltas: the one to apply if the entity is an asset and the one to
+    apply if it is a liability. Effects on the same entity are merged, so a
+    request that saves many transactions ends with one UPDATE per entity.
+
+    Rollbacks drop the on_commit callback together with the savepoint it was
+    registered in; the registry entry of such a buffer is pruned the next
+    time an effect is queued on that connection (see `_prune_buffers`).
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.deltas = {}  # {entity_pk: [asset_delta, liability_delta]}
+        self.callback = self.flush
+
+    def add(self, entity_pk, asset_delta, liability_delta):
+        pending = self.deltas.setdefault(entity_pk, [Decimal(0), Decimal(0)])
+        pending[0] += asset_delta
+        pending[1] += liability_delta
+
+    def flush(self):
+        buffers = getattr(_local, 'buffers', {})
+        if buffers.get(self.key) is self:
+            del buffers[self.key]
+        apply_balance_deltas(self.deltas)
+        self.deltas = {}
+
+
+def apply_balance_deltas(deltas):
+    """
+    Applies merged {entity_pk: [asset_delta, liability_delta]} deltas with one
+    SELECT for the entity types and one UPDATE per affected entity.
+    """
+    if not deltas:
+        return
+
+    entity_types = dict(
+        VisionEntity.objects.filter(pk__in=list(deltas)).values_list('pk', 'type')
+    )
+    now = timezone.now()
+    for pk, entity_type in entity_types.items():
+        asset_delta, liability_delta = deltas[pk]
+        delta = asset_delta if entity_type == 'asset' else liability_delta
+        if entity_type not in ('asset', 'liability') or not delta:
+            continue
+        VisionEntity.objects.filter(pk=pk).update(amount=F('amount') + delta, updated_at=now)
+
+
+def _prune_buffers(connection):
+    """
+    Drops the connection's buffers whose on_commit callback is gone (their
+    savepoint or transaction was rolled back), so the registry does not grow
+    for the thread's lifetime and a reused savepoint id never finds a stale
+    buffer. Returns the registry.
+    """
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+        return buffers
+
+    pending = {id(entry[1]) for entry in connection.run_on_commit}
+    for key, buffer in list(buffers.items()):
+        if key[0] == connection.alias and id(buffer.callback) not in pending:
+            del buffers[key]
+    return buffers
+
+
+def _current_buffer(connection):
+    """
+    Returns the buffer for the innermost savepoint, opening a new one (and
+    registering its on_commit flush) if there is none or if the previous one
+    was discarded by a rollback.
+    """
+    buffers = _prune_buffers(connection)
+    key = (connection.alias, tuple(connection.savepoint_ids))
+    buffer = buffers.get(key)
+    if buffer is not None:
+        return buffer
+
+    buffer = BalanceBuffer(key)
+    buffers[key] = buffer
+    db_transaction.on_commit(buffer.callback, using=connection.alias)
+    return buffer
+
+
+def _queue_balance_effect(entity_id, asset_delta, liability_delta):
+    """
+    Queues a balance effect on a VisionEntity. Inside an atomic block the
+    effect is buffered until commit; in autocommit mode it is applied now.
+    """
+    if not entity_id:
+        return
+
+    try:
+        # Handle case where entity_id might be string or int
+        entity_pk = int(entity_id)
+    except (TypeError, ValueError):
+        return
+
+    connection = db_transaction.get_connection()
+    if not connection.in_atomic_block:
+        # Lo que quedó de transacciones revertidas ya no se va a aplicar
+        _prune_buffers(connection)
+        apply_balance_deltas({entity_pk: [asset_delta, liability_delta]})
+        return
+
+    _current_buffer(connection).add(entity_pk, asset_delta, liability_delta)
+
+
+def _source_effect(transaction_type, amount):
+    """
+    Returns the (asset_delta, liability_delta) pair a transaction of the given
+    type and amount has on its primary (source) entity.
+    """
+    if transaction_type == 'expense':
+        # Spending on credit card -> Debt Increases
+        return -amount, amount
+    elif transaction_type == 'income':
+        # Refund to credit card -> Debt Decreases
+        return amount, -amount
+    elif transaction_type == 'transfer':
+        # If this is the source of a transfer, it decreases.
+        # Transfer FROM liability (Cash advance) -> Debt Increases
+        return -amount, amount
+    return Decimal(0), Decimal(0)
+
+
 def update_entity_balance(entity_id, amount, transaction_type, is_reversal=False):
     """
     Updates the balance of a VisionEntity based on transaction details.
-    
+
     Logic:
     - Expense + Asset: Decrease Balance (Spending money you have)
     - Expense + Liability: Increase Balance (Increasing debt)
     - Income + Asset: Increase Balance (Receiving money)
     - Income + Liability: Decrease Balance (Paying off debt / Refund)
     - Transfer: Handle Source (related_entity_id) and Destination (transfer_related_entity_id) separately
-    
+
     is_reversal: True if we are undoing a transaction (e.g. pre_save update or delete)
     """
-    if not entity_id:
-        return
+    amount = Decimal(amount)
+    if is_reversal:
+        amount = -amount
 
-    try:
-        # Handle case where entity_id might be string or int
-        entity = VisionEntity.objects.get(pk=int(entity_id))
-    except (VisionEntity.DoesNotExist, ValueError):
-        return
+    asset_delta, liability_delta = _source_effect(transaction_type, amount)
+    _queue_balance_effect(entity_id, asset_delta, liability_delta)
 
+
+def update_transfer_destination_balance(entity_id, amount, is_reversal=False):
+    """
+    Destination logic is inverted relative to Source:
+    - Asset Dest: Increases (Receiving money)
+    - Liability Dest: Decreases (Debt being paid off)
+    """
     amount = Decimal(amount)
     if is_reversal:
         amount = -amount
 
-    if entity.type == 'asset':
-        if transaction_type == 'expense':
-            entity.amount -= amount
-        elif transaction_type == 'income':
-            entity.amount += amount
-        elif transaction_type == 'transfer':
-            # If this is the source of a transfer, it decreases
-            entity.amount -= amount
-            
-    elif entity.type == 'liability':
-        if transaction_type == 'expense':
-            # Spending on credit card -> Debt Increases
-            entity.amount += amount
-        elif transaction_type == 'income':
-            # Refund to credit card -> Debt Decreases
-            entity.amount -= amount
-        elif transaction_type == 'transfer':
-            # Transfer FROM liability (Cash advance) -> Debt Increases
-            entity.amount += amount
-
-    entity.save()
+    _queue_balance_effect(entity_id, amount, -amount)
+
+
+@contextmanager
+def suppress_balance_signals():
+    """
+    Disables the balance signals for the current thread, for maintenance jobs
+    that write many transactions at once (imports, migrations, restores).
+
+    Entity balances are left untouched while suppressed; pass the rows written
+    meanwhile to `recompute_balances(transactions)` if they should count.
+    """
+    _local.suppressed = getattr(_local, 'suppressed', 0) + 1
+    try:
+        yield
+    finally:
+        _local.suppressed -= 1
+
+
+def balance_signals_suppressed():
+    return getattr(_local, 'suppressed', 0) > 0
+
+
+def recompute_balances(transactions):
+    """
+    Applies the balance effect of `transactions` to their entities, with one
+    UPDATE per affected entity. `transactions` is a queryset (aggregated in
+    two grouped queries) or an iterable of Transaction instances.
+
+    Only for rows whose effect was never applied: those written under
+    `suppress_balance_signals()` or with `bulk_create`. Rows that went
+    through the signals would be counted twice.
+
+    Returns the number of entities that received a delta.
+    """
+    deltas = {}
+
+    def add(entity_id, asset_delta, liability_delta):
+        try:
+            entity_pk = int(entity_id)
+        except (TypeError, ValueError):
+            return
+        pending = deltas.setdefault(entity_pk, [Decimal(0), Decimal(0)])
+        pending[0] += asset_delta
+        pending[1] += liability_delta
+
+    if isinstance(transactions, QuerySet):
+        # 1. Primary Entity
+        sources = (
+            transactions.exclude(related_entity_id__isnull=True)
+            .exclude(related_entity_id='')
+            .values('related_entity_id', 'type')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        for row in sources:
+            add(row['related_entity_id'], *_source_effect(row['type'], row['total']))
+
+        # 2. Transfer Destination
+        destinations = (
+            transactions.filter(type='transfer')
+            .exclude(transfer_related_entity_id__isnull=True)
+            .exclude(transfer_related_entity_id='')
+            .values('transfer_related_entity_id')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        for row in destinations:
+            add(row['transfer_related_entity_id'], row['total'], -row['total'])
+    else:
+        for transaction in transactions:
+            amount = Decimal(transaction.amount)
+            add(transaction.related_entity_id, *_source_effect(transaction.type, amount))
+            if transaction.type == 'transfer':
+                add(transaction.transfer_related_entity_id, amount, -amount)
+
+    apply_balance_deltas(deltas)
+    return len(deltas)
+
 
 @receiver(pre_save, sender=Transaction)
 def store_old_transaction_state(sender, instance, **kwargs):
     """
     Before saving, if this is an update, reverse the effect of the OLD transaction data.
+    The old row is kept on the instance for the post_save receivers.
     """
+    instance._old_state = None
     if instance.pk:
         try:
-            old_instance = Transaction.objects.get(pk=instance.pk)
-            
-            # Reverse Primary Entity Effect
-            if old_instance.related_entity_id:
-                # Special handling for Transfer destination
-                is_transfer_source = (old_instance.type == 'transfer')
-                update_entity_balance(
-                    old_instance.related_entity_id, 
-                    old_instance.amount, 
-                    old_instance.type, 
-                    is_reversal=True
-                )
-
-            # Reverse Transfer Destination Effect
-            if old_instance.type == 'transfer' and old_instance.transfer_related_entity_id:
-                # Destination logic is inverted relative to Source
-                # Asset Dest: Increases (+ amount) -> Reversal: Decrease (- amount)
-                # Liability Dest: Decreases (- amount) -> Reversal: Increase (+ amount)
-                
-                # To reuse update_entity_balance, we treat destination as "Income" for Asset 
-                # and "Income" (Payment) for Liability?
-                # Simpler: Just inline the logic for destination or make helper smarter.
-                
-                # Let's do manual reversal for destination to be safe/clear
-                dest_id = old_instance.transfer_related_entity_id
-                try:
-                    dest = VisionEntity.objects.get(pk=int(dest_id))
-                    amt = Decimal(old_instance.amount)
-                    # Reversing:
-                    if dest.type == 'asset':
-                        dest.amount -= amt # Originally added, now subtract
-                    elif dest.type == 'liability':
-                        dest.amount += amt # Originally subtracted (payment), now add back
-                    dest.save()
-                except (VisionEntity.DoesNotExist, ValueError):
-                    pass
-
+            instance._old_state = Transaction.objects.get(pk=instance.pk)
         except Transaction.DoesNotExist:
             pass
 
+    old_instance = instance._old_state
+    if old_instance is None or balance_signals_suppressed():
+        return
+
+    # Reverse Primary Entity Effect
+    if old_instance.related_entity_id:
+        update_entity_balance(
+            old_instance.related_entity_id,
+            old_instance.amount,
+            old_instance.type,
+            is_reversal=True
+        )
+
+    # Reverse Transfer Destination Effect
+    if old_instance.type == 'transfer' and old_instance.transfer_related_entity_id:
+        update_transfer_destination_balance(
+            old_instance.transfer_related_entity_id,
+            old_instance.amount,
+            is_reversal=True
+        )
+
 @receiver(post_save, sender=Transaction)
 def apply_new_transaction_state(sender, instance, created, **kwargs):
     """
     After saving, apply the effect of the NEW transaction data.
     """
+    if balance_signals_suppressed():
+        return
+
     # 1. Primary Entity
     if instance.related_entity_id:
         update_entity_balance(
-            instance.related_entity_id, 
-            instance.amount, 
-            instance.type, 
+            instance.related_entity_id,
+            instance.amount,
+            instance.type,
             is_reversal=False
         )
 
     # 2. Transfer Destination
     if instance.type == 'transfer' and instance.transfer_related_entity_id:
-        dest_id = instance.transfer_related_entity_id
-        try:
-            dest = VisionEntity.objects.get(pk=int(dest_id))
-            amt = Decimal(instance.amount)
-            
-            if dest.type == 'asset':
-                dest.amount += amt # Receiving money
-            elif dest.type == 'liability':
-                dest.amount -= amt # Debt being paid off
-            dest.save()
-        except (VisionEntity.DoesNotExist, ValueError):
-            pass
+        update_transfer_destination_balance(
+            instance.transfer_related_entity_id,
+            instance.amount,
+            is_reversal=False
+        )
 
 @receiver(post_delete, sender=Transaction)
 def reverse_deleted_transaction(sender, instance, **kwargs):
     """
     If a transaction is deleted, reverse its effect.
     """
+    if balance_signals_suppressed():
+        return
+
     # 1. Primary Entity
     if instance.related_entity_id:
         update_entity_balance(
-            instance.related_entity_id, 
-            instance.amount, 
-            instance.type, 
+            instance.related_entity_id,
+            instance.amount,
+            instance.type,
             is_reversal=True # Reversal = Undo the effect
         )
 
     # 2. Transfer Destination
     if instance.type == 'transfer' and instance.transfer_related_entity_id:
-        dest_id = instance.transfer_related_entity_id
-        try:
-            dest = VisionEntity.objects.get(pk=int(dest_id))
-            amt = Decimal(instance.amount)
-            
-            # Reversing destination effect
-            if dest.type == 'asset':
-                dest.amount -= amt 
-            elif dest.type == 'liability':
-                dest.amount += amt
-            dest.save()
-        except (VisionEntity.DoesNotExist, ValueError):
-            pass
+        update_transfer_destination_balance(
+            instance.transfer_related_entity_id,
+            instance.amount,
+            is_reversal=True
+        )
+
+@receiver(pre_save, sender=Transaction)
+def set_transaction_fingerprint(sender, instance, **kwargs):
+    """
+    Keeps the duplicate-detection fingerprint in step with the row. Writes
+    that bypass save() (bulk_create, queryset.update) must set it themselves.
+    """
+    instance.fingerprint = fingerprint_for(instance)
+
+@receiver(post_save, sender=Transaction)
+def update_transaction_category_counts(sender, instance, **kwargs):
+    """
+    Keeps the Naive Bayes counts in step with the transaction's description
+    and category; the persisted model is only invalidated if they changed.
+    """
+    old_instance = getattr(instance, '_old_state', None)
+    old = (old_instance.description, old_instance.category) if old_instance else None
+    if update_category_counts(instance.user_id, old, (instance.description, instance.category)):
+        invalidate_category_model(instance.user_id)
+
+@receiver(post_delete, sender=Transaction)
+def remove_transaction_category_counts(sender, instance, **kwargs):
+    if update_category_counts(instance.user_id, (instance.description, instance.category), None):
+        invalidate_category_model(instance.user_id)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_user_category_model(sender, instance, **kwargs):
+    """
+    Category names feed the name and keyword matching of the predictor.
+    """
+    invalidate_category_model(instance.user_id)
+
+@receiver(pre_save, sender=VisionEntity)
+def store_old_entity_name(sender, instance, **kwargs):
+    instance._old_name = None
+    if instance.pk:
+        instance._old_name = VisionEntity.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+@receiver(post_save, sender=VisionEntity)
+def invalidate_renamed_entity_context(sender, instance, created, **kwargs):
+    """
+    Entity names feed the voice command matcher. Other workers notice the
+    change through the user's ParsingContextVersion; balance and other
+    field updates keep the cached context.
+    """
+    if created or instance.name != getattr(instance, '_old_name', None):
+        discard_parsing_context(instance.user_id)
+
+@receiver(post_delete, sender=VisionEntity)
+def invalidate_deleted_entity_context(sender, instance, **kwargs):
+    discard_parsing_context(instance.user_id)
@@ -0,0 +1,138 @@
+import re
+
+# Clases de palabra; dentro de un grupo (< 1000) deben aparecer en orden
+# descendente: centenas > decenas > unidades ("trescientos cuarenta y cinco")
+UNIT, TENS, HUNDREDS, SCALE = 1, 2, 3, 4
+
+NUMBER_WORDS = {}
+for _words, _kind in [
+    ({
+        'cero': 0, 'un': 1, 'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4,
+        'cinco': 5, 'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9,
+        # De 10 a 29 son una sola palabra y ocupan el lugar de decenas + unidades
+        'diez': 10, 'once': 11, 'doce': 12, 'trece': 13, 'catorce': 14, 'quince': 15,
+        'dieciseis': 16, 'dieciséis': 16, 'diecisiete': 17, 'dieciocho': 18, 'diecinueve': 19,
+        'veintiun': 21, 'veintiún': 21, 'veintiuno': 21, 'veintiuna': 21,
+        'veintidos': 22, 'veintidós': 22, 'veintitres': 23, 'veintitrés': 23,
+        'veinticuatro': 24, 'veinticinco': 25, 'veintiseis': 26, 'veintiséis': 26,
+        'veintisiete': 27, 'veintiocho': 28, 'veintinueve': 29,
+    }, UNIT),
+    ({
+        'veinte': 20, 'treinta': 30, 'cuarenta': 40, 'cincuenta': 50,
+        'sesenta': 60, 'setenta': 70, 'ochenta': 80, 'noventa': 90,
+    }, TENS),
+    ({
+        'cien': 100, 'ciento': 100, 'doscientos': 200, 'doscientas': 200,
+        'trescientos': 300, 'trescientas': 300, 'cuatrocientos': 400, 'cuatrocientas': 400,
+        'quinientos': 500, 'quinientas': 500, 'seiscientos': 600, 'seiscientas': 600,
+        'setecientos': 700, 'setecientas': 700, 'ochocientos': 800, 'ochocientas': 800,
+        'novecientos': 900, 'novecientas': 900,
+    }, HUNDREDS),
+    ({'mil': 1000, 'millon': 1000000, 'millón': 1000000, 'millones': 1000000}, SCALE),
+]:
+    for _word, _value in _words.items():
+        NUMBER_WORDS[_word] = (_kind, _value)
+
+# "un"/"una" solos suelen ser artículos ("una pizza"), salvo antes de "peso(s)"
+ARTICLES = frozenset(['un', 'una'])
+CURRENCY_WORDS = frozenset(['peso', 'pesos'])
+CENT_WORDS = frozenset(['centavo', 'centavos', 'cvs'])
+
+_TOKEN = re.compile(r'[a-záéíóúüñ]+', re.IGNORECASE)
+
+
+def find_spanish_numbers(text):
+    """
+    Finds the numbers written in words in `text` with a single pass over its
+    tokens, e.g. "dos mil trescientos cuarenta y cinco" or
+    "cien pesos con cincuenta centavos".
+
+    Returns a list of (value, start, end), where value is an int (a float when
+    it has cents) and [start:end] is the span of `text` it was read from.
+    """
+    tokens = [(m.group().lower(), m.start(), m.end()) for m in _TOKEN.finditer(text or '')]
+    numbers = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i][0] not in NUMBER_WORDS:
+            i += 1
+            continue
+
+        value, j = _read_integer(tokens, i)
+        if j == i + 1 and tokens[i][0] in ARTICLES and not _word_at(tokens, j, CURRENCY_WORDS):
+            i += 1
+            continue
+
+        end = tokens[j - 1][2]
+        cents, k = _read_cents(tokens, j)
+        if cents is not None:
+            value = round(value + cents / 100, 2)
+            end = tokens[k - 1][2]
+            j = k
+        numbers.append((value, tokens[i][1], end))
+        i = j
+    return numbers
+
+
+def _word_at(tokens, index, words):
+    return index < len(tokens) and tokens[index][0] in words
+
+
+def _read_integer(tokens, i):
+    """
+    Reads the longest well-formed number starting at tokens[i]. Returns
+    (value, index after its last token).
+    """
+    total = 0
+    group = 0
+    last = None  # clase de la última palabra del grupo actual
+    j = i
+    while j < len(tokens):
+        word = tokens[j][0]
+        if word == 'y':
+            # Solo entre decenas y unidades: "cuarenta y cinco"
+            following = NUMBER_WORDS.get(tokens[j + 1][0]) if j + 1 < len(tokens) else None
+            if last != TENS or not following or following[0] != UNIT:
+                break
+            j += 1
+            continue
+
+        entry = NUMBER_WORDS.get(word)
+        if entry is None:
+            break
+        kind, value = entry
+
+        if kind == SCALE:
+            if value == 1000:
+                # "mil mil" son dos números; "seis millones mil" es uno
+                if group == 0 and total % 1000000:
+                    break
+                total += (group or 1) * 1000
+            else:
+                total = ((total + group) or 1) * value
+            group = 0
+            last = None
+        else:
+            # "veinte treinta" son dos números
+            if last is not None and kind >= last:
+                break
+            group += value
+            last = kind
+        j += 1
+    return total + group, j
+
+
+def _read_cents(tokens, j):
+    """
+    Reads "[pesos] con <número> centavos" after an integer. The cents need
+    "centavos" after them: in "cien pesos con una amiga" or "doscientos
+    pesos con dos amigos" the words after "con" are not an amount.
+    """
+    k = j + 1 if _word_at(tokens, j, CURRENCY_WORDS) else j
+    if not _word_at(tokens, k, ('con',)) or not _word_at(tokens, k + 1, NUMBER_WORDS):
+        return None, j
+
+    cents, end = _read_integer(tokens, k + 1)
+    if cents >= 100 or not _word_at(tokens, end, CENT_WORDS):
+        return None, j
+    return cents, end + 1
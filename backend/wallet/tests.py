@@ -1,10 +1,41 @@
-from django.test import TestCase
+import os
+import csv
+import gzip
+import json
+import tempfile
+import zipfile
+import importlib.util
+from unittest import mock
+import openpyxl
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Spacer
+from reportlab.platypus.doctemplate import LayoutError
+from io import BytesIO, StringIO
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from django.db import connection, transaction as db_transaction
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
-from .models import Transaction, VisionEntity
+from .models import Transaction, VisionEntity, Category, CategoryModel, CategoryDocCount, CategoryTokenCount, ExportJob, ExportCacheEntry, Budget, FixedExpense, GamificationStats, FirebaseMigrationCheckpoint, ParseSession
+from . import global_model, signals
+from .ml import CategoryPredictor, get_category_predictor, rebuild_category_counts, _predictor_cache
+from .signals import suppress_balance_signals, recompute_balances
+from .nlp import parse_voice_command, get_parsing_context, discard_parsing_context
+from . import fuzzy
+from .fuzzy import FuzzyMatcher
+from .spanish_numbers import find_spanish_numbers
+from .exporters import render_transactions_pdf, _PageWriter
+from .export_jobs import process_export_jobs
+from .backup import write_backup, restore_backup
+from .importers import StatementReader, import_statement, import_statement_events
+from .firebase_migration import FirestoreMigration
 from decimal import Decimal
 from django.utils import timezone
 
-class SignalTests(TestCase):
+class SignalTests(TransactionTestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
         
@@ -127,3 +158,1195 @@ class SignalTests(TestCase):
         self.assertEqual(self.asset.amount, Decimal("900.00"))
         # Liability: 500 - 100 = 400
         self.assertEqual(self.liability.amount, Decimal("400.00"))
+
+    def test_atomic_block_defers_balance_until_commit(self):
+        """Test that balance effects inside an atomic block are merged and applied on commit."""
+        with db_transaction.atomic():
+            for amount in ("100.00", "50.00", "25.00"):
+                Transaction.objects.create(
+                    user=self.user,
+                    amount=Decimal(amount),
+                    type="expense",
+                    description="Dinner",
+                    date=timezone.now(),
+                    related_entity_id=str(self.liability.id)
+                )
+
+            self.liability.refresh_from_db()
+            self.assertEqual(self.liability.amount, Decimal("0.00"))
+
+        self.liability.refresh_from_db()
+        self.assertEqual(self.liability.amount, Decimal("175.00"))
+
+    def test_rollback_discards_pending_balance(self):
+        """Test that a rolled back savepoint discards its buffered balance effects."""
+        with db_transaction.atomic():
+            Transaction.objects.create(
+                user=self.user,
+                amount=Decimal("100.00"),
+                type="expense",
+                description="Groceries",
+                date=timezone.now(),
+                related_entity_id=str(self.asset.id)
+            )
+            try:
+                with db_transaction.atomic():
+                    Transaction.objects.create(
+                        user=self.user,
+                        amount=Decimal("300.00"),
+                        type="expense",
+                        description="Rolled back",
+                        date=timezone.now(),
+                        related_entity_id=str(self.asset.id)
+                    )
+                    raise ValueError
+            except ValueError:
+                pass
+
+            Transaction.objects.create(
+                user=self.user,
+                amount=Decimal("10.00"),
+                type="expense",
+                description="Coffee",
+                date=timezone.now(),
+                related_entity_id=str(self.asset.id)
+            )
+
+        self.asset.refresh_from_db()
+        self.assertEqual(self.asset.amount, Decimal("890.00"))
+
+    def test_rolled_back_buffers_are_pruned(self):
+        """Test that buffers of rolled back transactions do not stay in the per-thread registry."""
+        for _ in range(3):
+            try:
+                with db_transaction.atomic():
+                    Transaction.objects.create(
+                        user=self.user, amount=Decimal("5.00"), type="expense", description="Rolled back",
+                        date=timezone.now(), related_entity_id=str(self.asset.id),
+                    )
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(len(signals._local.buffers), 1)
+
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("5.00"), type="expense", description="Autocommit",
+            date=timezone.now(), related_entity_id=str(self.asset.id),
+        )
+        self.assertEqual(signals._local.buffers, {})
+        self.asset.refresh_from_db()
+        self.assertEqual(self.asset.amount, Decimal("995.00"))
+
+    def test_suppressed_signals_then_recompute(self):
+        """Test that suppressed writes leave balances alone until recompute_balances runs."""
+        # Applied through the signals: must not be counted again
+        Transaction.objects.create(
+            user=self.user,
+            amount=Decimal("50.00"),
+            type="expense",
+            description="Lunch",
+            date=timezone.now(),
+            related_entity_id=str(self.asset.id)
+        )
+        with suppress_balance_signals():
+            dinner = Transaction.objects.create(
+                user=self.user,
+                amount=Decimal("100.00"),
+                type="expense",
+                description="Dinner",
+                date=timezone.now(),
+                related_entity_id=str(self.liability.id)
+            )
+            payment = Transaction(
+                user=self.user,
+                amount=Decimal("200.00"),
+                type="transfer",
+                description="Pay Card",
+                date=timezone.now(),
+                related_entity_id=str(self.asset.id),
+                transfer_related_entity_id=str(self.liability.id)
+            )
+            Transaction.objects.bulk_create([payment])
+
+        self.asset.refresh_from_db()
+        self.liability.refresh_from_db()
+        self.assertEqual(self.asset.amount, Decimal("950.00"))
+        self.assertEqual(self.liability.amount, Decimal("0.00"))
+
+        self.assertEqual(recompute_balances(Transaction.objects.filter(pk=dinner.pk)), 1)
+        self.assertEqual(recompute_balances([payment]), 2)
+
+        self.asset.refresh_from_db()
+        self.liability.refresh_from_db()
+        # Asset: 1000 - 50 - 200 = 750
+        self.assertEqual(self.asset.amount, Decimal("750.00"))
+        # Liability: 0 + 100 - 200 = -100
+        self.assertEqual(self.liability.amount, Decimal("-100.00"))
+
+
+class CategoryPredictorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mluser', password='password')
+        Category.objects.create(user=self.user, name="Comida")
+        Category.objects.create(user=self.user, name="Transporte")
+        for description, category in [
+            ("Tacos el guero", "Comida"),
+            ("Tacos de canasta", "Comida"),
+            ("Tortas ahogadas", "Comida"),
+            ("Metro linea 3", "Transporte"),
+            ("Recarga metro", "Transporte"),
+            ("Caseta autopista", "Transporte"),
+        ]:
+            Transaction.objects.create(
+                user=self.user,
+                amount=Decimal("50.00"),
+                type="expense",
+                description=description,
+                category=category,
+                date=timezone.now(),
+            )
+        _predictor_cache.clear()
+
+    def test_dumps_loads_round_trip(self):
+        """Test that a serialized predictor predicts like the trained one."""
+        predictor = CategoryPredictor(self.user)
+        predictor.train()
+        restored = CategoryPredictor.loads(self.user, predictor.dumps())
+
+        self.assertTrue(restored.is_trained)
+        self.assertEqual(restored.vocab, predictor.vocab)
+        for description in ("tacos al pastor", "recarga del metro", "caseta"):
+            self.assertEqual(restored.predict(description), predictor.predict(description))
+
+    def test_persisted_model_is_reused_until_invalidated(self):
+        """Test that the persisted model is loaded without retraining and refreshed after writes."""
+        get_category_predictor(self.user)
+        model = CategoryModel.objects.get(user=self.user)
+        self.assertEqual(model.trained_revision, model.revision)
+
+        _predictor_cache.clear()
+        with self.assertNumQueries(2):
+            predictor = get_category_predictor(self.user)
+        self.assertEqual(predictor.predict("tortas de jamon"), "Comida")
+
+        with self.assertNumQueries(1):
+            get_category_predictor(self.user)
+
+        Transaction.objects.create(
+            user=self.user,
+            amount=Decimal("20.00"),
+            type="expense",
+            description="Boleto camion",
+            category="Transporte",
+            date=timezone.now(),
+        )
+        self.assertIn("camion", get_category_predictor(self.user).vocab)
+
+    def test_counts_follow_edits_and_deletes(self):
+        """Test that token counts are updated incrementally and match a full rebuild."""
+        tx = Transaction.objects.get(user=self.user, description="Metro linea 3")
+        tx.description = "Tacos de suadero"
+        tx.category = "Comida"
+        tx.save()
+
+        self.assertFalse(CategoryTokenCount.objects.filter(user=self.user, token="linea").exists())
+        self.assertEqual(
+            CategoryTokenCount.objects.get(user=self.user, category="Comida", token="tacos").count, 3
+        )
+        self.assertEqual(CategoryDocCount.objects.get(user=self.user, category="Transporte").doc_count, 2)
+
+        Transaction.objects.filter(user=self.user, category="Transporte").delete()
+        self.assertFalse(CategoryDocCount.objects.filter(user=self.user, category="Transporte").exists())
+
+        incremental = set(CategoryTokenCount.objects.filter(user=self.user).values_list('category', 'token', 'count'))
+        rebuild_category_counts(self.user)
+        rebuilt = set(CategoryTokenCount.objects.filter(user=self.user).values_list('category', 'token', 'count'))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_counts_are_upserted(self):
+        """Test that count rows written concurrently are added to, with one statement per table."""
+        # Fila que otro guardado insertó entre medias
+        CategoryTokenCount.objects.create(user=self.user, category="Comida", token="pozole", count=2)
+
+        with CaptureQueriesContext(connection) as queries:
+            Transaction.objects.create(
+                user=self.user,
+                amount=Decimal("90.00"),
+                type="expense",
+                description="Pozole rojo grande",
+                category="Comida",
+                date=timezone.now(),
+            )
+        token_writes = [q for q in queries.captured_queries if 'wallet_categorytokencount' in q['sql']]
+        self.assertEqual(len(token_writes), 1)
+        self.assertEqual(CategoryTokenCount.objects.get(user=self.user, category="Comida", token="pozole").count, 3)
+        self.assertEqual(CategoryTokenCount.objects.get(user=self.user, category="Comida", token="rojo").count, 1)
+
+    def test_amount_only_edit_keeps_model_fresh(self):
+        """Test that edits not touching description or category do not invalidate the model."""
+        get_category_predictor(self.user)
+        tx = Transaction.objects.filter(user=self.user).first()
+        tx.amount = Decimal("75.00")
+        tx.save()
+
+        model = CategoryModel.objects.get(user=self.user)
+        self.assertEqual(model.trained_revision, model.revision)
+
+    def test_predict_many_matches_single_predictions(self):
+        """Test that batch prediction returns the same results, in order, as single calls."""
+        predictor = get_category_predictor(self.user)
+        descriptions = ["tacos al pastor", "recarga metro", "algo nuevo", "tacos al pastor", ""]
+        self.assertEqual(
+            predictor.predict_many(descriptions),
+            [predictor.predict(d) for d in descriptions],
+        )
+
+    def test_predict_batch_endpoint(self):
+        """Test POST /categories/predict-batch/."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            '/api/wallet/categories/predict-batch/',
+            {"descriptions": ["Tortas de pierna", "Caseta de peaje"]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [p["predicted_category"] for p in response.data["predictions"]],
+            ["Comida", "Transporte"],
+        )
+
+        response = client.post('/api/wallet/categories/predict-batch/', {"descriptions": "x"}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_predict_top_k_reports_strategy_and_probabilities(self):
+        """Test that top-k predictions carry normalized probabilities and the matching strategy."""
+        predictor = get_category_predictor(self.user)
+
+        result = predictor.predict_top_k("Recarga metro", k=2)
+        self.assertEqual(result["predicted_category"], "Transporte")
+        self.assertEqual(result["strategy"], "naive_bayes")
+        self.assertEqual([p["category"] for p in result["top_k"]], ["Transporte", "Comida"])
+        self.assertAlmostEqual(sum(p["probability"] for p in result["top_k"]), 1.0, places=3)
+        self.assertEqual(result["confidence"], result["top_k"][0]["probability"])
+
+        self.assertEqual(predictor.predict_top_k("Pago transporte escolar")["strategy"], "name")
+        self.assertEqual(predictor.predict_top_k("zzz qqq")["predicted_category"], None)
+
+    def test_predict_endpoint_top_k(self):
+        """Test that /categories/predict/ only adds the explanation when top_k is sent."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/wallet/categories/predict/', {"description": "Tacos"}, format='json')
+        self.assertEqual(set(response.data), {"description", "predicted_category"})
+
+        response = client.post(
+            '/api/wallet/categories/predict/', {"description": "Tacos dorados", "top_k": 1}, format='json'
+        )
+        self.assertEqual(response.data["strategy"], "keyword")
+        self.assertEqual(len(response.data["top_k"]), 1)
+
+    def test_multi_word_merchant_keywords(self):
+        """Test that multi-word merchants map to concepts and partial category names."""
+        Category.objects.create(user=self.user, name="Salud")
+        Category.objects.create(user=self.user, name="Compras varias")
+        predictor = get_category_predictor(self.user)
+
+        self.assertEqual(predictor.predict("FARMACIAS DEL AHORRO suc 123"), "Salud")
+        self.assertEqual(predictor.predict("Mercado Libre MX"), "Compras Varias")
+
+
+    def test_benchmark_command_reports_json(self):
+        """Test that the predictor benchmark runs k-fold over a synthetic corpus."""
+        out = StringIO()
+        call_command('benchmark_category_predictor', synthetic=200, folds=2, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["documents"], 200)
+        self.assertGreater(report["accuracy"], 0.5)
+        for key in ("train_seconds_mean", "predict_ms_p50", "predict_ms_p99", "train_peak_memory_bytes"):
+            self.assertIn(key, report)
+
+class VoiceCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voiceuser', password='password')
+        self.card = VisionEntity.objects.create(user=self.user, name="Tarjeta Oro", type="liability")
+        VisionEntity.objects.create(user=self.user, name="Oro", type="asset")
+        discard_parsing_context(self.user.pk)
+        _predictor_cache.clear()
+
+    def test_parsing_context_matches_longest_entity_and_is_reused(self):
+        """Test that the entity matcher prefers the longest name and is cached between calls."""
+        result = parse_voice_command("Gasté 200 en tacos con tarjeta oro", self.user)
+        self.assertEqual(result["relatedEntityId"], self.card.id)
+        self.assertEqual(result["amount"], 200.0)
+
+        context = get_parsing_context(self.user)
+        self.assertIs(get_parsing_context(self.user), context)
+
+        # Renombrar una entidad reconstruye el contexto
+        self.card.name = "Tarjeta Platino"
+        self.card.save()
+        self.assertIsNot(get_parsing_context(self.user), context)
+        result = parse_voice_command("Gasté 200 con tarjeta platino", self.user)
+        self.assertEqual(result["relatedEntityName"], "Tarjeta Platino")
+
+    def test_parsing_context_survives_balance_updates(self):
+        """Test that transactions moving entity balances do not rebuild the parsing context."""
+        context = get_parsing_context(self.user)
+        Transaction.objects.create(
+            user=self.user, amount=Decimal("80.00"), type="expense", description="Cena",
+            date=timezone.now(), related_entity_id=str(self.card.id),
+        )
+        self.card.refresh_from_db()
+        self.card.interest_rate = Decimal("45.00")
+        self.card.save()
+        self.assertIs(get_parsing_context(self.user), context)
+
+        VisionEntity.objects.filter(pk=self.card.pk).delete()
+        self.assertIsNot(get_parsing_context(self.user), context)
+
+    def test_fuzzy_entity_match_for_transcription_errors(self):
+        """Test that misheard entity names still match, with their score."""
+        bbva = VisionEntity.objects.create(user=self.user, name="Tarjeta BBVA", type="asset")
+        result = parse_voice_command("Pagué 300 de luz con tarjeta bebeva", self.user)
+        self.assertEqual(result["relatedEntityId"], bbva.id)
+        self.assertGreaterEqual(result["relatedEntityScore"], 0.65)
+        self.assertLess(result["relatedEntityScore"], 1.0)
+
+        matcher = FuzzyMatcher([("Tarjeta Oro", 1), ("BBVA", 2), ("Efectivo", 3)])
+        self.assertEqual(matcher.match("pago con efectibo")[:2], (3, 7 / 8))
+        self.assertIsNone(matcher.match("compre tacos en el oxxo"))
+        self.assertIsNone(matcher.match("pago con bbba"))
+
+    def test_fuzzy_match_ignores_common_words_near_short_names(self):
+        """Test that short entity names only match exactly, not ordinary words one edit away."""
+        VisionEntity.objects.create(user=self.user, name="Caja", type="asset")
+        for text in ["Gasté 100 cuando fui a la casa", "Gasté 50 pesos cada uno", "Pagué 30 de cafe"]:
+            self.assertIsNone(parse_voice_command(text, self.user)["relatedEntityId"], text)
+        self.assertIsNone(FuzzyMatcher([("Caja", 1)]).match("casa"))
+        self.assertIsNone(FuzzyMatcher([("Banco", 1)]).match("barato"))
+
+    def test_entity_span_is_removed_as_written(self):
+        """Test that the matched entity is cut from the description even with accents and punctuation."""
+        bbva = VisionEntity.objects.create(user=self.user, name="Tarjeta BBVA", type="asset")
+        result = parse_voice_command("Gasté 200 con Tarjeta BBVÁ, en tacos", self.user)
+        self.assertEqual(result["relatedEntityId"], bbva.id)
+        self.assertEqual(result["relatedEntityScore"], 1.0)
+        self.assertEqual(result["description"], "Tacos")
+
+        text = "pago con efectívo."
+        _, _, (start, end) = FuzzyMatcher([("Efectivo", 3)]).match(text)
+        self.assertEqual(text[start:end], "efectívo")
+
+    def test_parse_batch_streams_ndjson(self):
+        """Test that pasted notifications use the bank templates and stream one result per line."""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        text = "\n".join([
+            "BBVA: Compra aprobada por $1,234.56 en OXXO SUC 123 con tu tarjeta terminación 1234 el 12/03/2024.",
+            "",
+            "Gasté 200 con tarjeta oro",
+        ])
+        response = client.post('/api/wallet/transactions/parse-batch/', {"text": text}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        results = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([r["index"] for r in results], [0, 2])
+        self.assertEqual(results[0]["source"], "template")
+        self.assertEqual(results[0]["amount"], 1234.56)
+        self.assertEqual(results[0]["cardSuffix"], "1234")
+        self.assertEqual(results[0]["date"], "2024-03-12")
+        self.assertEqual(results[0]["description"], "Oxxo suc 123")
+        self.assertEqual(results[1]["source"], "voice")
+        self.assertEqual(results[1]["relatedEntityId"], self.card.id)
+
+    def test_spanish_number_words(self):
+        """Test that amounts spoken in words are parsed compositionally."""
+        for text, amount in [
+            ("gasté dos mil trescientos cuarenta y cinco en el súper", 2345.0),
+            ("mil quinientos de renta", 1500.0),
+            ("cien pesos con cincuenta centavos de propina", 100.5),
+            ("compré una pizza de doscientos", 200.0),
+            ("dos millones quinientos mil del coche", 2500000.0),
+        ]:
+            self.assertEqual(parse_voice_command(text, self.user)["amount"], amount, text)
+
+        self.assertEqual(find_spanish_numbers("veinte treinta"), [(20, 0, 6), (30, 7, 14)])
+        self.assertEqual(find_spanish_numbers("cien pesos con un centavo"), [(100.01, 0, 25)])
+        # Sin "centavos" lo que sigue a "con" no es parte del monto
+        self.assertEqual(find_spanish_numbers("gasté cien pesos con una amiga"), [(100, 6, 10)])
+        self.assertEqual(find_spanish_numbers("doscientos pesos con dos amigos"), [(200, 0, 10), (2, 21, 24)])
+        self.assertEqual(parse_voice_command("cien pesos con cincuenta amigos", self.user)["amount"], 100.0)
+        result = parse_voice_command("gasté doscientos en dos tacos", self.user)
+        self.assertEqual(result["description"], "Dos tacos")
+
+    def test_number_parser_benchmark_command(self):
+        """Test that the number parser benchmark scores labelled utterances and the old word map."""
+        out = StringIO()
+        call_command('benchmark_number_parser', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["utterances"], 40)
+        self.assertLess(report["legacy_accuracy"], report["accuracy"])
+        self.assertLess(report["accuracy"], 1.0)
+
+        # El corpus sintético sale de la misma gramática: no se reporta como accuracy
+        out = StringIO()
+        call_command('benchmark_number_parser', synthetic=300, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["self_consistency"], 1.0)
+        self.assertNotIn("accuracy", report)
+
+    def test_parse_session_reuses_matches(self):
+        """Test that a parse session fills the draft in as the transcript grows."""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = '/api/wallet/transactions/parse-session/'
+
+        response = client.post(url, {"text": "gasté doscientos"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        session_id = response.data["session_id"]
+        self.assertEqual(response.data["draft"]["amount"], 200.0)
+        self.assertIsNone(response.data["draft"]["relatedEntityId"])
+
+        response = client.post(url, {"text": "gasté doscientos con tarjeta oro", "session_id": session_id}, format='json')
+        self.assertEqual(response.data["draft"]["relatedEntityId"], self.card.id)
+        self.assertIn("relatedEntityId", response.data["changed"])
+        self.assertNotIn("amount", response.data["changed"])
+
+        # El mismo texto no vuelve a parsear
+        with mock.patch('wallet.nlp.parse_voice_command') as parse:
+            response = client.post(url, {"text": "gasté doscientos con tarjeta oro", "session_id": session_id}, format='json')
+        parse.assert_not_called()
+        self.assertEqual(response.data["changed"], [])
+
+        # El estado vive en la base de datos, no en la memoria del worker
+        session = ParseSession.objects.get(user=self.user, session_id=session_id)
+        self.assertEqual(session.text, "gasté doscientos con tarjeta oro")
+        self.assertIn("entity", session.memo)
+
+        # Una sesión vencida vuelve a empezar
+        ParseSession.objects.filter(pk=session.pk).update(updated_at=timezone.now() - timezone.timedelta(hours=1))
+        response = client.post(url, {"text": "gasté doscientos con tarjeta oro", "session_id": session_id}, format='json')
+        self.assertIn("amount", response.data["changed"])
+
+        response = client.post(url, {"text": "gasté doscientos con tarjeta oro", "session_id": session_id, "final": True}, format='json')
+        self.assertFalse(ParseSession.objects.filter(user=self.user).exists())
+        response = client.post(url, {"text": "gasté doscientos con tarjeta oro", "session_id": session_id}, format='json')
+        self.assertIn("amount", response.data["changed"])
+
+    def test_parse_session_scores_only_new_words(self):
+        """Test that a growing transcript does not re-run the fuzzy matcher over its unchanged prefix."""
+        bbva = VisionEntity.objects.create(user=self.user, name="Tarjeta BBVA", type="asset")
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = '/api/wallet/transactions/parse-session/'
+
+        response = client.post(url, {"text": "gasté doscientos en tacos al pastor"}, format='json')
+        session_id = response.data["session_id"]
+
+        with mock.patch('wallet.fuzzy.trigrams', wraps=fuzzy.trigrams) as scored:
+            response = client.post(
+                url, {"text": "gasté doscientos en tacos al pastor con tarjeta bebeva", "session_id": session_id},
+                format='json',
+            )
+        self.assertEqual(response.data["draft"]["relatedEntityId"], bbva.id)
+        windows = [call.args[0] for call in scored.call_args_list]
+        self.assertTrue(windows)
+        for window in windows:
+            self.assertTrue({"con", "tarjeta", "bebeva"} & set(window.split()), window)
+
+
+class GlobalCategoryModelTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            user = User.objects.create_user(username=f'globaluser{i}', password='password')
+            for description, category in [
+                ("Tortas ahogadas", "Comida"),
+                ("Boleto metro", "Transporte"),
+                (f"Regalo para persona{i}", "Regalos"),
+            ]:
+                Transaction.objects.create(
+                    user=user,
+                    amount=Decimal("50.00"),
+                    type="expense",
+                    description=description,
+                    category=category,
+                    date=timezone.now(),
+                )
+        self.new_user = User.objects.create_user(username='newuser', password='password')
+        Category.objects.create(user=self.new_user, name="Comida")
+        Category.objects.create(user=self.new_user, name="Transporte")
+
+        handle, self.path = tempfile.mkstemp(suffix='.bin')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        self.addCleanup(global_model.reset_global_model)
+        _predictor_cache.clear()
+
+    def test_cold_start_prediction_from_global_model(self):
+        """Test that a user without history gets predictions from the shared artifact."""
+        call_command('train_global_category_model', output=self.path, stdout=StringIO())
+
+        model = global_model.load_global_model(self.path)
+        self.assertEqual(model.categories, ["comida", "regalos", "transporte"])
+        self.assertIsNotNone(model.token_counts("tortas"))
+        # Tokens used by a single user are dropped
+        self.assertIsNone(model.token_counts("persona0"))
+
+        global_model.reset_global_model(model)
+        predictor = get_category_predictor(self.new_user)
+        self.assertFalse(predictor.is_trained)
+        self.assertEqual(predictor.predict("Tortas de la esquina"), "Comida")
+        self.assertEqual(predictor.predict("Recarga metro"), "Transporte")
+
+    def test_large_artifact_is_memory_mapped(self):
+        """Test that lookups work the same over a memory-mapped artifact."""
+        call_command('train_global_category_model', output=self.path, stdout=StringIO())
+        threshold = global_model.MMAP_THRESHOLD_BYTES
+        global_model.MMAP_THRESHOLD_BYTES = 0
+        self.addCleanup(setattr, global_model, 'MMAP_THRESHOLD_BYTES', threshold)
+
+        model = global_model.load_global_model(self.path)
+        self.assertNotIsInstance(model._buffer, bytes)
+        self.assertEqual(model.token_counts("metro"), (0, 0, 3))
+
+class ExportTests(TestCase):
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        storage = override_settings(EXPORT_STORAGE={
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': location.name},
+        })
+        storage.enable()
+        self.addCleanup(storage.disable)
+
+        self.user = User.objects.create_user(username='exportuser', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        for day, amount, tx_type, description, category in [
+            (1, "1000.00", "income", "Sueldo", "Ingresos"),
+            (2, "50.00", "expense", "Tacos", "Comida"),
+            (3, "20.50", "expense", "Metro", "Transporte"),
+            (4, "200.00", "income", "Venta", None),
+            (5, "80.00", "expense", "Cine", "Entretenimiento"),
+            (6, "10.00", "transfer", "Ahorro", None),
+        ]:
+            Transaction.objects.create(
+                user=self.user,
+                amount=Decimal(amount),
+                type=tx_type,
+                description=description,
+                category=category,
+                date=timezone.make_aware(timezone.datetime(2024, 3, day, 12, 0)),
+            )
+
+    def test_excel_export_keeps_split_layout(self):
+        """Test that the streaming XLSX export keeps the income/expense split and totals."""
+        response = self.client.get('/api/wallet/transactions/export/excel/')
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content)))
+        sheet = workbook["Transactions"]
+
+        self.assertEqual(sheet["A1"].value, "INGRESOS (INCOME)")
+        self.assertIn("A1:C1", sheet.merged_cells)
+        self.assertEqual([sheet.cell(2, c).value for c in range(1, 8)],
+                         ["Fecha", "Descripción", "Monto", None, "Fecha", "Descripción", "Monto"])
+        # Más reciente primero, como el listado
+        self.assertEqual(sheet["A3"].value, "2024-03-04")
+        self.assertEqual(sheet["B3"].value, "General: Venta")
+        self.assertEqual(sheet["F5"].value, "Comida: Tacos")
+        self.assertIsNone(sheet["A5"].value)
+        self.assertEqual(sheet["C3"].style, "split_amount_income")
+
+        # 3 filas de datos -> totales en la fila 7, balance en la 9
+        self.assertEqual(sheet["A7"].value, "TOTAL INGRESOS")
+        self.assertEqual(sheet["C7"].value, 1200)
+        self.assertEqual(sheet["G7"].value, 150.5)
+        self.assertEqual(sheet["A9"].value, "BALANCE NETO: $1,049.50")
+        self.assertIn("A9:G9", sheet.merged_cells)
+
+    def test_csv_and_ndjson_exports_stream(self):
+        """Test that the flat exports stream every transaction, optionally gzipped."""
+        response = self.client.get('/api/wallet/transactions/export/csv/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:4], ["id", "date", "type", "amount"])
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1][2:4], ["transfer", "10.00"])
+
+        response = self.client.get('/api/wallet/transactions/export/ndjson/?gzip=1')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b"".join(response.streaming_content)).decode()
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[-1]["amount"], "1000.00")
+        self.assertEqual(records[-1]["date"], "2024-03-01T12:00:00+00:00")
+
+    def test_pdf_export_paginates_with_subtotals(self):
+        """Test that the PDF report is built page by page with subtotals and a benchmark command."""
+        response = self.client.get('/api/wallet/transactions/export/pdf/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+
+        with tempfile.TemporaryFile() as output:
+            pages = render_transactions_pdf(Transaction.objects.filter(user=self.user), output, rows_per_page=4)
+        # 6 filas en páginas de 4 -> 2 páginas
+        self.assertEqual(pages, 2)
+
+        # Una descripción de muchas líneas sigue ocupando una sola fila
+        Transaction.objects.filter(user=self.user, description="Cine").update(description="Cine\n" * 200)
+        with tempfile.TemporaryFile() as output:
+            self.assertEqual(render_transactions_pdf(Transaction.objects.filter(user=self.user), output, rows_per_page=4), 2)
+
+        # Lo que no cabe ni en una página vacía falla en lugar de pedir páginas sin fin
+        with tempfile.TemporaryFile() as output:
+            writer = _PageWriter(canvas.Canvas(output), letter)
+            with self.assertRaises(LayoutError):
+                writer.add([Spacer(1, 5000)])
+
+        out = StringIO()
+        call_command('benchmark_pdf_export', rows='50,100', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual([r["rows"] for r in report], [50, 100])
+        # El canvas guarda las páginas terminadas: la memoria crece con las filas
+        self.assertNotIn("peak_memory_bytes_per_row", report[0])
+        self.assertGreater(report[1]["peak_memory_bytes"], report[0]["peak_memory_bytes"])
+        self.assertGreater(report[1]["peak_memory_bytes_per_row"], 0)
+        self.assertFalse(User.objects.filter(username='__pdf_export_benchmark__').exists())
+
+    def test_export_job_lifecycle(self):
+        """Test that an export job is queued, rendered by the worker, downloaded and reused."""
+        payload = {"export_type": "csv", "filters": {"type": "expense", "start_date": "2024-03-03"}}
+        response = self.client.post('/api/wallet/export-jobs/', payload, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.data["reused"])
+        job_id = response.data["id"]
+
+        response = self.client.get(f'/api/wallet/export-jobs/{job_id}/download/')
+        self.assertEqual(response.status_code, 409)
+
+        self.assertEqual(process_export_jobs(), 1)
+        response = self.client.get(f'/api/wallet/export-jobs/{job_id}/')
+        self.assertEqual(response.data["status"], "completed")
+
+        response = self.client.get(f'/api/wallet/export-jobs/{job_id}/download/')
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        # Gastos desde el día 3: Cine y Metro
+        self.assertEqual([row[5] for row in rows[1:]], ["Cine", "Metro"])
+
+        # Mismos filtros en otro orden -> el mismo archivo
+        payload = {"export_type": "csv", "filters": {"start_date": "2024-03-03 ", "type": "expense"}}
+        response = self.client.post('/api/wallet/export-jobs/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["id"], response.data["reused"]), (job_id, True))
+        self.assertEqual(ExportJob.objects.filter(user=self.user).count(), 1)
+
+        response = self.client.post('/api/wallet/export-jobs/', {"export_type": "docx"}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_parquet_export(self):
+        """Test that the Parquet export is a typed columnar file, optionally zipped with vision entities."""
+        response = self.client.get('/api/wallet/transactions/export/parquet/?type=expense')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        body = b"".join(response.streaming_content)
+        self.assertEqual((body[:4], body[-4:]), (b"PAR1", b"PAR1"))
+
+        if importlib.util.find_spec('pyarrow'):
+            import pyarrow.parquet as pq
+            table = pq.read_table(BytesIO(body))
+            self.assertEqual(str(table.schema.field('amount').type), 'decimal128(12, 2)')
+            self.assertEqual(table.column('amount').to_pylist(), [Decimal("80.00"), Decimal("20.50"), Decimal("50.00")])
+            self.assertEqual(table.column('category').to_pylist(), ["Entretenimiento", "Transporte", "Comida"])
+
+        VisionEntity.objects.create(user=self.user, name='BTC', type='asset', amount=Decimal('1500.00'),
+                                    is_crypto=True, crypto_amount=Decimal('0.01234567'))
+        response = self.client.get('/api/wallet/transactions/export/parquet/?include_vision=1')
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['transactions.parquet', 'vision_entities.parquet'])
+        self.assertTrue(all(archive.read(name).startswith(b"PAR1") for name in archive.namelist()))
+
+    def test_bundle_workbook_has_every_sheet(self):
+        """Test that the bundle export writes the four sheets of the workbook in one response."""
+        VisionEntity.objects.create(user=self.user, name='Ahorro', type='asset', amount=Decimal('3000'))
+        VisionEntity.objects.create(user=self.user, name='Tarjeta', type='liability', amount=Decimal('1000'))
+        budget = Budget.objects.create(user=self.user, monthly_income=Decimal('1500'), is_setup=True)
+        FixedExpense.objects.create(budget=budget, name='Súper', amount=Decimal('100'), category='comida')
+
+        response = self.client.get('/api/wallet/transactions/export/bundle/')
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ["Transactions", "Balance Sheet", "Monthly Summary", "Budget vs Actual"])
+
+        balance = workbook["Balance Sheet"]
+        self.assertEqual((balance["A3"].value, balance["D3"].value), ("Ahorro", "Tarjeta"))
+        self.assertEqual(balance["B5"].value, 3000)
+        self.assertEqual(balance["A7"].value, "PATRIMONIO NETO: $2,000.00")
+        self.assertIn("A7:E7", balance.merged_cells)
+
+        summary = [row for row in workbook["Monthly Summary"].iter_rows(min_row=2, values_only=True)]
+        self.assertIn(("2024-03", "Gasto", "Comida", 1, 50), summary)
+        self.assertIn(("2024-03", "Ingreso", "General", 1, 200), summary)
+
+        budget_rows = {row[1]: row[2:] for row in workbook["Budget vs Actual"].iter_rows(min_row=2, values_only=True)}
+        self.assertEqual(budget_rows["Ingresos"], (1500, 1200, -300))
+        self.assertEqual(budget_rows["comida"], (100, 50, 50))
+        self.assertEqual(budget_rows["Otros gastos (sin presupuesto)"], (0, 100.5, -100.5))
+
+        response = self.client.get('/api/wallet/vision/export/excel/')
+        self.assertEqual(openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content))).sheetnames, ["Balance Sheet"])
+
+    def test_repeat_exports_are_served_from_cache(self):
+        """Test that unchanged exports are served from the cache with an ETag and evicted LRU."""
+        first = self.client.get('/api/wallet/transactions/export/excel/?type=income')
+        body = b"".join(first.streaming_content)
+        self.assertEqual(first['X-Export-Cache'], 'miss')
+
+        second = self.client.get('/api/wallet/transactions/export/excel/?type=income&category=')
+        self.assertEqual(second['X-Export-Cache'], 'hit')
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(b"".join(second.streaming_content), body)
+
+        response = self.client.get('/api/wallet/transactions/export/excel/?type=income',
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Editar un movimiento del conjunto cambia la versión de los datos
+        income = Transaction.objects.filter(user=self.user, type='income').first()
+        income.description = 'Sueldo quincenal'
+        income.save()
+        response = self.client.get('/api/wallet/transactions/export/excel/?type=income',
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+        # Otra versión del formato no sirve archivos generados por la anterior
+        with mock.patch.dict('wallet.exporters.TRANSACTION_EXPORT_VERSIONS', {'xlsx': 99}):
+            response = self.client.get('/api/wallet/transactions/export/excel/?type=income')
+        self.assertEqual(response['X-Export-Cache'], 'miss')
+
+        # CSV se envía mientras se genera; la copia se guarda al terminar y al pasar
+        # del límite se descarta lo menos usado, nunca lo que se va a servir
+        with override_settings(EXPORT_CACHE_MAX_BYTES=1):
+            response = self.client.get('/api/wallet/transactions/export/csv/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(ExportCacheEntry.objects.filter(export_type='csv').exists())
+            body = b"".join(response.streaming_content)
+        self.assertEqual(len(list(csv.reader(body.decode().splitlines()))), 7)
+        self.assertEqual(list(ExportCacheEntry.objects.values_list('export_type', flat=True)), ['csv'])
+        response = self.client.get('/api/wallet/transactions/export/csv/')
+        self.assertEqual((response['X-Export-Cache'], b"".join(response.streaming_content)), ('hit', body))
+
+    def test_export_without_writable_storage(self):
+        """Test that exports are still served when the cache storage cannot be written."""
+        with mock.patch('django.core.files.storage.FileSystemStorage.save', side_effect=PermissionError), \
+                self.assertLogs('wallet.export_cache', 'ERROR'):
+            response = self.client.get('/api/wallet/transactions/export/pdf/')
+            self.assertTrue(b"".join(response.streaming_content).startswith(b"%PDF"))
+            response = self.client.get('/api/wallet/transactions/export/ndjson/')
+            self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 6)
+        self.assertFalse(ExportCacheEntry.objects.exists())
+
+    def test_export_storage_must_be_shared_on_vercel(self):
+        """Test that jobs and cached exports refuse the per-instance local disk when a shared storage is required."""
+        with override_settings(EXPORT_STORAGE_MUST_BE_SHARED=True):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.post('/api/wallet/export-jobs/', {"export_type": "csv"}, format='json')
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get('/api/wallet/transactions/export/csv/')
+            self.assertFalse(ExportJob.objects.exists())
+
+            with override_settings(EXPORT_STORAGE={'BACKEND': 'django.core.files.storage.InMemoryStorage'}):
+                response = self.client.post('/api/wallet/export-jobs/', {"export_type": "csv"}, format='json')
+                self.assertEqual(response.status_code, 202)
+
+
+class BackupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='backupuser', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        Category.objects.create(user=self.user, name='Comida')
+        self.card = VisionEntity.objects.create(user=self.user, name='Tarjeta Oro', type='liability', amount=Decimal('0'))
+        self.cash = VisionEntity.objects.create(user=self.user, name='Efectivo', type='asset', amount=Decimal('500'))
+        budget = Budget.objects.create(user=self.user, monthly_income=Decimal('20000'), is_setup=True)
+        FixedExpense.objects.create(budget=budget, name='Renta', amount=Decimal('8000'), category='Vivienda')
+        GamificationStats.objects.create(user=self.user, streak_freezes=1, repaired_days=['2024-03-02'])
+        Transaction.objects.create(user=self.user, amount=Decimal('120.50'), type='expense', description='Tacos',
+                                   category='Comida', related_entity_id=str(self.card.id),
+                                   date=timezone.make_aware(timezone.datetime(2024, 3, 1, 12, 0, 0, 123456)))
+        Transaction.objects.create(user=self.user, amount=Decimal('300'), type='transfer', description='Pago tarjeta',
+                                   related_entity_id=str(self.cash.id), transfer_related_entity_id=str(self.card.id),
+                                   date=timezone.make_aware(timezone.datetime(2024, 3, 2, 9, 0)))
+        self.stamped = timezone.make_aware(timezone.datetime(2024, 3, 1, 12, 5, 0, 654321))
+        Transaction.objects.filter(description='Tacos').update(created_at=self.stamped, updated_at=self.stamped)
+        self.card.refresh_from_db()
+        self.cash.refresh_from_db()
+
+    def test_backup_restores_into_another_account(self):
+        """Test that a backup restores every model with remapped entity references and unchanged balances."""
+        response = self.client.get('/api/wallet/backup/')
+        self.assertEqual(response.status_code, 200)
+        backup = b"".join(response.streaming_content)
+        self.assertEqual(json.loads(gzip.decompress(backup).splitlines()[0])["format"], "flowcash-backup")
+
+        other = User.objects.create_user(username='restored', password='password')
+        counts = restore_backup(other, BytesIO(backup))
+        self.assertEqual(counts["transaction"], 2)
+        self.assertEqual(counts["unlinked_references"], 0)
+
+        card = VisionEntity.objects.get(user=other, name='Tarjeta Oro')
+        cash = VisionEntity.objects.get(user=other, name='Efectivo')
+        self.assertNotEqual(card.id, self.card.id)
+        # Los saldos respaldados ya incluyen los movimientos: no se vuelven a aplicar
+        self.assertEqual((card.amount, cash.amount), (self.card.amount, self.cash.amount))
+
+        tacos = Transaction.objects.get(user=other, description='Tacos')
+        self.assertEqual(tacos.related_entity_id, str(card.id))
+        self.assertEqual(tacos.date, timezone.make_aware(timezone.datetime(2024, 3, 1, 12, 0, 0, 123456)))
+        # created_at/updated_at son los del respaldo, no la hora de la restauración
+        self.assertEqual((tacos.created_at, tacos.updated_at), (self.stamped, self.stamped))
+        self.assertEqual(card.created_at, self.card.created_at)
+        transfer = Transaction.objects.get(user=other, type='transfer')
+        self.assertEqual((transfer.related_entity_id, transfer.transfer_related_entity_id), (str(cash.id), str(card.id)))
+
+        self.assertEqual(other.budget.fixed_expenses.get().name, 'Renta')
+        self.assertEqual(other.gamification_stats.repaired_days, ['2024-03-02'])
+        # Los conteos del predictor se reconstruyen en la primera predicción
+        self.assertFalse(CategoryDocCount.objects.filter(user=other).exists())
+        get_category_predictor(other)
+        self.assertTrue(CategoryDocCount.objects.filter(user=other, category='Comida').exists())
+
+    def test_restore_validates_and_protects_existing_data(self):
+        """Test that restores refuse non-empty accounts unless replacing, and reject broken files atomically."""
+        with tempfile.TemporaryFile() as output:
+            write_backup(self.user, output)
+            output.seek(0)
+            backup = output.read()
+
+        response = self.client.post('/api/wallet/backup/restore/', {"file": BytesIO(backup)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        # Un presupuesto solo también cuenta como datos de la cuenta
+        budget_only = User.objects.create_user(username='budgetonly', password='password')
+        Budget.objects.create(user=budget_only, monthly_income=Decimal('900'))
+        with self.assertRaises(ValueError):
+            restore_backup(budget_only, BytesIO(backup))
+        self.assertEqual(Budget.objects.get(user=budget_only).monthly_income, Decimal('900'))
+
+        Transaction.objects.filter(user=self.user, type='expense').update(description='Editado')
+        truncated = gzip.compress(b"\n".join(gzip.decompress(backup).splitlines()[:-1]))
+        with self.assertRaises(ValueError):
+            restore_backup(self.user, BytesIO(truncated), replace=True)
+        self.assertTrue(Transaction.objects.filter(user=self.user, description='Editado').exists())
+
+        response = self.client.post('/api/wallet/backup/restore/', {"file": BytesIO(backup), "replace": "true"},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        self.assertTrue(Transaction.objects.filter(user=self.user, description='Tacos').exists())
+        self.assertEqual(VisionEntity.objects.filter(user=self.user).count(), 2)
+
+
+class StatementImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importuser', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.debit = VisionEntity.objects.create(user=self.user, name='Débito', type='asset', amount=Decimal('1000'))
+        self.card = VisionEntity.objects.create(user=self.user, name='Tarjeta', type='liability', amount=Decimal('0'))
+        Category.objects.create(user=self.user, name='Comida')
+        Category.objects.create(user=self.user, name='Transporte')
+        for description, category in [("Oxxo Centro", "Comida"), ("Oxxo Reforma", "Comida"), ("Tacos oxxo", "Comida"),
+                                      ("Metro linea 3", "Transporte"), ("Recarga metro", "Transporte")]:
+            Transaction.objects.create(user=self.user, amount=Decimal('80'), type='expense', description=description,
+                                       category=category, date=timezone.now())
+        _predictor_cache.clear()
+
+    def test_csv_statement_import_streams_progress(self):
+        """Test that a CSV statement is imported in chunks with predicted categories and one balance update."""
+        statement = (
+            "Banco Ejemplo;Cuenta 1234\n"
+            "\n"
+            "Fecha;Concepto;Cargo;Abono\n"
+            "05/03/2024;OXXO CENTRO;$80.00;\n"
+            "06/03/2024;Nómina;;\"15,000.00\"\n"
+            "07/03/2024;Farmacia;120.50;\n"
+            "Saldo final;;;\n"
+        ).encode('utf-8')
+        upload = BytesIO(statement)
+        upload.name = 'estado.csv'
+        response = self.client.post('/api/wallet/transactions/import/',
+                                    {"file": upload, "entity_id": str(self.debit.id)}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        summary = events[-1]
+        self.assertTrue(summary["done"])
+        self.assertEqual((summary["imported"], summary["skipped"]), (3, 1))
+        self.assertEqual(summary["errors"][0]["line"], 7)
+        self.assertEqual(summary["expense"], "200.50")
+
+        oxxo = Transaction.objects.get(user=self.user, description='OXXO CENTRO')
+        self.assertEqual((oxxo.type, oxxo.amount, oxxo.category), ('expense', Decimal('80.00'), 'Comida'))
+        self.assertEqual(oxxo.related_entity_id, str(self.debit.id))
+        self.assertEqual(timezone.localtime(oxxo.date).date().isoformat(), '2024-03-05')
+        self.debit.refresh_from_db()
+        self.assertEqual(self.debit.amount, Decimal('15799.50'))
+
+    def test_xlsx_and_ofx_statements_with_profiles(self):
+        """Test that read-only XLSX with a custom profile and OFX statements map amounts and signs."""
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(["Fecha Op", "Detalle", "Importe"])
+        sheet.append([timezone.datetime(2024, 4, 1), "Gasolina", "1.250,00"])
+        sheet.append([timezone.datetime(2024, 4, 2), "Devolución", "-99,90"])
+        output = BytesIO()
+        workbook.save(output)
+        output.seek(0)
+
+        profile = {"date": "fecha op", "description": "Detalle", "amount": "Importe", "decimal": ",", "invert_sign": True}
+        summary = import_statement(self.user, StatementReader(output, None, profile, 'tarjeta.xlsx'), self.card.id)
+        self.assertEqual((summary["imported"], summary["total"]), (2, 2))
+        self.assertEqual(Transaction.objects.get(description='Gasolina').amount, Decimal('1250.00'))
+        self.assertEqual(Transaction.objects.get(description='Devolución').type, 'income')
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.amount, Decimal('1150.10'))
+
+        ofx = (
+            "OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"
+            "<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>20240510120000[-6:CST]\n<TRNAMT>-45.00\n<FITID>1\n<NAME>Uber\n"
+            "<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20240511\n<TRNAMT>500.00\n<FITID>2\n<MEMO>Reembolso\n"
+            "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+        ).encode('utf-8')
+        summary = import_statement(self.user, StatementReader(BytesIO(ofx)))
+        self.assertEqual(summary["imported"], 2)
+        self.assertEqual(Transaction.objects.get(description='Uber').type, 'expense')
+        self.assertEqual(Transaction.objects.get(description='Reembolso').amount, Decimal('500.00'))
+
+    def test_import_rejects_bad_requests(self):
+        """Test that unknown profiles, unmapped files and foreign entities are rejected before importing."""
+        upload = BytesIO(b"Fecha,Concepto,Monto\n2024-03-01,Tacos,-50\n")
+        upload.name = 'a.csv'
+        response = self.client.post('/api/wallet/transactions/import/', {"file": upload, "profile": "nope"},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        upload = BytesIO(b"Dia,Texto\n2024-03-01,Tacos\n")
+        upload.name = 'b.csv'
+        response = self.client.post('/api/wallet/transactions/import/', {"file": upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        other = User.objects.create_user(username='other', password='password')
+        foreign = VisionEntity.objects.create(user=other, name='Ajena', type='asset', amount=Decimal('0'))
+        upload = BytesIO(b"Fecha,Concepto,Monto\n2024-03-01,Tacos,-50\n")
+        upload.name = 'c.csv'
+        response = self.client.post('/api/wallet/transactions/import/',
+                                    {"file": upload, "entity_id": str(foreign.id)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.filter(description='Tacos').exists())
+
+    def test_stopped_import_keeps_committed_chunks(self):
+        """Test that each chunk is committed before it is reported and a re-import skips it."""
+        statement = b"Fecha,Concepto,Monto\n01/03/2024,Pan,-10\n02/03/2024,Leche,-20\n03/03/2024,Huevo,-30\n"
+        events = import_statement_events(self.user, StatementReader(BytesIO(statement), 'csv'), self.debit.id,
+                                         chunk_size=2)
+        savepoints = list(connection.savepoint_ids)
+        self.assertEqual(next(events)["imported"], 2)
+        # Ningún atomic queda abierto mientras se reporta el progreso
+        self.assertEqual(connection.savepoint_ids, savepoints)
+        events.close()  # el cliente se desconecta
+
+        self.debit.refresh_from_db()
+        self.assertEqual(self.debit.amount, Decimal('970'))
+        summary = import_statement(self.user, StatementReader(BytesIO(statement), 'csv'), self.debit.id)
+        self.assertEqual((summary["imported"], summary["duplicates"]), (1, 2))
+        self.debit.refresh_from_db()
+        self.assertEqual(self.debit.amount, Decimal('940'))
+
+    def test_overlapping_statements_and_retries_skip_duplicates(self):
+        """Test that fingerprints skip re-imported rows and retried batches, and flag probable duplicates."""
+        first = b"Fecha,Concepto,Monto\n01/03/2024,Cafe Punta,-45\n02/03/2024,Cine,-120\n"
+        import_statement(self.user, StatementReader(BytesIO(first), 'csv'), self.debit.id)
+        second = (b"Fecha,Concepto,Monto\n01/03/2024,CAFE  PUNTA,-45\n01/03/2024,Cafe Punta,-45\n"
+                  b"03/03/2024,Cinepolis,-120\n")
+        summary = import_statement(self.user, StatementReader(BytesIO(second), 'csv'), self.debit.id)
+        # Un café ya estaba; el segundo igual es otro movimiento, y "Cinepolis" se parece a "Cine"
+        self.assertEqual((summary["imported"], summary["duplicates"]), (2, 1))
+        cine = Transaction.objects.get(user=self.user, description='Cine')
+        self.assertEqual(summary["probable_duplicates"], [{"line": 4, "transaction_id": cine.id}])
+        self.assertEqual(Transaction.objects.filter(user=self.user, description__iexact='cafe punta').count(), 2)
+        self.debit.refresh_from_db()
+        self.assertEqual(self.debit.amount, Decimal('1000') - Decimal('45') * 2 - Decimal('240'))
+
+        batch = [{"amount": "99.00", "type": "expense", "description": "Libros", "date": "2024-03-04T10:00:00Z"}]
+        response = self.client.post('/api/wallet/transactions/batch_create/', batch, format='json')
+        self.assertEqual(response.status_code, 201)
+        retry = self.client.post('/api/wallet/transactions/batch_create/', batch, format='json')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry["X-Duplicate-Count"], "1")
+        self.assertEqual(retry.data[0]["id"], response.data[0]["id"])
+        self.assertEqual(Transaction.objects.filter(user=self.user, description='Libros').count(), 1)
+        self.assertIsNotNone(Transaction.objects.get(description='Libros').fingerprint)
+
+        # Pasada la ventana de reintento es otra compra igual: se crea y se reporta
+        Transaction.objects.filter(description='Libros').update(created_at=timezone.now() - timezone.timedelta(hours=1))
+        later = self.client.post('/api/wallet/transactions/batch_create/', batch * 2, format='json')
+        self.assertEqual(later.status_code, 201)
+        self.assertEqual((later["X-Duplicate-Count"], later["X-Probable-Duplicates"]), ("0", "0"))
+        self.assertEqual(Transaction.objects.filter(user=self.user, description='Libros').count(), 3)
+
+
+class FakeFirestoreDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeFirestoreQuery:
+    """The subset of google.cloud.firestore queries the migration uses."""
+
+    def __init__(self, client, name, field=None, value=None, limit=None, after=None):
+        self.client, self.name, self.field, self.value = client, name, field, value
+        self._limit, self._after = limit, after
+
+    def where(self, field, op, value):
+        return FakeFirestoreQuery(self.client, self.name, field, value, self._limit, self._after)
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, count):
+        return FakeFirestoreQuery(self.client, self.name, self.field, self.value, count, self._after)
+
+    def start_after(self, doc):
+        return FakeFirestoreQuery(self.client, self.name, self.field, self.value, self._limit, doc.id)
+
+    def document(self, doc_id):
+        query = self
+
+        class Ref:
+            def get(self):
+                return FakeFirestoreDoc(doc_id, query.client.collections.get(query.name, {}).get(doc_id))
+        return Ref()
+
+    def stream(self):
+        self.client.requests.append((self.name, self.field))
+        docs = sorted(self.client.collections.get(self.name, {}).items())
+        docs = [FakeFirestoreDoc(doc_id, data) for doc_id, data in docs
+                if data.get(self.field) == self.value and (self._after is None or doc_id > self._after)]
+        return iter(docs[:self._limit])
+
+
+class FakeFirestore:
+    def __init__(self, collections):
+        self.collections = collections
+        self.requests = []
+
+    def collection(self, name):
+        return FakeFirestoreQuery(self, name)
+
+
+class FirebaseMigrationTests(TestCase):
+    def setUp(self):
+        self.ana = User.objects.create_user(username='ana', email='ana@example.com', password='password')
+        self.luis = User.objects.create_user(username='luis', email='Luis@example.com', password='password')
+        self.firestore = FakeFirestore({
+            'categories': {'c1': {'uid': 'fb-ana', 'name': 'Comida'}, 'c2': {'uid': 'fb-luis', 'name': 'Renta'}},
+            'vision': {'v1': {'uid': 'fb-ana', 'name': 'Nu', 'type': 'liability', 'amount': 1500,
+                              'isCreditCard': True}},
+            'Transactions': {
+                f't{i}': {'userId': 'fb-ana', 'description': f'Compra {i}', 'amount': 10 + i, 'type': 'expense',
+                          'category': 'Super' if i % 2 else 'Comida', 'date': 1709294400000 + i * 3600000,
+                          'relatedEntityId': 'v1'}
+                for i in range(5)
+            },
+            'subscriptions': {'s1': {'uid': 'fb-luis', 'name': 'Netflix', 'amount': 199, 'frequency': 'monthly',
+                                     'nextPaymentDate': '2024-04-10T12:00:00+00:00'}},
+            'budgets': {'fb-ana': {'monthlyIncome': 30000, 'isSetup': True,
+                                   'fixedExpenses': [{'name': 'Renta', 'amount': 9000, 'category': 'Vivienda'}]}},
+        })
+        self.lookups = []
+
+    def lookup(self, emails):
+        self.lookups.append(emails)
+        return {'ana@example.com': 'fb-ana', 'luis@example.com': 'fb-luis'}
+
+    def test_migrates_users_with_paging_and_cached_fields(self):
+        """Test that users are migrated with cursor paging, one uid lookup and the learned uid fields."""
+        migration = FirestoreMigration(self.firestore, self.lookup, workers=1, page_size=2)
+        results = migration.run(User.objects.order_by('pk'))
+
+        self.assertEqual([status for _, status, _ in results], ['completed', 'completed'])
+        self.assertEqual(len(self.lookups), 1)
+        self.assertEqual(results[0][2]['transactions'], 5)
+        # 5 documentos en páginas de 2: tres consultas con cursor
+        self.assertEqual(self.firestore.requests.count(('Transactions', 'userId')), 3 + 1)
+        self.assertEqual(migration.user_fields['Transactions'], 'userId')
+        # Ya aprendido, el segundo usuario prueba 'userId' antes que los demás campos
+        luis_start = len(self.firestore.requests) - self.firestore.requests[::-1].index(('categories', 'uid')) - 1
+        luis_requests = [field for name, field in self.firestore.requests[luis_start:] if name == 'Transactions']
+        self.assertEqual(luis_requests, ['userId', 'uid', 'user_id'])
+
+        card = VisionEntity.objects.get(user=self.ana, name='Nu')
+        self.assertEqual(card.amount, Decimal('1500.00'))
+        self.assertEqual(Transaction.objects.filter(user=self.ana, related_entity_id=str(card.id)).count(), 5)
+        self.assertEqual(set(Category.objects.filter(user=self.ana).values_list('name', flat=True)), {'Comida', 'Super'})
+        self.assertEqual(self.ana.budget.fixed_expenses.get().amount, Decimal('9000.00'))
+
+        netflix = Transaction.objects.get(user=self.luis, description='Netflix')
+        self.assertTrue(netflix.is_recurring)
+        self.assertEqual(netflix.date.date().isoformat(), '2024-03-10')
+
+    def test_learned_uid_field_falls_back_for_other_users(self):
+        """Test that a user whose documents use another uid field than the learned one is still migrated."""
+        self.firestore.collections['Transactions']['t7'] = {
+            'user_id': 'fb-luis', 'description': 'Gasolina', 'amount': 500, 'type': 'expense',
+            'date': '2024-03-05T12:00:00+00:00',
+        }
+        migration = FirestoreMigration(self.firestore, self.lookup, workers=1, page_size=2)
+        results = migration.run(User.objects.order_by('pk'))
+
+        self.assertEqual(results[0][2]['transactions'], 5)
+        self.assertEqual(results[1][2]['transactions'], 1)
+        self.assertTrue(Transaction.objects.filter(user=self.luis, description='Gasolina').exists())
+        self.assertEqual(migration.user_fields['Transactions'], 'user_id')
+
+    def test_checkpoints_make_reruns_resumable(self):
+        """Test that completed users are skipped, failed ones retried and forced re-runs add no duplicates."""
+        self.firestore.collections['Transactions']['t9'] = {'userId': 'fb-ana', 'amount': 'n/a', 'date': {}}
+        original = FirestoreMigration._migrate_entities
+
+        def failing(migration, user, uid, counts):
+            if user == self.ana:
+                raise RuntimeError('Firestore unavailable')
+            return original(migration, user, uid, counts)
+
+        migration = FirestoreMigration(self.firestore, self.lookup, workers=1, page_size=2)
+        FirestoreMigration._migrate_entities = failing
+        try:
+            migration.run(User.objects.all())
+        finally:
+            FirestoreMigration._migrate_entities = original
+        self.assertEqual(self.ana.firebase_migration.status, 'failed')
+        self.assertIn('Firestore unavailable', self.ana.firebase_migration.error)
+        self.assertFalse(Category.objects.filter(user=self.ana).exists())
+
+        results = migration.run(User.objects.all())
+        self.assertEqual([user for user, _, _ in results], [self.ana])
+        self.assertEqual(FirebaseMigrationCheckpoint.objects.filter(status='completed').count(), 2)
+        self.assertEqual(Transaction.objects.filter(user=self.ana).count(), 6)
+
+        results = migration.run(User.objects.filter(pk=self.ana.pk), force=True)
+        self.assertEqual(results[0][2]['transactions'], 0)
+        self.assertEqual(results[0][2]['duplicates'], 6)
+        self.assertEqual(Transaction.objects.filter(user=self.ana).count(), 6)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TransactionViewSet, BudgetViewSet, CategoryViewSet, VisionEntityViewSet, GamificationStatsViewSet, AnalyticsViewSet, CronViewSet, DevicePushTokenViewSet, PushViewSet
+from .views import TransactionViewSet, BudgetViewSet, CategoryViewSet, VisionEntityViewSet, GamificationStatsViewSet, AnalyticsViewSet, CronViewSet, DevicePushTokenViewSet, PushViewSet, ExportJobViewSet, BackupViewSet
 
 router = DefaultRouter()
 router.register(r'transactions', TransactionViewSet, basename='transaction')
@@ -12,6 +12,8 @@ router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 router.register(r'cron', CronViewSet, basename='cron')
 router.register(r'push-tokens', DevicePushTokenViewSet, basename='push-token')
 router.register(r'push', PushViewSet, basename='push')
+router.register(r'export-jobs', ExportJobViewSet, basename='export-job')
+router.register(r'backup', BackupViewSet, basename='backup')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -2,19 +2,26 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from decimal import Decimal
-from .models import Transaction, Budget, Category, VisionEntity, GamificationStats, DevicePushToken
-from .serializers import TransactionSerializer, BudgetSerializer, CategorySerializer, VisionEntitySerializer, GamificationStatsSerializer, DevicePushTokenSerializer
-from .ml import predict_category_for_user
-from .nlp import parse_voice_command
+from datetime import timedelta
+from .models import Transaction, Budget, Category, VisionEntity, GamificationStats, DevicePushToken, ExportJob
+from .serializers import TransactionSerializer, BudgetSerializer, CategorySerializer, VisionEntitySerializer, GamificationStatsSerializer, DevicePushTokenSerializer, ExportJobSerializer
+from .ml import predict_category_for_user, predict_categories_for_user, explain_category_for_user
+from .nlp import parse_voice_command, parse_notification_batch, update_parse_session
 from .analytics import predict_runway
 from .recurrence import process_recurring_transactions
+from .export_jobs import enqueue_export_job, filter_transactions, get_export_storage, normalize_transaction_filters
 from django.utils import timezone
 from django.conf import settings
+from django.db import transaction as db_transaction
+from django.http import FileResponse, StreamingHttpResponse
 import os
 import json
 import urllib.request
 import urllib.error
 
+def _wants_gzip(request):
+    return request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
 class CronViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny] # Secured by header check manually
     authentication_classes = []  # Avoid JWT auth treating CRON_SECRET as an access token
@@ -158,11 +165,25 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def predict(self, request):
         """
         Endpoint to predict category based on description.
-        Body: { "description": "Starbucks" }
+        Body: { "description": "Starbucks", "top_k": 3 }
+        With "top_k", the response also includes the matching strategy, the
+        confidence of the prediction and the k most likely categories.
         """
         description = request.data.get('description', '')
         if not description:
             return Response({"error": "Description is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        top_k = request.data.get('top_k')
+        if top_k is not None:
+            try:
+                top_k = min(max(int(top_k), 1), 20)
+            except (TypeError, ValueError):
+                return Response({"error": "top_k must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                "description": description,
+                **explain_category_for_user(request.user, description, top_k),
+            })
         
         predicted_category = predict_category_for_user(request.user, description)
         
@@ -171,6 +192,28 @@ class CategoryViewSet(viewsets.ModelViewSet):
             "predicted_category": predicted_category
         })
     
+    @action(detail=False, methods=['post'], url_path='predict-batch')
+    def predict_batch(self, request):
+        """
+        Predicts categories for many descriptions with a single model load.
+        Body: { "descriptions": ["Starbucks", "Uber", ...] }
+        Predictions are returned in the same order.
+        """
+        descriptions = request.data.get('descriptions')
+        if not isinstance(descriptions, list):
+            return Response({"error": "descriptions must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(descriptions) > 5000:
+            return Response({"error": "At most 5000 descriptions per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        predictions = predict_categories_for_user(request.user, descriptions)
+
+        return Response({
+            "predictions": [
+                {"description": description, "predicted_category": predicted_category}
+                for description, predicted_category in zip(descriptions, predictions)
+            ]
+        })
+
     @action(detail=False, methods=['post'])
     def batch_create(self, request):
         # We need to manually inject the user into the data for validation if using many=True
@@ -267,15 +310,28 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Transaction.objects.filter(user=self.request.user).order_by('-date')
 
+    def filter_queryset(self, queryset):
+        # ?type=&category=&related_entity_id=&start_date=&end_date= for the exports
+        queryset = super().filter_queryset(queryset)
+        if (self.action or '').startswith('export_'):
+            queryset = filter_transactions(queryset, normalize_transaction_filters(self.request.query_params))
+        return queryset
+
+    def _cached_export(self, request, export_type, filename, compress=False):
+        # Repeat downloads of unchanged data are served from the export cache with an ETag
+        from .export_cache import cached_export_response
+        filters = normalize_transaction_filters(request.query_params)
+        queryset = self.filter_queryset(self.get_queryset())
+        stamp = timezone.now().strftime("%Y%m%d")
+        return cached_export_response(request, queryset, export_type, filters, filename.format(stamp), compress)
+
     @action(detail=False, methods=['get'], url_path='export/excel')
     def export_excel(self, request):
         """
         Exports filtered transactions to Excel.
         Supports standard list filters (date, category, etc.)
         """
-        queryset = self.filter_queryset(self.get_queryset())
-        from .exporters import export_transactions_to_excel
-        return export_transactions_to_excel(queryset)
+        return self._cached_export(request, 'xlsx', 'transactions_split_{}.xlsx')
 
     @action(detail=False, methods=['get'], url_path='export/pdf')
     def export_pdf(self, request):
@@ -283,9 +339,133 @@ class TransactionViewSet(viewsets.ModelViewSet):
         Exports filtered transactions to PDF.
         Supports standard list filters.
         """
+        return self._cached_export(request, 'pdf', 'transactions_{}.pdf')
+
+    @action(detail=False, methods=['get'], url_path='export/csv')
+    def export_csv(self, request):
+        """
+        Streams filtered transactions as CSV.
+        Supports standard list filters; ?gzip=1 compresses the stream.
+        """
+        return self._cached_export(request, 'csv', 'transactions_{}.csv', _wants_gzip(request))
+
+    @action(detail=False, methods=['get'], url_path='export/ndjson')
+    def export_ndjson(self, request):
+        """
+        Streams filtered transactions as NDJSON, one object per line.
+        Supports standard list filters; ?gzip=1 compresses the stream.
+        """
+        return self._cached_export(request, 'ndjson', 'transactions_{}.ndjson', _wants_gzip(request))
+
+    @action(detail=False, methods=['get'], url_path='export/bundle')
+    def export_bundle(self, request):
+        """
+        Exports one workbook with the filtered transactions, the balance
+        sheet, a monthly summary by category and budget vs actual.
+        Supports standard list filters (they apply to the transaction sheets).
+        """
+        from .exporters import export_workbook_bundle
         queryset = self.filter_queryset(self.get_queryset())
-        from .exporters import export_transactions_to_pdf
-        return export_transactions_to_pdf(queryset)
+        entities = VisionEntity.objects.filter(user=request.user).order_by('-amount')
+        budget = Budget.objects.filter(user=request.user).first()
+        return export_workbook_bundle(queryset, entities, budget)
+
+    @action(detail=False, methods=['get'], url_path='export/parquet')
+    def export_parquet(self, request):
+        """
+        Exports filtered transactions as a Parquet file (typed decimals and
+        timestamps, dictionary-encoded categories) for pandas / DuckDB.
+        Supports standard list filters; ?include_vision=1 returns a zip that
+        also holds the vision entities.
+        """
+        if request.query_params.get('include_vision', '').lower() in ('1', 'true', 'yes'):
+            from .exporters import export_transactions_to_parquet_archive
+            queryset = self.filter_queryset(self.get_queryset())
+            entities = VisionEntity.objects.filter(user=request.user)
+            return export_transactions_to_parquet_archive(queryset, entities)
+        return self._cached_export(request, 'parquet', 'transactions_{}.parquet')
+
+    @action(detail=False, methods=['post'])
+    def batch_create(self, request):
+        """
+        Creates several transactions in one database transaction, so their
+        balance effects are merged and applied once per entity on commit.
+        Body: [{ "amount": "100.00", "type": "expense", ... }, ...]
+
+        An item matching the fingerprint of a transaction stored less than
+        RETRY_WINDOW_SECONDS ago is taken for a retried request: the stored
+        one is returned in its place and X-Duplicate-Count tells how many.
+        Other matches (the same purchase made again later that day) are
+        created, and their positions in the body are listed in
+        X-Probable-Duplicates so the app can ask the user.
+        """
+        from .fingerprints import RETRY_WINDOW_SECONDS, classify_duplicates
+        data = request.data
+        if not isinstance(data, list):
+            return Response({"detail": "Expected a list of items"}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data
+        retry_since = timezone.now() - timedelta(seconds=RETRY_WINDOW_SECONDS)
+        with db_transaction.atomic():
+            statuses = classify_duplicates(request.user, [Transaction(**item) for item in items])
+            stored = Transaction.objects.in_bulk([pk for kind, pk in statuses if kind == 'duplicate'])
+            transactions, retried, probable = [], 0, []
+            for index, (item, (kind, pk)) in enumerate(zip(items, statuses)):
+                if kind == 'duplicate' and stored[pk].created_at >= retry_since:
+                    transactions.append(stored[pk])
+                    retried += 1
+                    continue
+                if kind != 'new':
+                    probable.append(index)
+                transactions.append(serializer.child.create(item))
+
+        response = Response(
+            self.get_serializer(transactions, many=True).data,
+            status=status.HTTP_200_OK if items and retried == len(items) else status.HTTP_201_CREATED,
+        )
+        response['X-Duplicate-Count'] = str(retried)
+        response['X-Probable-Duplicates'] = ','.join(str(index) for index in probable)
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_statement(self, request):
+        """
+        Imports a bank statement (XLSX, CSV or OFX) sent as a multipart "file".
+        Optional fields: "format" (guessed from the file otherwise), "profile"
+        (a profile name or a JSON column mapping, see `importers`) and
+        "entity_id" (the account the statement belongs to).
+        Streams NDJSON progress: {"processed", "imported", "skipped", "total"}
+        after each chunk (committed before it is reported), then the summary
+        with "done": true and the row errors.
+        """
+        from .importers import StatementReader, import_statement_events
+        statement = request.FILES.get('file')
+        if statement is None:
+            return Response({"detail": "Expected a statement file in 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        profile = request.data.get('profile') or None
+        if isinstance(profile, str) and profile.lstrip().startswith('{'):
+            try:
+                profile = json.loads(profile)
+            except json.JSONDecodeError:
+                return Response({"detail": "profile is not valid JSON"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            reader = StatementReader(statement, request.data.get('format') or None, profile, statement.name)
+            events = import_statement_events(request.user, reader, request.data.get('entity_id'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def lines():
+            try:
+                for event in events:
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                # The chunks already reported stay imported; sending the statement again skips them
+                yield json.dumps({"done": False, "error": str(e)}) + "\n"
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
 
     @action(detail=False, methods=['post'], url_path='parse-command')
     def parse_command(self, request):
@@ -303,6 +483,123 @@ class TransactionViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='parse-session')
+    def parse_session(self, request):
+        """
+        Incremental parsing of a live transcript.
+        Body: { "text": "gasté doscientos en", "session_id": "...", "final": false }
+        Omit session_id on the first call and send back the returned one with
+        each longer transcript. Sessions expire after a short idle time;
+        "final": true closes it.
+        """
+        text = request.data.get('text', '')
+        if not text:
+            return Response({"error": "Text is required"}, status=status.HTTP_400_BAD_REQUEST)
+        session_id = request.data.get('session_id') or None
+        if session_id is not None and (not isinstance(session_id, str) or len(session_id) > 64):
+            return Response({"error": "Invalid session_id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        session_id, draft, changed = update_parse_session(
+            request.user, text, session_id=session_id, final=bool(request.data.get('final')),
+        )
+        return Response({
+            "session_id": session_id,
+            "draft": draft,
+            "changed": changed,
+        })
+
+    @action(detail=False, methods=['post'], url_path='parse-batch')
+    def parse_batch(self, request):
+        """
+        Parses many pasted bank notifications or commands at once.
+        Body: { "text": "one per line..." } or { "lines": ["...", "..."] }
+        Streams one JSON object per non-empty line (NDJSON) as it is parsed;
+        each carries the line's "index" and, on failure, an "error".
+        """
+        lines = request.data.get('lines')
+        if lines is None:
+            lines = (request.data.get('text') or '').splitlines()
+        if not isinstance(lines, list) or not any(isinstance(line, str) and line.strip() for line in lines):
+            return Response({"error": "text or lines is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(lines) > 1000:
+            return Response({"error": "At most 1000 lines per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = parse_notification_batch([line if isinstance(line, str) else '' for line in lines], request.user)
+        return StreamingHttpResponse(
+            (json.dumps(result, ensure_ascii=False) + "\n" for result in results),
+            content_type='application/x-ndjson',
+        )
+
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Exports rendered in the background by `run_export_worker`:
+    POST {"export_type": "xlsx"|"pdf"|"csv"|"ndjson"|"parquet", "filters": {...}} queues
+    one (or returns a recent identical one), GET polls it and
+    GET .../download/ fetches the file once it is completed.
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user).order_by('-created_at')
+
+    def create(self, request):
+        filters = request.data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return Response({"detail": "filters must be an object"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            job, reused = enqueue_export_job(request.user, request.data.get('export_type'), filters)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = dict(self.get_serializer(job).data, reused=reused)
+        return Response(data, status=status.HTTP_200_OK if job.status == 'completed' else status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'completed':
+            return Response({"detail": f"Export is {job.status}", "status": job.status}, status=status.HTTP_409_CONFLICT)
+
+        storage = get_export_storage()
+        if not storage.exists(job.file_name):
+            return Response({"detail": "Export file expired"}, status=status.HTTP_410_GONE)
+
+        from .exporters import TRANSACTION_EXPORT_FORMATS
+        _, content_type, extension = TRANSACTION_EXPORT_FORMATS[job.export_type]
+        filename = f"transactions_{job.created_at.strftime('%Y%m%d_%H%M%S')}.{extension}"
+        return FileResponse(storage.open(job.file_name, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
+
+class BackupViewSet(viewsets.ViewSet):
+    """
+    GET streams the user's full backup (gzip-compressed JSON lines);
+    POST restore/ with a multipart "file" restores one (replace=true to
+    overwrite an account that already has data).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        from .backup import backup_chunks
+        response = StreamingHttpResponse(backup_chunks(request.user), content_type='application/gzip')
+        response['Content-Disposition'] = (
+            f'attachment; filename=flowcash_backup_{timezone.now().strftime("%Y%m%d")}.jsonl.gz'
+        )
+        return response
+
+    @action(detail=False, methods=['post'])
+    def restore(self, request):
+        from .backup import restore_backup
+        backup = request.FILES.get('file')
+        if backup is None:
+            return Response({"detail": "Expected a backup file in 'file'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        replace = str(request.data.get('replace', '')).lower() in ('1', 'true', 'yes')
+        try:
+            counts = restore_backup(request.user, backup, replace=replace)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"status": "restored", "counts": counts})
+
 class BudgetViewSet(viewsets.ModelViewSet):
     serializer_class = BudgetSerializer
     permission_classes = [permissions.IsAuthenticated]